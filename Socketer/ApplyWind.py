@@ -1,91 +1,842 @@
 # -*- encoding: UTF-8 -*-
 import datetime
-import json
+import itertools
+import time
 
+from array import array
+from collections import OrderedDict
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError, as_completed
+from queue import Queue
+from threading import Lock, Thread
+
+from Socketer.AsyncServer import AsyncSocketServer
+from Socketer.Cache import SingleFlight, WSDCache, WSDData, to_date
+from Socketer.DiskCache import WSDDiskCache
+from Socketer.Engine import EngineManager, EngineUnavailable
 from Socketer.Client import SocketClient
+from Socketer.Reactor import ReactorSocketServer
+from Socketer.Scheduler import PRIORITIES, RateLimiter, Scheduler
+from Socketer.Serializer import SERIALIZERS, TEXT, format_dates, loads, negotiate, offer, parse_dates, parse_days
 from Socketer.Server import SocketServer, SocketMessage
+from Socketer.Subscription import SubscriptionHub, make_keys
+from Socketer.WireFormat import NAN, encode_wsd, decode_wsd, days_to_dates, numpy
 
 
 class WindStatusCode:
     STATUS_SUCCESS = 0
     STATUS_ARGS_ERROR = -100
+    STATUS_BUSY = -200
+    STATUS_ENGINE_ERROR = -300
+    STATUS_RATE_LIMITED = -400
+    STATUS_DEADLINE_EXCEEDED = -500
     STATUS_FUNC_ERROR = -999
 
 
-class ComplexEncoder(json.JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, datetime.datetime):
-            return obj.strftime('%Y%m%d')
-        elif isinstance(obj, datetime.date):
-            return obj.strftime('%Y%m%d')
-        else:
-            return json.JSONEncoder.default(self, obj)
+class WSDRes(object):
+    """
+    Compact wsd result.
 
+    Numeric Data is kept in one flat array('d') (or the numpy array of a binary frame) and Times in
+    their wire form; Times / Data are materialized as lists, as WindPy returns them, on first access.
+    to_numpy / data_array / to_pandas share memory with the backing buffer instead.
+    """
+    __slots__ = ('ErrorCode', 'Codes', 'Fields', '__raw_times__', '__times__', '__values__', '__rows__', '__data__')
 
-class WSDRes(object):
     def __init__(self, response: dict):
         self.ErrorCode = response['ErrorCode']
         self.Codes = response['Codes']
         self.Fields = response['Fields']
-        self.Times = [datetime.datetime.strptime(var, '%Y%m%d').date() for var in response['Times']]
-        self.Data = response['Data']
+        self.__raw_times__ = response['Times']
+        self.__times__ = None
+        self.__rows__ = len(response['Data'])
+        self.__data__ = None
+        try:
+            self.__values__ = array('d', itertools.chain.from_iterable(response['Data']))
+        except TypeError:
+            # orjson 将 NaN 写为 null，其余含字符串等的非数值结果保持原样
+            try:
+                self.__values__ = array('d', (NAN if var is None else var
+                                              for var in itertools.chain.from_iterable(response['Data'])))
+            except TypeError:
+                self.__values__ = response['Data']
+
+    @classmethod
+    def from_binary(cls, meta: dict, times, data):
+        """ 由二进制帧构造，不复制接收缓冲区 """
+        res = cls.__new__(cls)
+        res.ErrorCode = meta['ErrorCode']
+        res.Codes = meta['Codes']
+        res.Fields = meta['Fields']
+        res.__raw_times__ = times
+        res.__times__ = None
+        res.__rows__ = meta['rows']
+        res.__values__ = data
+        res.__data__ = None
+        return res
+
+    @property
+    def Times(self):
+        if self.__times__ is None:
+            raw_times = self.__raw_times__
+            if numpy is not None and isinstance(raw_times, numpy.ndarray):
+                self.__times__ = raw_times.tolist()
+            elif isinstance(raw_times, array):
+                self.__times__ = days_to_dates(raw_times)
+            else:
+                self.__times__ = parse_dates(raw_times)
+        return self.__times__
+
+    @property
+    def Data(self):
+        """ rows x times 的 list，首次访问时由底层缓冲区生成 """
+        if self.__data__ is None:
+            values = self.__values__
+            if numpy is not None and isinstance(values, numpy.ndarray):
+                self.__data__ = values.tolist()
+            elif isinstance(values, array):
+                n_times = len(values) // self.__rows__ if self.__rows__ > 0 else 0
+                view = memoryview(values)
+                self.__data__ = [view[i * n_times:(i + 1) * n_times].tolist() for i in range(self.__rows__)]
+            else:
+                self.__data__ = values
+        return self.__data__
+
+    @property
+    def times_array(self):
+        """ datetime64[D] 数组 """
+        if numpy is None:
+            raise ImportError('numpy is required for times_array.')
+        raw_times = self.__raw_times__
+        if isinstance(raw_times, numpy.ndarray):
+            return raw_times
+        elif isinstance(raw_times, array):
+            return numpy.frombuffer(raw_times, dtype='i8').view('datetime64[D]')
+        else:
+            return parse_days(raw_times)
+
+    def to_numpy(self):
+        """ rows x times 的 numpy 数组，数值结果不复制数据 """
+        if numpy is None:
+            raise ImportError('numpy is required for to_numpy.')
+        values = self.__values__
+        if isinstance(values, numpy.ndarray):
+            return values
+        elif isinstance(values, array):
+            return numpy.frombuffer(values, dtype='f8').reshape(self.__rows__, -1)
+        else:
+            return numpy.array(values, dtype=object)
+
+    @property
+    def data_array(self):
+        return self.to_numpy()
+
+    def to_pandas(self):
+        """ index 为日期，columns 为 Codes（多代码）或 Fields """
+        import pandas
+        columns = self.Codes if len(self.Codes) > 1 else self.Fields
+        return pandas.DataFrame(self.to_numpy().T, index=pandas.DatetimeIndex(self.times_array),
+                                columns=columns, copy=False)
 
 
 class WindClient(SocketClient, WindStatusCode):
-    def __init__(self, host: str, port: int = 33331, **kwargs):
+    """
+    Every request is tagged with an id which the server echoes back, so many wsd calls can be
+    pipelined over one connection. Use wsd_async for a concurrent.futures.Future
+    (asyncio.wrap_future(client.wsd_async(...)) inside a coroutine) or wsd_many for a list of queries.
+    """
+
+    ENCODINGS = ('binary', 'json')
+
+    def __init__(self, host: str, port: int = 33331, encoding: str = 'binary', priority: str = None,
+                 serializer=True, **kwargs):
+        if encoding not in self.ENCODINGS:
+            raise ValueError('param encoding should be in {} but got {}.'.format(self.ENCODINGS, encoding))
+        if priority is not None:
+            Scheduler.check_priority(priority)
         SocketClient.__init__(self, host=host, port=port, **kwargs)
+        self.priority = priority
+        # 协商前以 JSON 文本发送，服务器总能读取
+        self.serializer = TEXT
+        self.__serializer_offer__ = offer(serializer)
+        self.encoding = 'json'
+        self.__preferred_encoding__ = encoding
+        self.__request_id__ = itertools.count(1)
+        self.__pending__ = OrderedDict()
+        self.__pending_lock__ = Lock()
+        self.__subscriptions__ = list()
 
-    def wsd(self, codes: str, fields: str, start_date: datetime.date, end_date: datetime.date, options: str = ''):
-        self.msg_lock.acquire()
-        # self.msg_lock.locked()
-        self.msg_out.put(json.dumps({
-            'func': 'wsd',
-            'args': (codes, fields, start_date, end_date, options)
-        }, cls=ComplexEncoder))
-        res = json.loads(self.msg_in.get())
-        self.msg_lock.release()
-        if res['status'] == self.STATUS_SUCCESS:
-            return WSDRes(res)
-        else:
-            self.__process_error__(res)
+        self.__dispatch_thread__ = None
+
+    def __dispatch_msg__(self):
+        """ 将服务器返回按 id 分发给等待的 Future """
+        while True:
+            msg = self.msg_in.get()
+            if msg is None:
+                break
+            if isinstance(msg, bytes) and self.serializer.binary is False:
+                res, times, data = decode_wsd(msg)
+            else:
+                res, times, data = loads(msg, self.serializer), None, None
+                if 'wire' in res:
+                    res, times, data = decode_wsd(res['wire'])
+            if res.get('push', None) is not None:
+                self.__on_push__(res)
+                continue
+            with self.__pending_lock__:
+                if res.get('id', None) is not None and res.get('last', True) is False:
+                    waiting = self.__pending__.get(res['id'], None)
+                elif res.get('id', None) is not None:
+                    waiting = self.__pending__.pop(res['id'], None)
+                elif len(self.__pending__) > 0:
+                    waiting = self.__pending__.popitem(last=False)[1]
+                else:
+                    waiting = None
+            if waiting is None:
+                self.log.warning('response without waiting request: {}'.format(msg))
+                continue
+            future, parser = waiting
+            try:
+                if res['status'] == self.STATUS_SUCCESS and times is not None:
+                    result = WSDRes.from_binary(res, times, data)
+                elif res['status'] == self.STATUS_SUCCESS:
+                    result = parser(res)
+                else:
+                    self.__process_error__(res)
+            except Exception as e:
+                result = e
+            if isinstance(future, Queue):
+                # 分块返回，最后一块之后放入 None
+                future.put(result)
+                if res.get('last', True) is True or isinstance(result, Exception):
+                    future.put(None)
+            elif isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def __send__(self, func: str, args, parser=WSDRes, **extra):
+        """ 登记并发送请求，返回 (request_id, future)，extra 中不为 None 的项（如 priority / timeout）随请求发送 """
+        future = Future()
+        with self.__pending_lock__:
+            request_id = next(self.__request_id__)
+            self.__pending__[request_id] = (future, parser)
+        msg = {'id': request_id, 'func': func, 'args': args}
+        msg.update({key: value for key, value in extra.items() if value is not None})
+        self.msg_out.put(self.serializer.dumps(msg))
+        return request_id, future
+
+    def __request__(self, func: str, args, parser=WSDRes, **extra):
+        return self.__send__(func, args, parser, **extra)[1]
+
+    def __result__(self, func: str, args, wait: float = None, parser=WSDRes, **extra):
+        """ 发送请求并最多等待 wait 秒，超时时撤销登记，迟到的回复不会交给其他请求 """
+        request_id, future = self.__send__(func, args, parser, **extra)
+        try:
+            return future.result(wait)
+        except FutureTimeoutError:
+            with self.__pending_lock__:
+                waiting = self.__pending__.pop(request_id, None)
+            # 分发线程已取走时结果随即写入，不再取消
+            if waiting is not None:
+                future.cancel()
+            raise
+
+    def wsd_async(self, codes: str, fields: str, start_date: datetime.date, end_date: datetime.date,
+                  options: str = '', priority: str = None, timeout: float = None):
+        """
+        priority overrides the connection priority for this query. A query still queued on the
+        server timeout seconds after it arrived is dropped and fails with TimeoutError.
+        """
+        return self.__request__('wsd', (codes, fields, start_date, end_date, options),
+                                priority=priority, timeout=timeout)
+
+    def wsd(self, codes: str, fields: str, start_date: datetime.date, end_date: datetime.date, options: str = '',
+            priority: str = None, timeout: float = None):
+        return self.__result__('wsd', (codes, fields, start_date, end_date, options), timeout,
+                               priority=priority, timeout=timeout)
+
+    def wsd_iter(self, codes: str, fields: str, start_date: datetime.date, end_date: datetime.date,
+                 options: str = '', by: str = 'code', size: int = 100):
+        """
+        Stream one wsd result in blocks of size codes (by='code') or size dates (by='date').
+        Returns an iterator of partial WSDRes in the order the server sends them.
+        """
+        if by not in ('code', 'date'):
+            raise ValueError('param by should be code/date but got {}.'.format(by))
+        block_queue = Queue()
+        with self.__pending_lock__:
+            request_id = next(self.__request_id__)
+            self.__pending__[request_id] = (block_queue, WSDRes)
+        self.msg_out.put(self.serializer.dumps({
+            'id': request_id, 'func': 'wsd', 'args': (codes, fields, start_date, end_date, options),
+            'stream': {'by': by, 'size': size},
+        }))
+        return self.__iter_blocks__(block_queue)
+
+    @staticmethod
+    def __iter_blocks__(block_queue: Queue):
+        while True:
+            block = block_queue.get()
+            if block is None:
+                break
+            elif isinstance(block, Exception):
+                raise block
+            yield block
+
+    def wsd_many(self, queries: list):
+        """ queries: list of (codes, fields, start_date, end_date[, options])，全部发出后按顺序返回 WSDRes """
+        futures = [self.wsd_async(*var) for var in queries]
+        return [var.result() for var in futures]
+
+    def wsd_batch(self, queries: list, priority: str = None, timeout: float = None):
+        """
+        Send queries, a list of (codes, fields, start_date, end_date[, options]), in one frame.
+        The server merges queries sharing a single field, dates and options into fewer engine calls.
+        Returns an iterator of (index in queries, WSDRes) in the order the results arrive.
+        priority and timeout apply to every query as in wsd_async.
+        """
+        sub_list, futures = list(), dict()
+        with self.__pending_lock__:
+            for i, var in enumerate(queries):
+                future = Future()
+                sub_id = next(self.__request_id__)
+                self.__pending__[sub_id] = (future, WSDRes)
+                sub_list.append({'id': sub_id, 'func': 'wsd', 'args': list(var)})
+                futures[future] = i
+        batch_future = self.__request__('batch', sub_list, parser=lambda res: res['groups'],
+                                        priority=priority, timeout=timeout)
+
+        def on_batch_done(var: Future):
+            # 整批被拒绝时子请求不会再有返回
+            if var.exception() is not None:
+                with self.__pending_lock__:
+                    for sub in sub_list:
+                        self.__pending__.pop(sub['id'], None)
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(var.exception())
+        batch_future.add_done_callback(on_batch_done)
+        return ((futures[var], var.result()) for var in as_completed(futures))
+
+    def subscribe(self, codes: str, fields: str, callback, timeout: float = None):
+        """
+        Subscribe to real-time values of every (code, field). callback(data) is called from the
+        dispatch thread with data {code: {field: value}} holding the subscribed values changed since
+        the last push; a slow client only gets the latest value of each. Returns the number of
+        (code, field) keys this connection subscribes to, raises TimeoutError without an answer in
+        timeout seconds.
+        """
+        subscription = (set(make_keys(codes, fields)), callback)
+        # 先登记再发送，订阅回复之前到达的推送也能送达
+        with self.__pending_lock__:
+            self.__subscriptions__.append(subscription)
+        try:
+            return self.__result__('subscribe', (codes, fields), timeout, parser=lambda res: res['keys'])
+        except Exception:
+            with self.__pending_lock__:
+                self.__subscriptions__.remove(subscription)
+            raise
+
+    def unsubscribe(self, codes: str = None, fields: str = None, timeout: float = None):
+        """ 取消 codes x fields 的订阅，均为 None 时取消全部，返回仍订阅的 key 数 """
+        with self.__pending_lock__:
+            for keys, callback in self.__subscriptions__:
+                if codes is None or fields is None:
+                    keys.clear()
+                else:
+                    keys.difference_update(make_keys(codes, fields))
+            self.__subscriptions__ = [var for var in self.__subscriptions__ if len(var[0]) > 0]
+        args = (codes, fields) if codes is not None and fields is not None else ()
+        return self.__result__('unsubscribe', args, timeout, parser=lambda res: res['keys'])
+
+    def __on_push__(self, res: dict):
+        with self.__pending_lock__:
+            subscriptions = list(self.__subscriptions__)
+        for keys, callback in subscriptions:
+            data = dict()
+            for code, values in res['Data'].items():
+                for field, value in values.items():
+                    if (code, field) in keys:
+                        data.setdefault(code, dict())[field] = value
+            if len(data) == 0:
+                continue
+            try:
+                callback(data)
+            except Exception as e:
+                self.log.error('subscription callback failed: {}'.format(e))
+
+    def __resubscribe__(self):
+        """ 重连后按代码重新订阅全部 key """
+        with self.__pending_lock__:
+            keys = set(x for var in self.__subscriptions__ for x in var[0])
+        field_dict = dict()
+        for code, field in keys:
+            field_dict.setdefault(code, list()).append(field)
+        for code, field_list in field_dict.items():
+            self.__request__('subscribe', (code, ','.join(field_list)), parser=lambda res: res['keys'])
+
+    def ping(self, timeout: float = None):
+        return self.__result__('ping', (), timeout, parser=lambda res: True)
+
+    def server_ready(self, timeout: float = None):
+        """ 服务器的引擎会话是否已就绪，ping 只表明连接可用 """
+        return self.__result__('ready', (), timeout, parser=lambda res: res['ready'])
+
+    def server_stats(self, timeout: float = None):
+        """ 服务器状态：连接与队列深度、工作线程池利用率、缓存命中情况及全部统计项 """
+        return self.__result__('stats', (), timeout, parser=lambda res: res['stats'])
+
+    def server_metrics(self, timeout: float = None):
+        """ Prometheus 文本格式的服务器统计项 """
+        return self.__result__('metrics', (), timeout, parser=lambda res: res['text'])
+
+    def start(self):
+        SocketClient.start(self)
+        self.__dispatch_thread__ = Thread(target=self.__dispatch_msg__, name='dispatch wind response')
+        self.__dispatch_thread__.start()
+
+        try:
+            self.__negotiate__().result()
+        except NotImplementedError:
+            pass
+
+    def __negotiate__(self):
+        """ 协商本连接的结果编码及序列化方式，旧版服务器不支持 hello 时使用 json """
+        self.encoding = 'json'
+        self.serializer = TEXT
+        encodings = [var for var in self.ENCODINGS if var == self.__preferred_encoding__ or var == 'json']
+        hello = {'encodings': encodings, 'serializers': self.__serializer_offer__}
+        if self.priority is not None:
+            hello['priority'] = self.priority
+        return self.__request__('hello', hello, parser=self.__on_hello__)
+
+    def __on_hello__(self, res: dict):
+        """ 在分发线程中切换，之后的消息均以协商的方式读取 """
+        self.encoding = res['encoding']
+        self.serializer = SERIALIZERS.get(res.get('serializer', None), TEXT)
+        self.log.debug('result encoding %s, serializer %s negotiated.', self.encoding, self.serializer.name)
+        return self.encoding
+
+    def __fail_pending__(self, e: Exception):
+        with self.__pending_lock__:
+            waiting_list = list(self.__pending__.values())
+            self.__pending__.clear()
+        for future, parser in waiting_list:
+            if isinstance(future, Queue):
+                future.put(e)
+                future.put(None)
+            else:
+                future.set_exception(e)
+
+    def on_reconnect(self):
+        # 断线前未返回的请求不会再有结果
+        self.__fail_pending__(ConnectionError('connection to {} was reset.'.format(self.__host__)))
+        self.__negotiate__()
+        self.__resubscribe__()
+
+    def stop(self):
+        SocketClient.stop(self)
+        self.msg_in.put(None)
+        self.__dispatch_thread__.join()
+        self.__fail_pending__(ConnectionError('{} stopped.'.format(self.__class__.__name__)))
 
     def __process_error__(self, e_dict: dict):
         if e_dict['status'] == self.STATUS_FUNC_ERROR:
             raise NotImplementedError
         elif e_dict['status'] == self.STATUS_ARGS_ERROR:
             raise ValueError
+        elif e_dict['status'] == self.STATUS_BUSY:
+            raise RuntimeError('server queue is full, try again later.')
+        elif e_dict['status'] == self.STATUS_ENGINE_ERROR:
+            raise RuntimeError('server engine error: {}'.format(e_dict.get('msg', 'not ready, try again later.')))
+        elif e_dict['status'] == self.STATUS_RATE_LIMITED:
+            raise RuntimeError('request rate limit exceeded, try again later.')
+        elif e_dict['status'] == self.STATUS_DEADLINE_EXCEEDED:
+            raise TimeoutError('request expired in the server queue.')
         else:
             raise NotImplementedError
 
 
 class WindServer(SocketServer, WindStatusCode):
-    def __init__(self, **kwargs):
-        SocketServer.__init__(self, **kwargs)
-        self.engine = None
+    """
+    Serves wsd / wsq queries of WindClient from one engine session kept by an EngineManager.
+
+    engine_factory() returns the engine (WindPy.w by default, StubWindEngine offline). It is
+    connected and warmed up at start(), or on the first query with engine_lazy=True, and checked
+    every engine_health_interval seconds. Queries wait up to engine_timeout seconds for a session
+    that is (re)connecting and are answered with STATUS_ENGINE_ERROR after that, as are queries
+    the engine fails with any other exception (with its message in 'msg').
+
+    wsd and batch requests are queued in a Scheduler lane by their 'priority' (or the one the
+    connection sent in 'hello', 'normal' by default). Each connection may send rate_limit queries
+    per second with bursts of rate_burst (rate_limit=0 disables), excess requests get
+    STATUS_RATE_LIMITED. Requests with a 'timeout' still queued that many seconds after arrival
+    are dropped with STATUS_DEADLINE_EXCEEDED.
+    """
+    FUNCS = ('wsd', 'batch', 'hello', 'ping', 'ready', 'stats', 'metrics', 'subscribe', 'unsubscribe')
+    WARMUP_CODE = '000001.SZ'
+
+    def __init__(self, workers: int = 4, max_queue_size: int = 1000, cache: bool = True,
+                 cache_ttl: float = 3600.0, cache_max_entries: int = 1024, cache_max_bytes: int = 256 * 1024 * 1024,
+                 cache_dir: str = None, cache_dir_max_bytes: int = 1024 * 1024 * 1024, coalesce: bool = True,
+                 push_max_backlog: int = 64 * 1024, engine_factory=None, engine_lazy: bool = False,
+                 engine_timeout: float = 10.0, engine_health_interval: float = 30.0, engine_warmup: bool = True,
+                 rate_limit: float = 0.0, rate_burst: float = 50.0, **kwargs):
+        # 经 MRO 初始化，使 AsyncWindServer 得到 AsyncSocketServer 的初始化
+        super(WindServer, self).__init__(**kwargs)
+        self.__engine_timeout__ = engine_timeout
+        self.pool = Scheduler(workers=workers, max_queue_size=max_queue_size, name='wind query worker')
+        self.limiter = RateLimiter(rate=rate_limit, burst=rate_burst)
+        self.cache = WSDCache(
+            ttl=cache_ttl, max_entries=cache_max_entries, max_bytes=cache_max_bytes,
+        ) if cache is True else None
+        # 磁盘缓存位于内存缓存之下，重启后仍有效
+        self.disk_cache = WSDDiskCache(cache_dir, max_bytes=cache_dir_max_bytes) if cache_dir is not None else None
+        self.__encoding_dict__ = dict()
+        self.__priority_dict__ = dict()
+        self.__serializer_dict__ = dict()
+
+        self.__engine_time__ = self.metrics.histogram('wind_engine_seconds', 'Time spent in engine wsd calls')
+        self.__rejected__ = self.metrics.counter('wind_rejected_total', 'Requests rejected with a full worker queue')
+        self.__rate_limited__ = self.metrics.counter(
+            'wind_rate_limited_total', 'Requests over the connection rate limit')
+        self.__expired__ = self.metrics.counter('wind_expired_total', 'Requests dropped after their deadline')
+        # 同时到达的相同查询只调用一次引擎
+        self.single_flight = SingleFlight(saved_counter=self.metrics.counter(
+            'wind_coalesced_total', 'Queries served by an identical in-flight query')) if coalesce is True else None
+        self.metrics.gauge('wind_pool_queue_depth', 'Tasks waiting for a query worker',
+                           func=lambda: self.pool.stats()['queue_depth'])
+        # 发送积压超过 push_max_backlog 字节的订阅者只在追上后收到各项的最新值
+        self.subscriptions = SubscriptionHub(
+            send=lambda addr, msg: self.msg_out.put(SocketMessage(addr, msg)),
+            engine_subscribe=self.__engine_subscribe__, engine_cancel=self.__engine_cancel__,
+            backlog=self.out_backlog, max_backlog=push_max_backlog, metrics=self.metrics, log=self.log,
+        )
+        # 引擎会话只建立一次，断线后由监控线程重连并恢复订阅
+        self.engine_manager = EngineManager(
+            factory=engine_factory, lazy=engine_lazy, health_interval=engine_health_interval,
+            warmup=self.__warmup__ if engine_warmup is True else None,
+            on_ready=lambda engine: self.subscriptions.restore(), metrics=self.metrics, log=self.log,
+        )
+
+    @property
+    def engine(self):
+        """ 当前的引擎会话，未就绪时为 None """
+        return self.engine_manager.engine
+
+    def __observe__(self, func: str, msg_obj: SocketMessage):
+        """ 记录请求从收到至回复放入 msg_out 的耗时 """
+        self.metrics.histogram(
+            'wind_request_seconds', 'Request latency from receipt to reply', func=func,
+        ).observe(time.perf_counter() - msg_obj.time)
+
+    def __warmup__(self, engine):
+        """ 以一次短查询加载引擎的元数据，使首个请求不再承担 """
+        today = datetime.date.today()
+        engine.wsd(self.WARMUP_CODE, 'close', today - datetime.timedelta(days=7), today)
+
+    def __engine_wsd__(self, *args):
+        engine = self.engine_manager.get(self.__engine_timeout__)
+        start = time.perf_counter()
+        try:
+            return engine.wsd(*args)
+        finally:
+            self.__engine_time__.observe(time.perf_counter() - start)
+
+    def __engine_subscribe__(self, code: str, field: str):
+        res = self.engine_manager.get(self.__engine_timeout__).wsq(code, field, func=self.__on_quote__)
+        if res.ErrorCode != 0:
+            raise ValueError('wsq {} {} failed with ErrorCode {}.'.format(code, field, res.ErrorCode))
+        return res.RequestID
+
+    def __engine_cancel__(self, request_id):
+        engine = self.engine_manager.engine
+        if engine is not None:
+            engine.cancelRequest(request_id)
+
+    def __on_quote__(self, res):
+        """ 引擎推送回调，Data 按字段、代码排列 """
+        if res.ErrorCode != 0:
+            self.log.warning('wsq push with ErrorCode {}.'.format(res.ErrorCode))
+            return
+        self.subscriptions.publish({
+            (str(code).upper(), str(field).upper()): res.Data[i][j]
+            for i, field in enumerate(res.Fields) for j, code in enumerate(res.Codes)
+        })
+
+    def __disk_wsd__(self, *args):
+        return self.disk_cache.query(self.__engine_wsd__, *args)
+
+    def __cached_wsd__(self, codes: str, fields: str, start_date, end_date, options: str = ''):
+        fetch = self.__engine_wsd__ if self.disk_cache is None else self.__disk_wsd__
+        if self.cache is None:
+            return fetch(codes, fields, start_date, end_date, options)
+        return self.cache.query(fetch, codes, fields, start_date, end_date, options)
+
+    def __query_wsd__(self, codes: str, fields: str, start_date, end_date, options: str = ''):
+        if self.single_flight is None:
+            return self.__cached_wsd__(codes, fields, start_date, end_date, options)
+        key = ('wsd', ) + WSDCache.make_key(codes, fields, options) + tuple(
+            to_date(var) or str(var).strip() for var in (start_date, end_date))
+        return self.single_flight.do(key, self.__cached_wsd__, codes, fields, start_date, end_date, options)
+
+    def stats(self):
+        result = super(WindServer, self).stats()
+        result.update({
+            'pool': self.pool.stats(),
+            'rate_limit': self.limiter.stats(),
+            'cache': self.cache.stats() if self.cache is not None else None,
+            'disk_cache': self.disk_cache.stats() if self.disk_cache is not None else None,
+            'coalesce': self.single_flight.stats() if self.single_flight is not None else None,
+            'subscriptions': self.subscriptions.stats(),
+            'engine': self.engine_manager.stats(),
+        })
+        return result
+
+    def on_client_exit(self, sock_addr: str):
+        self.__encoding_dict__.pop(sock_addr, None)
+        self.__priority_dict__.pop(sock_addr, None)
+        self.__serializer_dict__.pop(sock_addr, None)
+        self.limiter.forget(sock_addr)
+        self.subscriptions.unsubscribe(sock_addr)
+
+    def __send_wsd__(self, msg_obj: SocketMessage, request_id, res, **extra):
+        meta = {
+            'id': request_id, 'status': self.STATUS_SUCCESS,
+            'ErrorCode': res.ErrorCode, 'Codes': res.Codes, 'Fields': res.Fields,
+        }
+        meta.update(extra)
+        res_msg = None
+        if self.__encoding_dict__.get(msg_obj.addr, 'json') == 'binary':
+            res_msg = encode_wsd(meta, res.Times, res.Data)
+            if res_msg is not None and self.__serializer_dict__.get(msg_obj.addr, TEXT).binary is True:
+                # 二进制帧均为该序列化方式的消息，结果帧放入其中
+                res_msg = self.__dumps__(msg_obj.addr, {'wire': res_msg})
+        if res_msg is None:
+            meta.update({'Times': format_dates(res.Times), 'Data': res.Data})
+            res_msg = self.__dumps__(msg_obj.addr, meta)
+        self.msg_out.put(SocketMessage(msg_obj.addr, res_msg))
+
+    def __send_wsd_blocks__(self, msg_obj: SocketMessage, request_id, res, by: str, size: int):
+        """ 将结果按代码（行）或日期分块依次发送，每块单独序列化 """
+        size = max(1, int(size))
+        if by == 'date':
+            bounds = [(i, min(i + size, len(res.Times))) for i in range(0, len(res.Times), size)] or [(0, 0)]
+            blocks = [WSDData(res.ErrorCode, res.Codes, res.Fields, res.Times[start:end],
+                              [row[start:end] for row in res.Data]) for start, end in bounds]
+        else:
+            by_codes = len(res.Codes) > 1
+            bounds = [(i, min(i + size, len(res.Data))) for i in range(0, len(res.Data), size)] or [(0, 0)]
+            blocks = [WSDData(
+                res.ErrorCode, res.Codes[start:end] if by_codes else res.Codes,
+                res.Fields if by_codes else res.Fields[start:end], res.Times, res.Data[start:end],
+            ) for start, end in bounds]
+        for i, block in enumerate(blocks):
+            self.__send_wsd__(msg_obj, request_id, block, chunk=i, last=i == len(blocks) - 1)
 
-    def on_new_client(self, sock_addr: str):
-        from WindPy import w
-        self.log.debug('new connection arrived {}'.format(sock_addr))
-        self.engine = w
-        self.engine.start()
+    def __reply_error__(self, msg_obj: SocketMessage, request_ids: list, e: Exception):
+        """ 参数错误回复 STATUS_ARGS_ERROR，其余异常回复 STATUS_ENGINE_ERROR 及异常信息 """
+        if isinstance(e, (KeyError, TypeError)):
+            status = self.STATUS_ARGS_ERROR
+        else:
+            status = self.STATUS_ENGINE_ERROR
+            if not isinstance(e, EngineUnavailable):
+                self.log.exception('wsd from {} failed: {}'.format(msg_obj.addr, e))
+        for request_id in request_ids:
+            self.__reply__(msg_obj, {'id': request_id, 'status': status, 'msg': str(e)})
+
+    def __process_wsd__(self, msg_obj: SocketMessage, request_id, args, stream: dict = None):
+        try:
+            res = self.__query_wsd__(*args)
+        except Exception as e:
+            self.__reply_error__(msg_obj, [request_id], e)
+            self.__observe__('wsd', msg_obj)
+            return
+        if stream is not None and res.ErrorCode == 0:
+            self.__send_wsd_blocks__(msg_obj, request_id, res, stream.get('by', 'code'), stream.get('size', 100))
+        else:
+            self.__send_wsd__(msg_obj, request_id, res)
+        self.__observe__('wsd', msg_obj)
+
+    def __process_wsd_group__(self, msg_obj: SocketMessage, group: list):
+        """ 合并 fields / 日期 / options 相同的单字段请求为一次查询，再按代码拆分结果 """
+        merged_codes = list()
+        for request_id, args in group:
+            for code in args[0].split(','):
+                if code.strip().upper() not in merged_codes:
+                    merged_codes.append(code.strip().upper())
+        codes, fields, start_date, end_date, options = group[0][1]
+        try:
+            res = self.__query_wsd__(','.join(merged_codes), fields, start_date, end_date, options)
+        except Exception as e:
+            self.__reply_error__(msg_obj, [var[0] for var in group], e)
+            self.__observe__('wsd_group', msg_obj)
+            return
+
+        row_index = {str(var).upper(): i for i, var in enumerate(res.Codes)}
+        for request_id, args in group:
+            sub_codes = [var.strip().upper() for var in args[0].split(',')]
+            if res.ErrorCode != 0 or any(var not in row_index for var in sub_codes):
+                self.__send_wsd__(msg_obj, request_id, WSDData(res.ErrorCode, sub_codes, res.Fields, [], []))
+                continue
+            self.__send_wsd__(msg_obj, request_id, WSDData(
+                res.ErrorCode, [res.Codes[row_index[var]] for var in sub_codes], res.Fields, res.Times,
+                [res.Data[row_index[var]] for var in sub_codes],
+            ))
+        self.__observe__('wsd_group', msg_obj)
+
+    def __expire__(self, msg_obj: SocketMessage, request_ids: list):
+        """ 超过截止时间的请求不再执行，只回复 STATUS_DEADLINE_EXCEEDED """
+        self.__expired__.inc(len(request_ids))
+        for request_id in request_ids:
+            self.__reply__(msg_obj, {'id': request_id, 'status': self.STATUS_DEADLINE_EXCEEDED})
+
+    def __process_query__(self, msg_obj: SocketMessage, msg: dict):
+        """ wsd / batch 请求经限流后按优先级及截止时间提交线程池，已提交时返回 None """
+        request_id, args = msg.get('id', None), msg.get('args', ())
+        try:
+            priority = msg.get('priority', None) or self.__priority_dict__.get(msg_obj.addr, 'normal')
+            Scheduler.check_priority(priority)
+            deadline = msg_obj.time + float(msg['timeout']) if msg.get('timeout', None) is not None else None
+        except (ValueError, TypeError):
+            return self.__dumps__(msg_obj.addr, {'id': request_id, 'status': self.STATUS_ARGS_ERROR})
+        if not self.limiter.allow(msg_obj.addr, len(args) if msg['func'] == 'batch' else 1):
+            self.__rate_limited__.inc()
+            return self.__dumps__(msg_obj.addr, {'id': request_id, 'status': self.STATUS_RATE_LIMITED})
+        if deadline is not None and time.perf_counter() > deadline:
+            self.__expired__.inc()
+            return self.__dumps__(msg_obj.addr, {'id': request_id, 'status': self.STATUS_DEADLINE_EXCEEDED})
+
+        if msg['func'] == 'batch':
+            return self.__process_batch__(msg_obj, request_id, args, priority, deadline)
+        if self.pool.submit(msg_obj.addr, self.__process_wsd__, msg_obj, request_id, args, msg.get('stream', None),
+                            priority=priority, deadline=deadline,
+                            on_expired=lambda: self.__expire__(msg_obj, [request_id])):
+            return None
+        self.__rejected__.inc()
+        self.log.warning('worker queue full, request from {} rejected.'.format(msg_obj.addr))
+        return self.__dumps__(msg_obj.addr, {'id': request_id, 'status': self.STATUS_BUSY, })
+
+    def __process_batch__(self, msg_obj: SocketMessage, request_id, sub_list: list, priority: str = 'normal',
+                          deadline: float = None):
+        """ 批量 wsd 请求：可合并的子请求合并后提交线程池，每个子请求完成后立即按其 id 返回 """
+        group_dict = OrderedDict()
+        for sub in sub_list:
+            if sub.get('func', None) != 'wsd' or len(sub.get('args', ())) < 4:
+                self.__reply__(msg_obj, {'id': sub.get('id', None), 'status': self.STATUS_ARGS_ERROR})
+                continue
+            args = list(sub['args']) + [''] * (5 - len(sub['args']))
+            if ',' in args[1]:
+                group_key = ('single', sub['id'])
+            else:
+                group_key = (args[1].strip().lower(), args[2], args[3], args[4])
+            group_dict.setdefault(group_key, list()).append((sub['id'], args))
+
+        for group in group_dict.values():
+            schedule = {
+                'priority': priority, 'deadline': deadline,
+                'on_expired': lambda ids=[var[0] for var in group]: self.__expire__(msg_obj, ids),
+            }
+            if len(group) == 1:
+                accepted = self.pool.submit(
+                    msg_obj.addr, self.__process_wsd__, msg_obj, group[0][0], group[0][1], **schedule)
+            else:
+                accepted = self.pool.submit(msg_obj.addr, self.__process_wsd_group__, msg_obj, group, **schedule)
+            if accepted is False:
+                self.__rejected__.inc(len(group))
+                for sub_id, args in group:
+                    self.__reply__(msg_obj, {'id': sub_id, 'status': self.STATUS_BUSY})
+        return self.__dumps__(msg_obj.addr, {
+            'id': request_id, 'status': self.STATUS_SUCCESS, 'groups': len(group_dict)})
+
+    def __process_hello__(self, msg_obj: SocketMessage, request_id, args: dict):
+        """ 回复仍以原序列化方式发出，之后的回复才使用协商的方式 """
+        encoding = 'binary' if 'binary' in args.get('encodings', ()) else 'json'
+        self.__encoding_dict__[msg_obj.addr] = encoding
+        if args.get('priority', None) in PRIORITIES:
+            self.__priority_dict__[msg_obj.addr] = args['priority']
+        serializer = negotiate(args.get('serializers', ()))
+        self.__reply__(msg_obj, {
+            'id': request_id, 'status': self.STATUS_SUCCESS, 'encoding': encoding, 'serializer': serializer,
+            'priority': self.__priority_dict__.get(msg_obj.addr, 'normal'),
+        })
+        self.__serializer_dict__[msg_obj.addr] = SERIALIZERS[serializer]
+        self.__observe__('hello', msg_obj)
+
+    def __dumps__(self, sock_addr, obj):
+        """ 以该连接协商的方式序列化 """
+        return self.__serializer_dict__.get(sock_addr, TEXT).dumps(obj)
+
+    def __reply__(self, msg_obj: SocketMessage, obj):
+        self.msg_out.put(SocketMessage(msg_obj.addr, self.__dumps__(msg_obj.addr, obj)))
+
+    def __process_subscription__(self, msg_obj: SocketMessage, request_id, func: str, args):
+        try:
+            if func == 'subscribe':
+                keys = self.subscriptions.subscribe(msg_obj.addr, args[0], args[1])
+            elif len(args) >= 2:
+                keys = self.subscriptions.unsubscribe(msg_obj.addr, args[0], args[1])
+            else:
+                keys = self.subscriptions.unsubscribe(msg_obj.addr)
+        except (ValueError, TypeError, IndexError) as e:
+            self.log.warning('{} from {} failed: {}'.format(func, msg_obj.addr, e))
+            return self.__dumps__(msg_obj.addr, {'id': request_id, 'status': self.STATUS_ARGS_ERROR})
+        except Exception as e:
+            # 引擎异常只回复本请求，不中断消息处理
+            if isinstance(e, EngineUnavailable):
+                self.log.warning('{} from {} failed: {}'.format(func, msg_obj.addr, e))
+            else:
+                self.log.exception('{} from {} failed: {}'.format(func, msg_obj.addr, e))
+            return self.__dumps__(msg_obj.addr, {'id': request_id, 'status': self.STATUS_ENGINE_ERROR, 'msg': str(e)})
+        return self.__dumps__(msg_obj.addr, {'id': request_id, 'status': self.STATUS_SUCCESS, 'keys': keys})
 
     def process_msg(self):
-        while self.__process_tag__ is True:
+        self.engine_manager.start()
+        self.pool.start()
+        self.subscriptions.start()
+        while True:
             msg_obj = self.msg_in.get()
+            if msg_obj is None:
+                break
             assert isinstance(msg_obj, SocketMessage)
-            msg = json.loads(msg_obj.msg)
-            if msg['func'] == 'wsd':
-                try:
-                    args = msg['args']
-                    res = self.engine.wsd(*args)
-                    res_msg = json.dumps({
-                        'status': self.STATUS_SUCCESS,
-                        'ErrorCode': res.ErrorCode, 'Codes': res.Codes,
-                        'Fields': res.Fields, 'Times': res.Times, 'Data': res.Data,
-                    }, cls=ComplexEncoder)
-                except KeyError:
-                    res_msg = json.dumps({'status': self.STATUS_ARGS_ERROR, })
+            msg = loads(msg_obj.msg, self.__serializer_dict__.get(msg_obj.addr, TEXT))
+            request_id = msg.get('id', None)
+            if msg['func'] in ('wsd', 'batch'):
+                res_msg = self.__process_query__(msg_obj, msg)
+                if res_msg is None:
+                    continue
+            elif msg['func'] == 'hello':
+                self.__process_hello__(msg_obj, request_id, msg['args'])
+                continue
+            elif msg['func'] == 'ping':
+                res_msg = self.__dumps__(msg_obj.addr, {'id': request_id, 'status': self.STATUS_SUCCESS})
+            elif msg['func'] == 'ready':
+                res_msg = self.__dumps__(msg_obj.addr, {
+                    'id': request_id, 'status': self.STATUS_SUCCESS, 'ready': self.engine_manager.is_ready()})
+            elif msg['func'] == 'stats':
+                res_msg = self.__dumps__(msg_obj.addr, {
+                    'id': request_id, 'status': self.STATUS_SUCCESS, 'stats': self.stats()})
+            elif msg['func'] == 'metrics':
+                res_msg = self.__dumps__(msg_obj.addr, {
+                    'id': request_id, 'status': self.STATUS_SUCCESS, 'text': self.metrics_text()})
+            elif msg['func'] in ('subscribe', 'unsubscribe'):
+                res_msg = self.__process_subscription__(msg_obj, request_id, msg['func'], msg.get('args', ()))
             else:
-                res_msg = json.dumps({'status': self.STATUS_FUNC_ERROR, })
+                res_msg = self.__dumps__(msg_obj.addr, {'id': request_id, 'status': self.STATUS_FUNC_ERROR, })
                 self.log.warning('Unknown command from {}: {}'.format(msg_obj.addr, msg_obj.msg))
             self.msg_out.put(SocketMessage(msg_obj.addr, res_msg))
+            # 未知 func 归为一类，避免统计项随客户端输入增长
+            self.__observe__(msg['func'] if msg['func'] in self.FUNCS else 'unknown', msg_obj)
+        self.subscriptions.stop()
+        self.pool.stop()
+        self.engine_manager.stop()
+
+
+class AsyncWindServer(WindServer, AsyncSocketServer):
+    """ WindServer whose connections are served by AsyncSocketServer's event loop """
+    pass
+
+
+class ReactorWindServer(WindServer, ReactorSocketServer):
+    """ WindServer whose connections are served by ReactorSocketServer's selector thread """
+    pass
@@ -0,0 +1,244 @@
+# -*- encoding: UTF-8 -*-
+import asyncio
+
+from queue import Empty
+from threading import Thread
+
+from Socketer.Framing import FrameConstants, FrameError, pack_frame
+from Socketer.Server import SocketServer, SocketMessage
+
+
+class AsyncSocketServer(SocketServer):
+    """
+    SocketServer served by one asyncio event loop instead of one thread per connection.
+
+    on_new_client / process_msg / msg_in / msg_out keep the contract of SocketServer:
+    process_msg still runs in its own thread and talks to the loop through the queues.
+
+    Writes never block the loop: the transport buffers them. Once out_buffer_size bytes are
+    buffered for a connection, slow_client_policy 'drop' drops its replies and 'disconnect' closes
+    it, while 'block' keeps buffering. Replies taken from msg_out together are written to each
+    connection as one coalesced write.
+    """
+
+    def __init__(self, port: int = 33331, out_buffer_size: int = 16 * 1024 * 1024, **kwargs):
+        SocketServer.__init__(self, port=port, **kwargs)
+        self.__out_buffer_size__ = out_buffer_size
+        self.__loop__ = None
+        self.__async_server__ = None
+        self.__writer_dict__ = dict()
+        self.__compression_dict__ = dict()
+        self.metrics.gauge('socketer_out_buffer_bytes', 'Bytes buffered in transports', func=self.__out_buffer_bytes__)
+
+    def __active_connections__(self):
+        return len(self.__writer_dict__)
+
+    def __out_buffer_bytes__(self):
+        return sum(var.transport.get_write_buffer_size() for var in list(self.__writer_dict__.values()))
+
+    def out_backlog(self, sock_addr):
+        writer = self.__writer_dict__.get(sock_addr, None)
+        return writer.transport.get_write_buffer_size() if writer is not None else 0
+
+    async def __handle_client__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        sock_addr = self.__peer_addr__(writer.get_extra_info('peername'))
+        self.__connections__.inc()
+        self.log.debug('new connection from %s.', sock_addr)
+        await self.__loop__.run_in_executor(None, self.on_new_client, sock_addr)
+        self.__writer_dict__[sock_addr] = writer
+        max_frame_size = self.__max_frame_size__ if self.__max_frame_size__ is not None \
+            else FrameConstants.DEFAULT_MAX_FRAME_SIZE
+
+        try:
+            while self.__receive_tag__ is True:
+                header = await reader.readexactly(FrameConstants.FRAME_HEADER_SIZE)
+                flags, length = FrameConstants.FRAME_HEADER.unpack(header)
+                if length > max_frame_size:
+                    raise FrameError('frame of {} bytes exceeds max frame size {}'.format(length, max_frame_size))
+                msg = await reader.readexactly(length)
+                self.__bytes_in__.inc(length + FrameConstants.FRAME_HEADER_SIZE)
+                if flags & FrameConstants.FLAG_CONTROL:
+                    compression, reply = self.__handshake__(sock_addr, msg)
+                    writer.write(pack_frame(reply, FrameConstants.FLAG_CONTROL))
+                    self.__compression_dict__[sock_addr] = compression
+                    continue
+                compression = self.__compression_dict__.get(sock_addr, None)
+                if compression is not None:
+                    msg, flags = compression.decode(msg, flags)
+                self.__msgs_in__.inc()
+                self.__msg_size_in__.observe(len(msg))
+                if not flags & FrameConstants.FLAG_BINARY:
+                    msg = msg.decode(self.__msg_encoding__)
+
+                self.msg_log.debug('message from %s with %s', sock_addr, msg)
+                if msg == self.CLIENT_EXIT_MSG:
+                    self.__write_frame__(writer, msg, compression)
+                    await writer.drain()
+                    break
+                else:
+                    self.msg_in.put(SocketMessage(sock_addr, msg))
+        except asyncio.IncompleteReadError:
+            self.log.debug('connection %s closed by peer.', sock_addr)
+        except FrameError as e:
+            self.log.error('invalid frame from {}: {}'.format(sock_addr, e))
+        except (ConnectionError, OSError) as e:
+            self.log.warning('connection {} lost: {}'.format(sock_addr, e))
+        except Exception as e:
+            # 解压失败等
+            self.log.error('invalid message from {}: {}'.format(sock_addr, e))
+        finally:
+            self.__writer_dict__.pop(sock_addr, None)
+            self.__compression_dict__.pop(sock_addr, None)
+            writer.close()
+            self.__release_connection__(sock_addr)
+            await self.__loop__.run_in_executor(None, self.on_client_exit, sock_addr)
+
+    def __pack__(self, msg, compression=None):
+        """ 返回待写出的数据块列表：小帧复制为一块，大帧头部与数据分开以免复制 """
+        if isinstance(msg, bytes):
+            payload, flags = msg, FrameConstants.FLAG_BINARY
+        else:
+            payload, flags = msg.encode(self.__msg_encoding__), FrameConstants.FLAG_TEXT
+        if compression is not None:
+            payload, flags = compression.encode(payload, flags)
+        self.__bytes_out__.inc(len(payload) + FrameConstants.FRAME_HEADER_SIZE)
+        self.__msgs_out__.inc()
+        if len(payload) > FrameConstants.COPY_THRESHOLD:
+            return [FrameConstants.FRAME_HEADER.pack(flags, len(payload)), payload]
+        return [pack_frame(payload, flags)]
+
+    def __write_frame__(self, writer: asyncio.StreamWriter, msg, compression=None):
+        for var in self.__pack__(msg, compression):
+            writer.write(var)
+        self.__writes__.inc()
+
+    def __write_msgs__(self, msg_list: list):
+        """ 在事件循环中执行：同一连接的消息合并为一次写出，由 transport 缓冲 """
+        chunk_dict = dict()
+        for msg_obj in msg_list:
+            writer = self.__writer_dict__.get(msg_obj.addr, None)
+            if writer is None:
+                self.log.warning('message to closed connection {} dropped.'.format(msg_obj.addr))
+                continue
+            if writer.transport.get_write_buffer_size() >= self.__out_buffer_size__:
+                if self.__slow_client_policy__ == 'drop':
+                    self.__dropped__.inc()
+                    self.log.debug('outbound buffer of %s full, message dropped.', msg_obj.addr)
+                    continue
+                elif self.__slow_client_policy__ == 'disconnect':
+                    self.__slow_disconnects__.inc()
+                    self.log.warning('outbound buffer of {} full, connection closed.'.format(msg_obj.addr))
+                    self.__writer_dict__.pop(msg_obj.addr, None)
+                    writer.transport.abort()
+                    chunk_dict.pop(msg_obj.addr, None)
+                    continue
+            chunk_dict.setdefault(msg_obj.addr, (writer, list()))[1].extend(
+                self.__pack__(msg_obj.msg, self.__compression_dict__.get(msg_obj.addr, None)))
+            self.msg_log.debug('message to %s: %s', msg_obj.addr, msg_obj.msg)
+
+        for sock_addr, (writer, chunks) in chunk_dict.items():
+            try:
+                if len(chunks) == 1 or all(len(var) <= FrameConstants.COPY_THRESHOLD for var in chunks):
+                    writer.write(b''.join(chunks) if len(chunks) > 1 else chunks[0])
+                else:
+                    writer.writelines(chunks)
+            except (ConnectionError, OSError) as e:
+                self.log.warning('message to {} failed: {}'.format(sock_addr, e))
+                continue
+            self.__writes__.inc()
+
+    def __send_msg__(self):
+        """ 将 msg_out 中已有的消息一并转交给事件循环发送 """
+        while True:
+            try:
+                msg_obj = self.msg_out.get()
+            except KeyboardInterrupt:
+                break
+            if msg_obj is None:
+                break
+
+            msg_list, stopped = [msg_obj], False
+            while True:
+                try:
+                    msg_obj = self.msg_out.get_nowait()
+                except Empty:
+                    break
+                if msg_obj is None:
+                    stopped = True
+                    break
+                msg_list.append(msg_obj)
+            if any(not isinstance(var, SocketMessage) for var in msg_list):
+                raise NotImplementedError
+            self.__loop__.call_soon_threadsafe(self.__write_msgs__, msg_list)
+            if stopped is True:
+                break
+
+    def __server_process__(self):
+        asyncio.set_event_loop(self.__loop__)
+        self.__async_server__ = self.__loop__.run_until_complete(asyncio.start_server(
+            self.__handle_client__, sock=self.socket, backlog=1024,
+        ))
+        self.__loop__.run_forever()
+        self.__loop__.close()
+
+    async def __shutdown__(self):
+        self.__async_server__.close()
+        for writer in list(self.__writer_dict__.values()):
+            writer.close()
+        await self.__async_server__.wait_closed()
+        # 等待各连接的协程结束，避免事件循环停止时丢弃未完成的任务
+        tasks = [var for var in asyncio.all_tasks() if var is not asyncio.current_task()]
+        if len(tasks) > 0:
+            done, pending = await asyncio.wait(tasks, timeout=1.0)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+        self.__loop__.stop()
+
+    def start(self):
+        self.__loop__ = asyncio.new_event_loop()
+        self.__stop_event__.clear()
+
+        self.__send_tag__ = True
+        self.__send_thread__ = Thread(target=self.__send_msg__, name='socket message sending service')
+        self.__send_thread__.start()
+        self.log.debug('message sending started.')
+
+        self.__process_tag__ = True
+        self.__process_thread__ = Thread(target=self.process_msg, name='socket message process')
+        self.__process_thread__.start()
+        self.log.debug('message processing started.')
+
+        # 事件循环线程启动前即开始监听，避免连接被拒绝
+        self.socket.listen(1024)
+        self.__receive_tag__ = True
+        self.__server_tag__ = True
+        self.__server_thread__ = Thread(target=self.__server_process__, name='socket server event loop')
+        self.__server_thread__.start()
+
+        self.log.info('{} started.'.format(self.__class__.__name__))
+
+    def stop(self):
+        if self.__server_thread__ is None or self.__stop_event__.is_set():
+            return
+        self.__receive_tag__ = False
+        self.__server_tag__ = False
+
+        self.__process_tag__ = False
+        self.__stop_event__.set()
+        self.msg_in.put(None)
+        self.__join__(self.__process_thread__, 'message processing')
+
+        self.__send_tag__ = False
+        self.msg_out.put(None)
+        self.__join__(self.__send_thread__, 'message sending')
+
+        # 发送线程已将回复交给事件循环，关闭前写出的数据仍会被发送
+        if self.__loop__.is_running():
+            asyncio.run_coroutine_threadsafe(self.__shutdown__(), self.__loop__)
+        self.__join__(self.__server_thread__, 'server event loop')
+
+        self.__close_listener__()
+        self.__release_all__()
+
+        self.log.info('{} stopped.'.format(self.__class__.__name__))
@@ -0,0 +1,395 @@
+# -*- encoding: UTF-8 -*-
+"""
+Benchmark and load generation for Socketer.
+
+run_load starts a local server (threaded / async / reactor), drives concurrent clients against the echo
+path or the Wind path (served by StubWindEngine) and reports msgs/s, MB/s, latency percentiles,
+threads and CPU usage. It is also available as `socketer bench`.
+
+compare_servers compares connections per second and latency of the server engines,
+bench_wsdres compares WSDRes with the former list based result class and bench_serializers
+compares the installed message serializers and the cached date conversion.
+
+Usage:
+    python -m Socketer.Benchmark
+"""
+import datetime
+import json
+import random
+import socket
+import threading
+import time
+import tracemalloc
+
+from threading import Event, Thread
+
+from Socketer.ApplyWind import WindClient, WindServer, AsyncWindServer, ReactorWindServer, WSDRes
+from Socketer.AsyncServer import AsyncSocketServer
+from Socketer.Framing import FrameReader, send_frame
+from Socketer.Reactor import ReactorSocketServer
+from Socketer.Serializer import SERIALIZERS, format_dates, parse_dates
+from Socketer.Server import SocketServer, SocketMessage
+from Socketer.StubWind import StubWindEngine
+from Socketer.utils import SocketConstants
+
+
+class EchoServerMixin:
+    def process_msg(self):
+        while True:
+            msg_obj = self.msg_in.get()
+            if msg_obj is None:
+                break
+            self.msg_out.put(SocketMessage(msg_obj.addr, msg_obj.msg))
+
+
+class EchoSocketServer(EchoServerMixin, SocketServer):
+    pass
+
+
+class EchoAsyncSocketServer(EchoServerMixin, AsyncSocketServer):
+    pass
+
+
+class EchoReactorSocketServer(EchoServerMixin, ReactorSocketServer):
+    pass
+
+
+class StubEngineMixin:
+    """ 使用 StubWindEngine 代替 WindPy，关闭缓存及合并以测量完整的查询路径 """
+
+    def __init__(self, engine_latency: float = 0.0, **kwargs):
+        kwargs.setdefault('cache', False)
+        kwargs.setdefault('coalesce', False)
+        kwargs.setdefault('engine_factory', lambda: StubWindEngine(latency=engine_latency))
+        super(StubEngineMixin, self).__init__(**kwargs)
+
+
+class StubWindServer(StubEngineMixin, WindServer):
+    pass
+
+
+class StubAsyncWindServer(StubEngineMixin, AsyncWindServer):
+    pass
+
+
+class StubReactorWindServer(StubEngineMixin, ReactorWindServer):
+    pass
+
+
+class BenchClient(object):
+    """ 不启动线程的同步客户端，仅用于压测 """
+
+    def __init__(self, host: str, port: int, msg_encoding: str = 'utf-8'):
+        self.socket = socket.create_connection((host, port))
+        self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.__reader__ = FrameReader(self.socket)
+        self.__pending__ = list()
+        self.__msg_encoding__ = msg_encoding
+
+    def request(self, msg: str):
+        send_frame(self.socket, msg.encode(self.__msg_encoding__))
+        while len(self.__pending__) == 0:
+            frames = self.__reader__.feed()
+            if frames is None:
+                raise ConnectionError('connection closed by server')
+            self.__pending__.extend(frames)
+        flags, payload = self.__pending__.pop(0)
+        return payload.decode(self.__msg_encoding__)
+
+    def close(self):
+        try:
+            self.request(SocketConstants.CLIENT_EXIT_MSG)
+        finally:
+            self.socket.close()
+
+
+def percentile(values: list, pct: float):
+    if len(values) == 0:
+        return float('nan')
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, int(round(pct / 100.0 * len(values))) - 1))
+    return values[index]
+
+
+def bench_connections(host: str, port: int, n_connections: int):
+    """ 串行建立连接、完成一次往返并断开，返回每秒连接数 """
+    start = time.perf_counter()
+    for i in range(n_connections):
+        client = BenchClient(host, port)
+        client.request('ping')
+        client.close()
+    return n_connections / (time.perf_counter() - start)
+
+
+def bench_latency(host: str, port: int, n_clients: int, n_requests: int, msg_size: int):
+    """ n_clients 个并发客户端各发送 n_requests 个请求，返回所有请求的往返耗时（秒） """
+    msg = 'x' * msg_size
+    clients = [BenchClient(host, port) for i in range(n_clients)]
+    latencies = list()
+
+    def run(client: BenchClient):
+        local = list()
+        for i in range(n_requests):
+            t = time.perf_counter()
+            client.request(msg)
+            local.append(time.perf_counter() - t)
+        latencies.extend(local)
+
+    threads = [Thread(target=run, args=(client, )) for client in clients]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    for client in clients:
+        client.close()
+    return latencies, elapsed
+
+
+class ResourceSampler(object):
+    """ 后台采样线程数，并统计进程 CPU 时间 """
+
+    def __init__(self, interval: float = 0.05):
+        self.max_threads = threading.active_count()
+        self.__interval__ = interval
+        self.__stop_event__ = Event()
+        self.__thread__ = Thread(target=self.__sample__, name='benchmark resource sampler')
+        self.__cpu_start__ = None
+        self.__wall_start__ = None
+        self.cpu_time = 0.0
+        self.wall_time = 0.0
+
+    def __sample__(self):
+        while not self.__stop_event__.wait(self.__interval__):
+            self.max_threads = max(self.max_threads, threading.active_count())
+
+    def __enter__(self):
+        self.__cpu_start__, self.__wall_start__ = time.process_time(), time.perf_counter()
+        self.__thread__.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.__stop_event__.set()
+        self.__thread__.join()
+        self.cpu_time = time.process_time() - self.__cpu_start__
+        self.wall_time = time.perf_counter() - self.__wall_start__
+
+
+SERVER_CLASSES = {
+    ('threaded', 'echo'): EchoSocketServer,
+    ('async', 'echo'): EchoAsyncSocketServer,
+    ('reactor', 'echo'): EchoReactorSocketServer,
+    ('threaded', 'wind'): StubWindServer,
+    ('async', 'wind'): StubAsyncWindServer,
+    ('reactor', 'wind'): StubReactorWindServer,
+}
+
+
+def __paced__(n_requests: int, rate: float):
+    """ rate > 0 时按每秒 rate 个请求的节奏产生序号 """
+    start = time.perf_counter()
+    for i in range(n_requests):
+        if rate > 0:
+            delay = start + i / rate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        yield i
+
+
+def run_load(server: str = 'threaded', mode: str = 'echo', n_clients: int = 10, n_requests: int = 1000,
+             msg_size: int = 256, rate: float = 0.0, port: int = 14140,
+             n_codes: int = 50, n_days: int = 250, engine_latency: float = 0.0, compression: bool = False,
+             transport: str = 'tcp'):
+    """
+    Drive n_clients concurrent clients with n_requests requests each against a local server.
+
+    mode 'echo' sends msg_size byte messages to an echo server; mode 'wind' calls wsd for n_codes
+    codes over n_days days against a WindServer backed by StubWindEngine. rate limits the requests
+    per second of every client, 0 means as fast as possible. compression lets wind clients negotiate
+    frame compression. transport 'unix' runs wind mode over an AF_UNIX socket with the shared-memory
+    ring. Server and clients share this process, so CPU usage covers both.
+    """
+    if (server, mode) not in SERVER_CLASSES:
+        raise ValueError('param server/mode should be in {} but got {}/{}.'.format(
+            list(SERVER_CLASSES.keys()), server, mode))
+    server_class = SERVER_CLASSES[(server, mode)]
+    if mode == 'echo' and transport != 'tcp':
+        raise ValueError('param transport should be tcp in echo mode but got {}.'.format(transport))
+    kwargs = {'port': port, 'log_level': 'warn', 'transport': transport}
+    if mode == 'wind':
+        kwargs['engine_latency'] = engine_latency
+    socket_server = server_class(**kwargs)
+    socket_server.start()
+
+    host = socket.gethostname()
+    latencies = list()
+    if mode == 'echo':
+        clients = [BenchClient(host, port) for i in range(n_clients)]
+        msg = 'x' * msg_size
+        bytes_per_request = 2 * msg_size
+    else:
+        clients = [WindClient(host, port=port, compression=compression, transport=transport) for i in range(n_clients)]
+        for client in clients:
+            client.log.setLevel('WARNING')
+            client.start()
+        codes = ','.join('{:06d}.SZ'.format(i) for i in range(n_codes))
+        start_date = datetime.date(2010, 1, 1)
+        end_date = start_date + datetime.timedelta(days=n_days - 1)
+        bytes_per_request = 8 * n_codes * len(
+            [var for var in range(n_days) if (start_date + datetime.timedelta(days=var)).weekday() < 5])
+
+    def run(client):
+        local = list()
+        for i in __paced__(n_requests, rate):
+            t = time.perf_counter()
+            if mode == 'echo':
+                client.request(msg)
+            else:
+                client.wsd(codes, 'close', start_date, end_date)
+            local.append(time.perf_counter() - t)
+        latencies.extend(local)
+
+    threads = [Thread(target=run, args=(client, )) for client in clients]
+    try:
+        with ResourceSampler() as sampler:
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+    finally:
+        for client in clients:
+            if mode == 'echo':
+                client.close()
+            else:
+                client.stop()
+        socket_server.stop()
+
+    return {
+        'msgs/s': len(latencies) / sampler.wall_time,
+        'MB/s': len(latencies) * bytes_per_request / sampler.wall_time / 1024 / 1024,
+        'p50 ms': percentile(latencies, 50) * 1000,
+        'p99 ms': percentile(latencies, 99) * 1000,
+        'p999 ms': percentile(latencies, 99.9) * 1000,
+        'max threads': sampler.max_threads,
+        'cpu %': sampler.cpu_time / sampler.wall_time * 100,
+    }
+
+
+def format_report(name: str, result: dict):
+    return '{:<24s} {}'.format(name, '  '.join('{}: {:.2f}'.format(k, v) for k, v in result.items()))
+
+
+def compare_servers(port: int = 14120, n_connections: int = 200, n_clients: int = 50,
+                    n_requests: int = 100, msg_size: int = 256):
+    host = socket.gethostname()
+    report = dict()
+    for server_class in (EchoSocketServer, EchoAsyncSocketServer, EchoReactorSocketServer):
+        server = server_class(port=port, log_level='warn')
+        server.start()
+        # port 为 0 时各服务器使用系统分配的端口
+        server_port = server.socket.getsockname()[1]
+        try:
+            cps = bench_connections(host, server_port, n_connections)
+            latencies, elapsed = bench_latency(host, server_port, n_clients, n_requests, msg_size)
+        finally:
+            server.stop()
+        report[server_class.__name__] = {
+            'connections/s': cps,
+            'requests/s': len(latencies) / elapsed,
+            'p50 ms': percentile(latencies, 50) * 1000,
+            'p99 ms': percentile(latencies, 99) * 1000,
+        }
+        if port != 0:
+            port += 1
+    return report
+
+
+class LegacyWSDRes(object):
+    """ WSDRes before it was made compact, kept as the benchmark baseline """
+
+    def __init__(self, response: dict):
+        self.ErrorCode = response['ErrorCode']
+        self.Codes = response['Codes']
+        self.Fields = response['Fields']
+        self.Times = [datetime.datetime.strptime(var, '%Y%m%d').date() for var in response['Times']]
+        self.Data = response['Data']
+
+
+def make_wsd_response(n_codes: int = 500, n_times: int = 2500):
+    """ 构造与服务器 json 返回相同结构的 wsd 结果 """
+    start = datetime.date(2010, 1, 1)
+    return json.dumps({
+        'id': 1, 'status': 0, 'ErrorCode': 0,
+        'Codes': ['{:06d}.SZ'.format(i) for i in range(n_codes)], 'Fields': ['CLOSE'],
+        'Times': [(start + datetime.timedelta(days=j)).strftime('%Y%m%d') for j in range(n_times)],
+        'Data': [[round(random.random() * 100, 2) for j in range(n_times)] for i in range(n_codes)],
+    })
+
+
+def bench_wsdres(n_codes: int = 500, n_times: int = 2500, n_results: int = 5):
+    """ 解析后的 json 交由各结果类构造，统计构造耗时与保留内存 """
+    msg = make_wsd_response(n_codes, n_times)
+    report = dict()
+    for res_class in (LegacyWSDRes, WSDRes):
+        tracemalloc.start()
+        kept, elapsed, elapsed_times = list(), 0.0, 0.0
+        for i in range(n_results):
+            response = json.loads(msg)
+            t = time.perf_counter()
+            res = res_class(response)
+            elapsed += time.perf_counter() - t
+            del response
+            t = time.perf_counter()
+            res.Times
+            elapsed_times += time.perf_counter() - t
+            kept.append(res)
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        report[res_class.__name__] = {
+            'construct ms': elapsed / n_results * 1000,
+            'first Times ms': elapsed_times / n_results * 1000,
+            'retained MB': current / n_results / 1024 / 1024,
+        }
+    return report
+
+
+def bench_serializers(n_codes: int = 500, n_times: int = 2500, n_rounds: int = 5):
+    """ 各 serializer 读写 wsd 结果的耗时与大小，以及逐个 strftime / strptime 与缓存转换日期的耗时 """
+    start = datetime.date(2010, 1, 1)
+    dates = [start + datetime.timedelta(days=j) for j in range(n_times)]
+    data = [[round(random.random() * 100, 2) for j in range(n_times)] for i in range(n_codes)]
+    codes = ['{:06d}.SZ'.format(i) for i in range(n_codes)]
+
+    def timed(func):
+        t = time.perf_counter()
+        for i in range(n_rounds):
+            result = func()
+        return (time.perf_counter() - t) / n_rounds * 1000, result
+
+    report = dict()
+    for name, serializer in SERIALIZERS.items():
+        encode_ms, msg = timed(lambda: serializer.dumps({
+            'id': 1, 'status': 0, 'ErrorCode': 0, 'Codes': codes, 'Fields': ['CLOSE'],
+            'Times': format_dates(dates), 'Data': data,
+        }))
+        decode_ms, response = timed(lambda: serializer.loads(msg))
+        report[name] = {'encode ms': encode_ms, 'decode ms': decode_ms, 'size MB': len(msg) / 1024 / 1024}
+
+    texts = format_dates(dates)
+    report['dates'] = {
+        'strftime ms': timed(lambda: [var.strftime('%Y%m%d') for var in dates])[0],
+        'format_dates ms': timed(lambda: format_dates(dates))[0],
+        'strptime ms': timed(lambda: [datetime.datetime.strptime(var, '%Y%m%d').date() for var in texts])[0],
+        'parse_dates ms': timed(lambda: parse_dates(texts))[0],
+    }
+    return report
+
+
+if __name__ == '__main__':
+    for name, result in compare_servers().items():
+        print(format_report(name, result))
+    for name, result in bench_wsdres().items():
+        print(format_report(name, result))
+    for name, result in bench_serializers().items():
+        print(format_report(name, result))
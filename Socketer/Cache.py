@@ -0,0 +1,286 @@
+# -*- encoding: UTF-8 -*-
+import datetime
+import time
+
+from collections import OrderedDict
+from concurrent.futures import Future
+from threading import Lock
+
+
+def to_date(value):
+    """ 将 date / datetime / 'YYYYMMDD' / 'YYYY-MM-DD' 转为 date，无法识别（如 '-5D'）时返回 None """
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    elif isinstance(value, datetime.date):
+        return value
+    elif isinstance(value, str):
+        for fmt in ('%Y%m%d', '%Y-%m-%d'):
+            try:
+                return datetime.datetime.strptime(value.strip(), fmt).date()
+            except ValueError:
+                continue
+    return None
+
+
+# Wind 对区间内没有数据（如没有交易日）的查询返回的 ErrorCode
+WSD_NO_DATA = -40520007
+
+
+def is_daily(options: str):
+    """ 缓存按日期切分结果，只适用于日频数据：Period 不为 D 或指定了 Days 的请求返回 False """
+    for item in str(options or '').split(';'):
+        key, sep, value = item.partition('=')
+        key, value = key.strip().lower(), value.strip().upper()
+        if key == 'period' and value not in ('', 'D'):
+            return False
+        elif key == 'days':
+            return False
+    return True
+
+
+class WSDData(object):
+    """ engine.wsd 结果的最小替代，字段与 WindPy 返回值一致 """
+
+    def __init__(self, error_code: int, codes: list, fields: list, times: list, data: list):
+        self.ErrorCode = error_code
+        self.Codes = codes
+        self.Fields = fields
+        self.Times = times
+        self.Data = data
+
+
+class WSDCacheEntry(object):
+    ONE_DAY = datetime.timedelta(days=1)
+
+    def __init__(self, codes: list, fields: list):
+        self.codes = codes
+        self.fields = fields
+        self.rows = dict()
+        self.covered = list()
+        self.created = time.monotonic()
+        self.size = 0
+
+    def missing(self, start: datetime.date, end: datetime.date):
+        """ 返回 [start, end] 中尚未缓存的日期区间 """
+        segments = list()
+        cursor = start
+        for covered_start, covered_end in self.covered:
+            if covered_end < cursor:
+                continue
+            if covered_start > end:
+                break
+            if covered_start > cursor:
+                segments.append((cursor, covered_start - self.ONE_DAY))
+            cursor = max(cursor, covered_end + self.ONE_DAY)
+            if cursor > end:
+                break
+        if cursor <= end:
+            segments.append((cursor, end))
+        return segments
+
+    def merge(self, start: datetime.date, end: datetime.date, res):
+        """ 保存 res 的全部行，并将 [start, end] 记为已缓存，start > end 时只保存行 """
+        n_rows = len(res.Data)
+        for j, t in enumerate(res.Times):
+            t = to_date(t)
+            if t not in self.rows:
+                self.size += 100 + 24 * n_rows
+            self.rows[t] = tuple(res.Data[i][j] for i in range(n_rows))
+        if start > end:
+            return
+
+        covered = sorted(self.covered + [(start, end)])
+        self.covered = [covered[0]]
+        for covered_start, covered_end in covered[1:]:
+            last_start, last_end = self.covered[-1]
+            if covered_start <= last_end + self.ONE_DAY:
+                self.covered[-1] = (last_start, max(last_end, covered_end))
+            else:
+                self.covered.append((covered_start, covered_end))
+
+    def slice(self, start: datetime.date, end: datetime.date):
+        times = sorted(var for var in self.rows if start <= var <= end)
+        n_rows = len(self.codes) if len(self.codes) > 1 else len(self.fields)
+        data = [[self.rows[t][i] for t in times] for i in range(n_rows)]
+        return WSDData(0, list(self.codes), list(self.fields), times, data)
+
+
+class WSDCache(object):
+    """
+    Per-date cache of wsd results keyed on (codes, fields, options).
+
+    A query whose date range is partly cached only asks the engine for the missing segments; a
+    segment without data (WSD_NO_DATA, e.g. no trading day in it) is cached as empty. Entries are
+    sliced by date, so only daily queries are cached, see is_daily. The last volatile_days days
+    (today included) may still change: they are returned from the engine on every query and never
+    marked as covered.
+    Entries are evicted least-recently-used when max_entries / max_bytes is exceeded and expire
+    ttl seconds after they were created.
+    """
+
+    def __init__(self, ttl: float = 3600.0, max_entries: int = 1024, max_bytes: int = 256 * 1024 * 1024,
+                 volatile_days: int = 1):
+        self.__ttl__ = ttl
+        self.__max_entries__ = max_entries
+        self.__max_bytes__ = max_bytes
+        self.__volatile_days__ = volatile_days
+
+        self.__entry_dict__ = OrderedDict()
+        self.__lock__ = Lock()
+        self.__bytes__ = 0
+
+        self.__hits__ = 0
+        self.__partial_hits__ = 0
+        self.__misses__ = 0
+        self.__engine_calls__ = 0
+        self.__evictions__ = 0
+
+    @staticmethod
+    def make_key(codes: str, fields: str, options: str):
+        return (
+            ','.join(var.strip().upper() for var in str(codes).split(',')),
+            ','.join(var.strip().lower() for var in str(fields).split(',')),
+            str(options or '').strip(),
+        )
+
+    def __get_entry__(self, key):
+        """ 调用前需持有 __lock__ """
+        entry = self.__entry_dict__.get(key, None)
+        if entry is None:
+            return None
+        if time.monotonic() - entry.created > self.__ttl__:
+            self.__remove__(key)
+            return None
+        self.__entry_dict__.move_to_end(key)
+        return entry
+
+    def __remove__(self, key):
+        entry = self.__entry_dict__.pop(key)
+        self.__bytes__ -= entry.size
+
+    def __evict__(self):
+        while len(self.__entry_dict__) > 0 and (
+                len(self.__entry_dict__) > self.__max_entries__ or self.__bytes__ > self.__max_bytes__):
+            self.__remove__(next(iter(self.__entry_dict__)))
+            self.__evictions__ += 1
+
+    def query(self, fetch, codes: str, fields: str, start_date, end_date, options: str = ''):
+        """
+        fetch(codes, fields, start_date, end_date, options) is called for every missing date segment.
+        Requests with relative dates (e.g. '-5D') or non-daily options are passed to fetch uncached.
+        """
+        start, end = to_date(start_date), to_date(end_date)
+        if start is None or end is None or start > end or not is_daily(options):
+            with self.__lock__:
+                self.__misses__ += 1
+                self.__engine_calls__ += 1
+            return fetch(codes, fields, start_date, end_date, options)
+
+        key = self.make_key(codes, fields, options)
+        with self.__lock__:
+            entry = self.__get_entry__(key)
+            segments = entry.missing(start, end) if entry is not None else [(start, end)]
+            if len(segments) == 0:
+                self.__hits__ += 1
+                return entry.slice(start, end)
+            elif entry is not None:
+                self.__partial_hits__ += 1
+            else:
+                self.__misses__ += 1
+            self.__engine_calls__ += len(segments)
+
+        fetched, no_data = list(), None
+        for segment_start, segment_end in segments:
+            res = fetch(codes, fields, segment_start, segment_end, options)
+            if res.ErrorCode == WSD_NO_DATA:
+                # 无数据的区间视为空，已缓存及其余区间的数据仍然有效
+                no_data, res = res, WSDData(0, res.Codes, res.Fields, [], [])
+            elif res.ErrorCode != 0:
+                return res
+            fetched.append((segment_start, segment_end, res))
+        if entry is None and all(len(var[2].Times) == 0 for var in fetched):
+            # 整个区间均无数据时保留引擎的返回
+            return no_data if no_data is not None else fetched[0][2]
+
+        with self.__lock__:
+            entry = self.__get_entry__(key)
+            if entry is None:
+                source = next((var[2] for var in fetched if len(var[2].Times) > 0), fetched[0][2])
+                entry = WSDCacheEntry(list(source.Codes), list(source.Fields))
+                self.__entry_dict__[key] = entry
+            self.__bytes__ -= entry.size
+            # 易变窗口内的行只用于本次结果，不计入已缓存区间，下次查询仍向引擎获取
+            stable = datetime.date.today() - datetime.timedelta(days=self.__volatile_days__)
+            for segment_start, segment_end, res in fetched:
+                entry.merge(segment_start, min(segment_end, stable), res)
+            self.__bytes__ += entry.size
+            result = entry.slice(start, end)
+            self.__evict__()
+        return result
+
+    def clear(self):
+        with self.__lock__:
+            self.__entry_dict__.clear()
+            self.__bytes__ = 0
+
+    def stats(self):
+        with self.__lock__:
+            return {
+                'entries': len(self.__entry_dict__),
+                'bytes': self.__bytes__,
+                'hits': self.__hits__,
+                'partial_hits': self.__partial_hits__,
+                'misses': self.__misses__,
+                'engine_calls': self.__engine_calls__,
+                'evictions': self.__evictions__,
+            }
+
+
+class SingleFlight(object):
+    """
+    Coalesce identical concurrent calls: the first caller of a key runs func, callers arriving
+    while it is in flight wait for and share its result (or exception). Results are shared
+    objects and must not be modified by the callers. saved_counter (e.g. a metrics Counter) is
+    incremented for every call served by another one.
+    """
+
+    def __init__(self, saved_counter=None):
+        self.__saved_counter__ = saved_counter
+        self.__flight_dict__ = dict()
+        self.__lock__ = Lock()
+        self.__calls__ = 0
+        self.__saved__ = 0
+
+    def do(self, key, func, *args):
+        with self.__lock__:
+            future = self.__flight_dict__.get(key, None)
+            leader = future is None
+            if leader is True:
+                future = self.__flight_dict__[key] = Future()
+                self.__calls__ += 1
+            else:
+                self.__saved__ += 1
+        if leader is False:
+            if self.__saved_counter__ is not None:
+                self.__saved_counter__.inc()
+            return future.result()
+
+        try:
+            result = func(*args)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self.__lock__:
+                self.__flight_dict__.pop(key, None)
+
+    def stats(self):
+        with self.__lock__:
+            return {
+                'in_flight': len(self.__flight_dict__),
+                'calls': self.__calls__,
+                'saved': self.__saved__,
+            }
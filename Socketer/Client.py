@@ -1,21 +1,44 @@
 # -*- encoding: UTF-8 -*-
 import socket
-import time
 
-from queue import Queue, Empty
-from threading import Thread, Lock
+from queue import Queue
+from threading import Event, Thread, Lock
 
-from Socketer.utils import get_logger, SocketConstants
+from Socketer.Compression import DEFAULT_THRESHOLD, FrameCompression, compression_stats, offer, pack_hello, \
+    unpack_hello
+from Socketer.Framing import FrameConstants, FrameReader, FrameError, send_frame
+from Socketer.Metrics import MetricsRegistry
+from Socketer.Transport import ShmReader, address, check_transport, make_socket, shared_memory, unpack_shm
+from Socketer.utils import DEFAULT_LOG_LEVEL, MessageLog, get_logger, SocketConstants
 
 
 class SocketClient(SocketConstants):
+    """
+    compression: True offers every installed codec in the connection handshake, False skips the
+    handshake, or a list of codec names in order of preference. Frames of at least
+    compress_threshold bytes are compressed once the server agreed on a codec.
 
-    def __init__(self, host: str, port: int = 33331, bufsize: int = 1024,
-                 time_out: float = 1.0, msg_encoding: str = 'utf-8'):
-        self.log = get_logger(self.__class__.__name__)
+    transport 'tcp' connects host:port, 'unix' the AF_UNIX socket unix_path of a server on the
+    same machine. shm asks such a server for a shared-memory ring carrying large replies; None
+    asks for it on 'unix' only.
+    """
 
-        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.socket.settimeout(time_out)
+    MAX_RECONNECT_BACKOFF = 30.0
+
+    def __init__(self, host: str, port: int = 33331, bufsize: int = 64 * 1024,
+                 time_out: float = 1.0, msg_encoding: str = 'utf-8', max_frame_size: int = None,
+                 reconnect_retries: int = 5, reconnect_backoff: float = 0.5,
+                 compression=True, compress_threshold: int = DEFAULT_THRESHOLD,
+                 transport: str = 'tcp', unix_path: str = None, shm: bool = None,
+                 log_level=DEFAULT_LOG_LEVEL, log_sample: int = 1):
+        check_transport(transport)
+        self.log = get_logger(self.__class__.__name__, log_level=log_level)
+        self.msg_log = MessageLog(self.log, sample=log_sample)
+        self.metrics = MetricsRegistry()
+
+        self.__time_out__ = time_out
+        self.__transport__ = transport
+        self.socket = self.__new_socket__()
         self.msg_in = Queue()
         self.msg_out = Queue()
         self.msg_lock = Lock()
@@ -24,6 +47,19 @@ class SocketClient(SocketConstants):
         self.__port__ = port
         self.__msg_encoding__ = msg_encoding
         self.__bufsize__ = bufsize
+        self.__max_frame_size__ = max_frame_size
+        self.__reconnect_retries__ = reconnect_retries
+        self.__reconnect_backoff__ = reconnect_backoff
+        self.__compression_offer__ = offer(compression)
+        self.__compress_threshold__ = compress_threshold
+        self.__address__ = address(transport, host, port, unix_path)
+        self.__shm_wanted__ = (transport == 'unix' if shm is None else shm) and shared_memory is not None
+        self.__stop_event__ = Event()
+
+        self.compression = None
+        self.shm = None
+        self.__reader__ = None
+        self.__early_frames__ = list()
 
         self.__send_thread__ = None
         self.__send_tag__ = False
@@ -31,39 +67,167 @@ class SocketClient(SocketConstants):
         self.__receive_thread__ = None
         self.__receive_tag__ = False
 
-    def __send_msg__(self):
-        while self.__send_tag__ is True:
+    def __new_socket__(self):
+        new_socket = make_socket(self.__transport__)
+        new_socket.settimeout(self.__time_out__)
+        return new_socket
+
+    def __connect__(self):
+        """ time_out 仅用于建立连接及握手，连接后阻塞读写，由关闭 socket 唤醒 """
+        self.socket.connect(self.__address__)
+        self.__reader__ = FrameReader(self.socket, bufsize=self.__bufsize__, max_frame_size=self.__max_frame_size__)
+        self.__early_frames__ = list()
+        self.compression = None
+        self.__close_shm__()
+        if len(self.__compression_offer__) > 0 or self.__shm_wanted__ is True:
+            self.__handshake__()
+        self.socket.settimeout(None)
+
+    def __handshake__(self):
+        """ 发送握手帧并等待服务器选定的压缩编码及共享内存 """
+        hello = pack_hello(self.__compression_offer__, shm=True) if self.__shm_wanted__ is True \
+            else pack_hello(self.__compression_offer__)
+        send_frame(self.socket, hello, FrameConstants.FLAG_CONTROL)
+        while True:
+            frames = self.__reader__.feed()
+            if frames is None:
+                raise ConnectionError('connection closed by server {} during handshake'.format(self.__host__))
+            for i, (flags, payload) in enumerate(frames):
+                if flags & FrameConstants.FLAG_CONTROL:
+                    codec, shm = unpack_hello(payload), unpack_shm(payload)
+                    if codec is not None:
+                        self.compression = FrameCompression(codec, self.__compress_threshold__, self.metrics,
+                                                            self.__max_frame_size__)
+                    if isinstance(shm, dict):
+                        self.shm = ShmReader(shm['name'], shm['size'])
+                    self.__early_frames__.extend(frames[i + 1:])
+                    self.log.debug('compression %s negotiated with %s, shared memory %s.', codec, self.__host__,
+                                   shm['name'] if isinstance(shm, dict) else None)
+                    return
+                self.__early_frames__.append((flags, payload))
+
+    def __close_shm__(self):
+        if self.shm is not None:
+            self.shm.close()
+            self.shm = None
+
+    def stats(self):
+        return {
+            'compression': compression_stats(self.metrics),
+            'codec': self.compression.codec.name if self.compression is not None else None,
+            'transport': self.__transport__,
+            'shm': self.shm is not None,
+        }
+
+    def on_reconnect(self):
+        """ 重新连接成功后调用，断线期间发出的消息可能已丢失 """
+        pass
+
+    def reconnect(self):
+        """ 以指数退避重试连接，旧 socket 已不可用，每次使用新的 socket """
+        delay = self.__reconnect_backoff__
+        for i in range(self.__reconnect_retries__):
             try:
-                msg_obj = self.msg_out.get(timeout=1)
-            except Empty:
+                self.socket.close()
+                self.socket = self.__new_socket__()
+                self.__connect__()
+            except OSError as e:
+                self.log.warning('reconnect to server {} failed ({}/{}): {}'.format(
+                    self.__host__, i + 1, self.__reconnect_retries__, e))
+                if self.__stop_event__.wait(delay):
+                    return False
+                delay = min(delay * 2, self.MAX_RECONNECT_BACKOFF)
                 continue
+            self.log.info('redo connect to server {}'.format(self.__host__))
+            self.on_reconnect()
+            return True
+        return False
+
+    def is_alive(self):
+        return self.__receive_thread__ is not None and self.__receive_thread__.is_alive() \
+            and self.__send_thread__ is not None and self.__send_thread__.is_alive()
+
+    def __send_msg__(self):
+        while True:
+            try:
+                msg_obj = self.msg_out.get()
             except KeyboardInterrupt:
                 break
-            self.socket.sendall(msg_obj.encode(self.__msg_encoding__))
-            self.log.debug('message to {}: {}'.format(self.__host__, msg_obj))
+            if msg_obj is None:
+                break
+            if isinstance(msg_obj, bytes):
+                payload, flags = msg_obj, FrameConstants.FLAG_BINARY
+            else:
+                payload, flags = msg_obj.encode(self.__msg_encoding__), FrameConstants.FLAG_TEXT
+            compression = self.compression
+            try:
+                if compression is not None:
+                    payload, flags = compression.encode(payload, flags)
+                send_frame(self.socket, payload, flags)
+            except OSError as e:
+                self.log.warning('message to {} dropped: {}'.format(self.__host__, e))
+                continue
+            self.msg_log.debug('message to %s: %s', self.__host__, msg_obj)
+
+    def __abort__(self, reason: str):
+        """ 收到无法处理的帧时关闭连接，由接收线程调用后退出 """
+        self.log.error('{} from {}, connection closed.'.format(reason, self.__host__))
+        try:
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
 
     def __receive_msg__(self):
+        reader, frames = self.__reader__, self.__early_frames__
         while self.__receive_tag__ is True:
             try:
-                msg = self.socket.recv(self.__bufsize__).decode(self.__msg_encoding__)
-                if len(msg) == 0:
+                frames = frames if len(frames) > 0 else reader.feed()
+            except FrameError as e:
+                self.log.error('invalid frame from {}: {}'.format(self.__host__, e))
+                break
+            except OSError as e:
+                if self.__receive_tag__ is True:
+                    self.log.warning('connection to server {} lost: {}'.format(self.__host__, e))
+                frames = None
+            except KeyboardInterrupt:
+                break
+
+            if frames is None:
+                if self.__receive_tag__ is False:
+                    break
+                self.log.info('connection closed by server {}'.format(self.__host__))
+                if self.reconnect() is True:
+                    reader, frames = self.__reader__, self.__early_frames__
                     continue
-                self.log.debug('message from {}: {}'.format(self.__host__, msg))
+                break
+
+            received, frames = frames, list()
+            for flags, payload in received:
+                if flags & FrameConstants.FLAG_SHM:
+                    if self.shm is None:
+                        self.__abort__('shared-memory frame without a negotiated ring')
+                        return
+                    payload, flags = self.shm.read(payload), flags & ~FrameConstants.FLAG_SHM
+                if self.compression is not None:
+                    try:
+                        payload, flags = self.compression.decode(payload, flags)
+                    except Exception as e:
+                        self.__abort__('invalid compressed frame ({})'.format(e))
+                        return
+                if flags & FrameConstants.FLAG_BINARY:
+                    msg = payload
+                else:
+                    msg = payload.decode(self.__msg_encoding__)
+                self.msg_log.debug('message from %s: %s', self.__host__, msg)
                 if msg == self.CLIENT_EXIT_MSG:
-                    break
+                    return
                 else:
                     self.msg_in.put(msg)
-            except ConnectionResetError:
-                self.socket.connect((self.__host__, self.__port__))
-                self.log.info('redo connect to server {}'.format(self.__host__))
-            except socket.timeout:
-                continue
-            except KeyboardInterrupt:
-                break
 
     def start(self):
         self.log.info('connect to server {}'.format(self.__host__))
-        self.socket.connect((self.__host__, self.__port__))
+        self.__stop_event__.clear()
+        self.__connect__()
 
         self.__send_tag__ = True
         self.__send_thread__ = Thread(target=self.__send_msg__, name='send socket message')
@@ -78,27 +242,29 @@ class SocketClient(SocketConstants):
         self.log.info('{} started.'.format(self.__class__.__name__))
 
     def stop(self):
-        self.msg_out.put(self.CLIENT_EXIT_MSG)
-
-        while self.msg_out.empty() is False:
-            time.sleep(0.1)
-        self.log.debug('all task processed send.')
+        if self.__send_thread__ is None or self.__stop_event__.is_set():
+            return
+        self.__stop_event__.set()
 
-        self.__send_tag__ = False
-        self.__send_thread__.join(5)
+        # 退出消息之后放入 None，发送线程发完全部消息后退出
+        self.msg_out.put(self.CLIENT_EXIT_MSG)
+        self.msg_out.put(None)
+        self.__send_thread__.join(self.__time_out__)
         self.log.debug('message sending stopped.')
 
-        self.msg_lock.acquire()
-        while self.msg_in.empty() is False:
-            time.sleep(0.1)
-        self.log.debug('all message received processed.')
-
+        # 服务器回送退出消息后接收线程退出，超时则关闭 socket 唤醒
+        self.__receive_thread__.join(self.__time_out__)
         self.__receive_tag__ = False
-        self.__receive_thread__.join(10)
+        if self.__receive_thread__.is_alive():
+            try:
+                self.socket.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self.__receive_thread__.join(self.__time_out__)
         self.log.debug('message receiving stopped.')
 
-        # self.socket.shutdown(socket.SHUT_RDWR)
         self.socket.close()
+        self.__close_shm__()
         self.log.info('{} stopped.'.format(self.__class__.__name__))
 
 
@@ -109,7 +275,6 @@ if __name__ == '__main__':
     new_server.start()
     new_client = SocketClient(socket.gethostname(), port=p)
     new_client.start()
-    time.sleep(2)
     try:
         new_client.msg_out.put('test client send')
         s = new_server.msg_in.get()
@@ -0,0 +1,201 @@
+# -*- encoding: UTF-8 -*-
+import time
+
+from collections import deque
+from contextlib import contextmanager
+from threading import Condition, Event, Thread
+
+from Socketer.Client import SocketClient
+from Socketer.utils import get_logger
+
+
+class SocketClientPool(object):
+    """
+    Pool of started clients of client_class, created with client_kwargs.
+
+        pool = SocketClientPool(WindClient, min_size=2, max_size=8, host='wind-box')
+        with pool.borrow() as client:
+            client.wsd(...)
+
+    A maintenance thread keeps at least min_size clients warm, closes clients idle longer than
+    max_idle_time and replaces clients failing health_check (default: client.is_alive()).
+    """
+
+    def __init__(self, client_class=SocketClient, min_size: int = 1, max_size: int = 8,
+                 max_idle_time: float = 300.0, check_interval: float = 30.0, health_check=None, **client_kwargs):
+        if not 0 <= min_size <= max_size or max_size < 1:
+            raise ValueError('param min_size/max_size should satisfy 0 <= min_size <= max_size and max_size >= 1 '
+                             'but got {}/{}.'.format(min_size, max_size))
+        self.log = get_logger(self.__class__.__name__, log_level='info')
+
+        self.__client_class__ = client_class
+        self.__client_kwargs__ = client_kwargs
+        self.__min_size__ = min_size
+        self.__max_size__ = max_size
+        self.__max_idle_time__ = max_idle_time
+        self.__check_interval__ = check_interval
+        self.__health_check__ = health_check if health_check is not None else lambda client: client.is_alive()
+
+        self.__idle__ = deque()
+        self.__size__ = 0
+        self.__condition__ = Condition()
+        self.__closed__ = False
+        self.__stop_event__ = Event()
+        self.__maintain_thread__ = None
+
+        self.__created__ = 0
+        self.__evicted__ = 0
+        self.__replaced__ = 0
+
+    def __create__(self):
+        client = self.__client_class__(**self.__client_kwargs__)
+        client.start()
+        self.__created__ += 1
+        return client
+
+    def __close_client__(self, client):
+        try:
+            client.stop()
+        except Exception as e:
+            self.log.warning('stop client {} failed: {}'.format(client, e))
+
+    def __is_healthy__(self, client):
+        try:
+            return self.__health_check__(client) is True
+        except Exception as e:
+            self.log.warning('health check of client {} failed: {}'.format(client, e))
+            return False
+
+    def acquire(self, timeout: float = None):
+        """ 取出一个空闲连接，没有空闲且未达到 max_size 时新建，否则等待至 timeout """
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        with self.__condition__:
+            while True:
+                if self.__closed__ is True:
+                    raise RuntimeError('{} closed.'.format(self.__class__.__name__))
+                if len(self.__idle__) > 0:
+                    client, last_used = self.__idle__.pop()
+                    break
+                if self.__size__ < self.__max_size__:
+                    self.__size__ += 1
+                    client = None
+                    break
+                remaining = deadline - time.monotonic() if deadline is not None else None
+                if remaining is not None and remaining <= 0:
+                    raise TimeoutError('no client available in {} seconds.'.format(timeout))
+                self.__condition__.wait(remaining)
+
+        if client is not None and self.__is_healthy__(client):
+            return client
+        if client is not None:
+            self.__replaced__ += 1
+            self.__close_client__(client)
+        try:
+            return self.__create__()
+        except Exception:
+            with self.__condition__:
+                self.__size__ -= 1
+                self.__condition__.notify()
+            raise
+
+    def release(self, client, broken: bool = False):
+        """ 归还连接，broken 为 True 或连接池已关闭时直接关闭该连接 """
+        with self.__condition__:
+            if broken is False and self.__closed__ is False:
+                self.__idle__.append((client, time.monotonic()))
+                self.__condition__.notify()
+                return
+            self.__size__ -= 1
+            self.__condition__.notify()
+        self.__close_client__(client)
+
+    @contextmanager
+    def borrow(self, timeout: float = None):
+        client = self.acquire(timeout)
+        try:
+            yield client
+        except (ConnectionError, OSError):
+            self.release(client, broken=True)
+            raise
+        except BaseException:
+            self.release(client)
+            raise
+        else:
+            self.release(client)
+
+    def __maintain__(self):
+        while not self.__stop_event__.wait(self.__check_interval__):
+            now = time.monotonic()
+            to_close, to_check = list(), list()
+            with self.__condition__:
+                while len(self.__idle__) > 0:
+                    client, last_used = self.__idle__.popleft()
+                    if now - last_used > self.__max_idle_time__ and self.__size__ > self.__min_size__:
+                        self.__size__ -= 1
+                        self.__evicted__ += 1
+                        to_close.append(client)
+                    else:
+                        to_check.append((client, last_used))
+
+            for client in to_close:
+                self.__close_client__(client)
+            for client, last_used in to_check:
+                if self.__is_healthy__(client):
+                    self.__return_idle__(client, last_used)
+                else:
+                    self.__replaced__ += 1
+                    self.release(client, broken=True)
+            self.__fill__()
+
+    def __return_idle__(self, client, last_used: float):
+        with self.__condition__:
+            self.__idle__.append((client, last_used))
+            self.__condition__.notify()
+
+    def __fill__(self):
+        """ 补足 min_size 个连接 """
+        while True:
+            with self.__condition__:
+                if self.__closed__ is True or self.__size__ >= self.__min_size__:
+                    return
+                self.__size__ += 1
+            try:
+                client = self.__create__()
+            except Exception as e:
+                self.log.warning('create client failed: {}'.format(e))
+                with self.__condition__:
+                    self.__size__ -= 1
+                return
+            self.release(client)
+
+    def start(self):
+        self.__fill__()
+        self.__maintain_thread__ = Thread(target=self.__maintain__, name='socket client pool maintenance')
+        self.__maintain_thread__.daemon = True
+        self.__maintain_thread__.start()
+        self.log.info('{} started with {} clients.'.format(self.__class__.__name__, self.__size__))
+
+    def close(self):
+        self.__stop_event__.set()
+        if self.__maintain_thread__ is not None:
+            self.__maintain_thread__.join()
+        with self.__condition__:
+            self.__closed__ = True
+            idle = [var[0] for var in self.__idle__]
+            self.__idle__.clear()
+            self.__size__ -= len(idle)
+            self.__condition__.notify_all()
+        for client in idle:
+            self.__close_client__(client)
+        self.log.info('{} closed.'.format(self.__class__.__name__))
+
+    def stats(self):
+        with self.__condition__:
+            return {
+                'size': self.__size__,
+                'idle': len(self.__idle__),
+                'in_use': self.__size__ - len(self.__idle__),
+                'created': self.__created__,
+                'evicted': self.__evicted__,
+                'replaced': self.__replaced__,
+            }
@@ -0,0 +1,158 @@
+# -*- encoding: UTF-8 -*-
+"""
+Per-connection frame compression.
+
+The client offers its codecs in a FLAG_CONTROL frame right after connecting:
+
+    {"compression": ["lz4", "zlib"]}
+
+and the server answers with the first offered codec it also supports, or null:
+
+    {"compression": "zlib"}
+
+Afterwards either side compresses frames of at least threshold bytes and marks them with
+FLAG_COMPRESSED. zlib keeps one compress / decompress stream per connection, so every frame
+benefits from the history of the previous ones. A frame decompressing to more than
+max_frame_size bytes is rejected with FrameError before the output is materialized.
+"""
+import json
+import time
+import zlib
+
+from Socketer.Framing import FrameConstants, FrameError
+from Socketer.Metrics import MetricsRegistry
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+
+class ZlibCodec(object):
+    name = 'zlib'
+
+    def __init__(self, level: int = 1):
+        self.__compressor__ = zlib.compressobj(level)
+        self.__decompressor__ = zlib.decompressobj()
+
+    def compress(self, data: bytes):
+        # sync flush 使每帧可单独解压，同时保留流的字典
+        return self.__compressor__.compress(data) + self.__compressor__.flush(zlib.Z_SYNC_FLUSH)
+
+    def decompress(self, data: bytes, max_size: int):
+        raw = self.__decompressor__.decompress(data, max_size)
+        if len(self.__decompressor__.unconsumed_tail) > 0:
+            raise FrameError('compressed frame exceeds max frame size {}'.format(max_size))
+        return raw
+
+
+class Lz4Codec(object):
+    name = 'lz4'
+
+    def __init__(self, level: int = 0):
+        self.__compressor__ = lz4.frame.LZ4FrameCompressor(compression_level=level)
+
+    def compress(self, data: bytes):
+        return self.__compressor__.begin(len(data)) + self.__compressor__.compress(data) + self.__compressor__.flush()
+
+    def decompress(self, data: bytes, max_size: int):
+        if lz4.frame.get_frame_info(data)['content_size'] > max_size:
+            raise FrameError('compressed frame exceeds max frame size {}'.format(max_size))
+        decompressor = lz4.frame.LZ4FrameDecompressor()
+        raw = decompressor.decompress(data, max_length=max_size)
+        if decompressor.eof is False:
+            raise FrameError('compressed frame exceeds max frame size {}'.format(max_size))
+        return raw
+
+
+# 按优先顺序排列，仅包含已安装的实现
+CODECS = dict(([('lz4', Lz4Codec)] if lz4 is not None else []) + [('zlib', ZlibCodec)])
+DEFAULT_THRESHOLD = 1024
+
+
+def offer(compression):
+    """ compression: True 表示全部可用编码，False / None 表示不压缩，或编码名称列表 """
+    if compression is True:
+        return list(CODECS.keys())
+    if not compression:
+        return list()
+    return [var for var in compression if var in CODECS]
+
+
+def negotiate(offered: list, supported: list):
+    for var in offered:
+        if var in supported:
+            return var
+    return None
+
+
+def pack_hello(codecs, **options):
+    """ options 为握手帧中的其他项，如共享内存传输的 shm """
+    hello = {'compression': codecs}
+    hello.update(options)
+    return json.dumps(hello).encode('utf-8')
+
+
+def unpack_hello(payload: bytes):
+    return json.loads(payload.decode('utf-8')).get('compression', None)
+
+
+def __counters__(metrics: MetricsRegistry, direction: str):
+    return (
+        metrics.counter('socketer_compression_raw_bytes_total', 'Bytes before compression', direction=direction),
+        metrics.counter('socketer_compression_wire_bytes_total', 'Bytes after compression', direction=direction),
+        metrics.counter('socketer_compression_cpu_seconds_total', 'CPU time of (de)compression', direction=direction),
+    )
+
+
+class FrameCompression(object):
+    """
+    Compression state of one connection. encode is called by the single sending thread and decode
+    by the single receiving thread of the connection, in frame order; decode raises FrameError when
+    a frame would decompress to more than max_frame_size bytes.
+    """
+
+    def __init__(self, codec: str, threshold: int = DEFAULT_THRESHOLD, metrics: MetricsRegistry = None,
+                 max_frame_size: int = None):
+        self.codec = CODECS[codec]()
+        self.threshold = threshold
+        self.max_frame_size = max_frame_size if max_frame_size is not None else FrameConstants.DEFAULT_MAX_FRAME_SIZE
+        metrics = metrics if metrics is not None else MetricsRegistry(enabled=False)
+        self.__raw_out__, self.__wire_out__, self.__cpu_out__ = __counters__(metrics, 'out')
+        self.__raw_in__, self.__wire_in__, self.__cpu_in__ = __counters__(metrics, 'in')
+
+    def encode(self, payload: bytes, flags: int):
+        if len(payload) < self.threshold:
+            return payload, flags
+        start = time.thread_time()
+        compressed = self.codec.compress(payload)
+        self.__cpu_out__.inc(time.thread_time() - start)
+        self.__raw_out__.inc(len(payload))
+        self.__wire_out__.inc(len(compressed))
+        return compressed, flags | FrameConstants.FLAG_COMPRESSED
+
+    def decode(self, payload: bytes, flags: int):
+        if not flags & FrameConstants.FLAG_COMPRESSED:
+            return payload, flags
+        start = time.thread_time()
+        raw = self.codec.decompress(payload, self.max_frame_size)
+        self.__cpu_in__.inc(time.thread_time() - start)
+        self.__raw_in__.inc(len(raw))
+        self.__wire_in__.inc(len(payload))
+        return raw, flags & ~FrameConstants.FLAG_COMPRESSED
+
+
+def compression_stats(metrics: MetricsRegistry):
+    """ 各方向压缩前后字节数、压缩率（压缩后 / 压缩前）及 CPU 时间 """
+    if metrics.enabled is False:
+        return None
+    result = dict()
+    for direction in ('out', 'in'):
+        raw, wire, cpu = __counters__(metrics, direction)
+        result[direction] = {
+            'raw_bytes': raw.value,
+            'wire_bytes': wire.value,
+            'ratio': wire.value / raw.value if raw.value > 0 else None,
+            'cpu_seconds': cpu.value,
+        }
+    return result
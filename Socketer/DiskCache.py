@@ -0,0 +1,461 @@
+# -*- encoding: UTF-8 -*-
+import datetime
+import hashlib
+import json
+import mmap
+import os
+import sys
+import time
+
+from array import array
+from bisect import bisect_left, bisect_right
+from threading import Lock
+from urllib.parse import quote
+
+from Socketer.Cache import WSD_NO_DATA, WSDData, is_daily, to_date
+from Socketer.WireFormat import EPOCH_ORDINAL, NAN, days_to_dates
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+class DiskSeries(object):
+    """
+    One (code, field, options) series on disk:
+
+        <name>.json          {"gen", "count", "covered", "accessed"}
+        <name>.<gen>.days    int64 days since 1970-01-01, ascending
+        <name>.<gen>.values  float64, aligned with days
+
+    Columns are in native byte order, the directory is local to the machine.
+
+    The meta file is the commit point and is only ever replaced atomically: bytes past count in
+    the column files (a crashed append) are ignored and truncated by the next append, and a
+    rewrite goes to a new generation of column files before the meta file points to it.
+
+    lock guards the series within the process; removed is set once its files are deleted.
+    """
+
+    ITEM_SIZE = 8
+
+    def __init__(self, path: str, meta: dict = None):
+        self.path = path
+        self.lock = Lock()
+        self.removed = False
+        meta = meta or dict()
+        self.gen = meta.get('gen', 0)
+        self.count = meta.get('count', 0)
+        self.covered = [tuple(var) for var in meta.get('covered', ())]
+        self.accessed = meta.get('accessed', time.time())
+
+    @property
+    def size(self):
+        return 2 * self.ITEM_SIZE * self.count
+
+    def column_path(self, column: str, gen: int = None):
+        return '{}.{}.{}'.format(self.path, self.gen if gen is None else gen, column)
+
+    def missing(self, start: int, end: int):
+        """ 返回 [start, end]（日序号）中尚未缓存的区间 """
+        segments, cursor = list(), start
+        for covered_start, covered_end in self.covered:
+            if covered_end < cursor:
+                continue
+            if covered_start > end:
+                break
+            if covered_start > cursor:
+                segments.append((cursor, covered_start - 1))
+            cursor = max(cursor, covered_end + 1)
+            if cursor > end:
+                break
+        if cursor <= end:
+            segments.append((cursor, end))
+        return segments
+
+    def cover(self, start: int, end: int):
+        covered = sorted(self.covered + [(start, end)])
+        merged = [covered[0]]
+        for covered_start, covered_end in covered[1:]:
+            last_start, last_end = merged[-1]
+            if covered_start <= last_end + 1:
+                merged[-1] = (last_start, max(last_end, covered_end))
+            else:
+                merged.append((covered_start, covered_end))
+        self.covered = merged
+
+    def __read_column__(self, column: str, typecode: str, lo: int = 0, hi: int = None):
+        """ 以 mmap 切片读取第 lo 至 hi 项，不解析文件 """
+        hi = self.count if hi is None else hi
+        result = array(typecode)
+        if hi <= lo:
+            return result
+        with open(self.column_path(column), 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            result.frombytes(mm[lo * self.ITEM_SIZE:hi * self.ITEM_SIZE])
+        return result
+
+    def read(self, start: int, end: int):
+        """ 返回 [start, end] 内的 (days, values) """
+        if self.count == 0:
+            return array('q'), array('d')
+        with open(self.column_path('days'), 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            view = memoryview(mm)[:self.count * self.ITEM_SIZE].cast('q')
+            try:
+                lo, hi = bisect_left(view, start), bisect_right(view, end)
+            finally:
+                view.release()
+            days = array('q')
+            days.frombytes(mm[lo * self.ITEM_SIZE:hi * self.ITEM_SIZE])
+        return days, self.__read_column__('values', 'd', lo, hi)
+
+    def last_day(self):
+        return self.__read_column__('days', 'q', self.count - 1)[0] if self.count > 0 else None
+
+    @staticmethod
+    def __write_column__(path: str, values: array, mode: str, offset: int = 0):
+        with open(path, mode) as f:
+            if offset > 0:
+                # 截去上次中断的追加写入
+                f.seek(offset)
+                f.truncate()
+            f.write(values.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+
+    def __write_meta__(self):
+        tmp_path = self.path + '.json.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'gen': self.gen, 'count': self.count, 'covered': self.covered, 'accessed': self.accessed}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path + '.json')
+
+    def write(self, rows: dict, start: int, end: int):
+        """ 写入 [start, end] 的数据（日序号 -> 数值）：日期均晚于已有数据时追加，否则重写为新一代文件 """
+        new_days = sorted(rows)
+        last_day = self.last_day()
+        if last_day is None or len(new_days) == 0 or new_days[0] > last_day:
+            if len(new_days) > 0:
+                mode = 'r+b' if self.count > 0 else 'wb'
+                self.__write_column__(self.column_path('days'), array('q', new_days), mode, self.count * self.ITEM_SIZE)
+                self.__write_column__(
+                    self.column_path('values'), array('d', [rows[var] for var in new_days]), mode,
+                    self.count * self.ITEM_SIZE)
+                self.count += len(new_days)
+            self.cover(start, end)
+            self.__write_meta__()
+            return 'append'
+
+        days, values = self.read(-sys.maxsize, sys.maxsize)
+        merged = dict(zip(days, values))
+        merged.update(rows)
+        merged_days = sorted(merged)
+        old_gen, self.gen = self.gen, self.gen + 1
+        self.__write_column__(self.column_path('days'), array('q', merged_days), 'wb')
+        self.__write_column__(self.column_path('values'), array('d', [merged[var] for var in merged_days]), 'wb')
+        self.count = len(merged_days)
+        self.cover(start, end)
+        self.__write_meta__()
+        self.remove_columns(old_gen)
+        return 'rewrite'
+
+    def remove_columns(self, gen: int = None):
+        for column in ('days', 'values'):
+            try:
+                os.remove(self.column_path(column, gen))
+            except FileNotFoundError:
+                pass
+
+    def remove(self):
+        # 先删除 meta 文件，中断时只留下无主的数据文件
+        self.removed = True
+        try:
+            os.remove(self.path + '.json')
+        except FileNotFoundError:
+            pass
+        self.remove_columns()
+
+
+class WSDDiskCache(object):
+    """
+    Persistent wsd cache in root_dir, one DiskSeries per (code, field, options), so it survives
+    server restarts and is shared by every query touching the same series.
+
+    Only the dates not covered yet are fetched: new dates at the end of a series are appended to
+    its column files, earlier ones rewrite it. The last volatile_days days (today included) may
+    still change and are fetched on every query without being stored. Series whose values are not numeric,
+    relative dates (e.g. '-5D') and non-daily options are passed to fetch uncached. Segments without
+    data (WSD_NO_DATA) are stored as covered and empty.
+
+    Reading and writing the files of a series only holds the lock of that series, so queries on
+    other series are not serialized behind fsync or mmap reads; the cache-wide lock guards the
+    series index and counters only.
+
+    Series are evicted least-recently-used once the column files exceed max_bytes; series in use
+    by another query are skipped. Every process takes the first slot-<n> directory under root_dir
+    not locked by another process, so prefork workers given the same root_dir keep separate files
+    and find them again after a restart.
+    """
+
+    def __init__(self, root_dir: str, max_bytes: int = 1024 * 1024 * 1024, volatile_days: int = 1):
+        self.__root_dir__, self.__lock_file__ = self.__take_slot__(os.path.abspath(root_dir))
+        self.__max_bytes__ = max_bytes
+        self.__volatile_days__ = volatile_days
+
+        self.__series_dict__ = dict()
+        self.__text_fields__ = set()
+        self.__lock__ = Lock()
+        self.__bytes__ = 0
+
+        self.__hits__ = 0
+        self.__partial_hits__ = 0
+        self.__misses__ = 0
+        self.__engine_calls__ = 0
+        self.__appends__ = 0
+        self.__rewrites__ = 0
+        self.__evictions__ = 0
+
+        self.__load__()
+
+    @staticmethod
+    def __take_slot__(root_dir: str):
+        """ 返回首个未被其他进程锁定的 slot 目录及其锁文件，锁随进程退出释放 """
+        slot = 0
+        while True:
+            slot_dir = os.path.join(root_dir, 'slot-{}'.format(slot))
+            os.makedirs(slot_dir, exist_ok=True)
+            if fcntl is None:
+                return slot_dir, None
+            lock_file = open(os.path.join(slot_dir, '.lock'), 'w')
+            try:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                lock_file.close()
+                slot += 1
+                continue
+            return slot_dir, lock_file
+
+    def __load__(self):
+        """ 读入已有序列的 meta，删除中断写入遗留的临时文件与旧版本数据文件 """
+        for dir_path, dir_names, file_names in os.walk(self.__root_dir__):
+            valid = set()
+            for file_name in file_names:
+                if not file_name.endswith('.json'):
+                    continue
+                path = os.path.join(dir_path, file_name[:-len('.json')])
+                try:
+                    with open(path + '.json') as f:
+                        series = DiskSeries(path, json.load(f))
+                except (OSError, ValueError):
+                    continue
+                self.__series_dict__[path] = series
+                self.__bytes__ += series.size
+                valid.update(os.path.basename(series.column_path(var)) for var in ('days', 'values'))
+            for file_name in file_names:
+                if file_name.endswith('.tmp') or file_name.endswith(('.days', '.values')) and file_name not in valid:
+                    os.remove(os.path.join(dir_path, file_name))
+
+    def __series_path__(self, code: str, field: str, options: str):
+        options_dir = hashlib.sha1(options.encode('utf-8')).hexdigest()[:16] if options else 'default'
+        return os.path.join(self.__root_dir__, options_dir, quote(field, safe=''), quote(code, safe=''))
+
+    def __get_series__(self, path: str):
+        """ 调用前需持有 __lock__ """
+        series = self.__series_dict__.get(path, None)
+        if series is None:
+            series = DiskSeries(path)
+            self.__series_dict__[path] = series
+        return series
+
+    def __acquire__(self, path: str):
+        """ 返回已持有 lock 的序列，等待期间序列被淘汰时重新取得 """
+        while True:
+            with self.__lock__:
+                series = self.__get_series__(path)
+            series.lock.acquire()
+            if series.removed is False:
+                return series
+            series.lock.release()
+
+    def __evict__(self, keep: set):
+        """ keep 中的序列为本次查询所用，与正被其他查询使用的序列一样不淘汰 """
+        with self.__lock__:
+            for series in sorted(self.__series_dict__.values(), key=lambda var: var.accessed):
+                if self.__bytes__ <= self.__max_bytes__:
+                    break
+                if series.path in keep or series.lock.acquire(blocking=False) is False:
+                    continue
+                try:
+                    # 在 __lock__ 内删除文件，以免同一路径的新序列先写入
+                    series.remove()
+                finally:
+                    series.lock.release()
+                self.__series_dict__.pop(series.path)
+                self.__bytes__ -= series.size
+                self.__evictions__ += 1
+
+    def __fetch_uncached__(self, fetch, codes, fields, start_date, end_date, options):
+        with self.__lock__:
+            self.__misses__ += 1
+            self.__engine_calls__ += 1
+        return fetch(codes, fields, start_date, end_date, options)
+
+    def query(self, fetch, codes: str, fields: str, start_date, end_date, options: str = ''):
+        """ 与 WSDCache.query 相同：fetch(codes, fields, start_date, end_date, options) 取未缓存的日期区间 """
+        start, end = to_date(start_date), to_date(end_date)
+        code_list = [var.strip().upper() for var in str(codes).split(',')]
+        field_list = [var.strip().lower() for var in str(fields).split(',')]
+        options = str(options or '').strip()
+        if start is None or end is None or start > end or (len(code_list) > 1 and len(field_list) > 1) \
+                or not is_daily(options) or any(var in self.__text_fields__ for var in field_list):
+            return self.__fetch_uncached__(fetch, codes, fields, start_date, end_date, options)
+
+        start_day, end_day = start.toordinal() - EPOCH_ORDINAL, end.toordinal() - EPOCH_ORDINAL
+        stable_day = datetime.date.today().toordinal() - EPOCH_ORDINAL - self.__volatile_days__
+        if len(code_list) > 1:
+            path_list = [self.__series_path__(var, field_list[0], options) for var in code_list]
+        else:
+            path_list = [self.__series_path__(code_list[0], var, options) for var in field_list]
+
+        missing, cached = list(), False
+        for path in path_list:
+            series = self.__acquire__(path)
+            try:
+                if start_day <= stable_day:
+                    missing.extend(series.missing(start_day, min(end_day, stable_day)))
+                cached = cached or series.count > 0
+            finally:
+                series.lock.release()
+        if end_day > stable_day:
+            missing.append((max(start_day, stable_day + 1), end_day))
+        segments = WSDDiskCache.__merge_segments__(missing)
+        with self.__lock__:
+            if len(segments) == 0:
+                self.__hits__ += 1
+            elif cached is True:
+                self.__partial_hits__ += 1
+            else:
+                self.__misses__ += 1
+            self.__engine_calls__ += len(segments)
+
+        fetched, no_data = list(), None
+        for segment_start, segment_end in segments:
+            res = fetch(codes, fields, WSDDiskCache.__to_date__(segment_start), WSDDiskCache.__to_date__(segment_end),
+                        options)
+            if res.ErrorCode == WSD_NO_DATA:
+                no_data, res = res, WSDData(0, res.Codes, res.Fields, [], [])
+            elif res.ErrorCode != 0:
+                return res
+            try:
+                fetched.append((segment_start, segment_end, self.__to_rows__(res)))
+            except (TypeError, ValueError):
+                with self.__lock__:
+                    self.__text_fields__.update(field_list)
+                return self.__fetch_uncached__(fetch, codes, fields, start_date, end_date, options)
+        if no_data is not None and cached is False and all(len(var[2][0].Times) == 0 for var in fetched):
+            # 整个区间均无数据时保留引擎的返回
+            return no_data
+        source = next((var[2][0] for var in fetched if len(var[2][0].Times) > 0), None)
+        result_codes = list(source.Codes) if source is not None else code_list
+        result_fields = list(source.Fields) if source is not None else [var.upper() for var in field_list]
+
+        columns, now = list(), time.time()
+        for i, path in enumerate(path_list):
+            volatile, modes = dict(), list()
+            # 逐个序列持有其 lock 读写文件，取数期间被淘汰的序列由 __acquire__ 重新创建
+            series = self.__acquire__(path)
+            try:
+                size = series.size
+                if series.count == 0:
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                for segment_start, segment_end, (res, row_list) in fetched:
+                    rows = row_list[i] if i < len(row_list) else dict()
+                    volatile.update((k, v) for k, v in rows.items() if k > stable_day)
+                    if segment_start > stable_day:
+                        continue
+                    modes.append(series.write(
+                        {k: v for k, v in rows.items() if k <= stable_day}, segment_start, min(segment_end, stable_day)))
+                series.accessed = now
+                days, values = series.read(start_day, min(end_day, stable_day))
+                size = series.size - size
+            finally:
+                series.lock.release()
+            extra = sorted(var for var in volatile if start_day <= var <= end_day)
+            days.extend(extra)
+            values.extend(volatile[var] for var in extra)
+            columns.append((days, values))
+            with self.__lock__:
+                self.__bytes__ += size
+                self.__appends__ += modes.count('append')
+                self.__rewrites__ += modes.count('rewrite')
+        if self.__bytes__ > self.__max_bytes__:
+            self.__evict__(set(path_list))
+        return WSDDiskCache.__align__(result_codes, result_fields, columns)
+
+    @staticmethod
+    def __merge_segments__(segments: list):
+        merged = list()
+        for segment_start, segment_end in sorted(segments):
+            if len(merged) > 0 and segment_start <= merged[-1][1] + 1:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], segment_end))
+            else:
+                merged.append((segment_start, segment_end))
+        return merged
+
+    @staticmethod
+    def __to_date__(day: int):
+        return datetime.date.fromordinal(EPOCH_ORDINAL + day)
+
+    @staticmethod
+    def __to_rows__(res):
+        """ 将 wsd 结果转为每行一个 {日序号: 数值}，非数值时抛出 ValueError / TypeError """
+        day_list = [to_date(var).toordinal() - EPOCH_ORDINAL for var in res.Times]
+        row_list = list()
+        for row in res.Data:
+            if len(row) != len(day_list):
+                raise ValueError('row of {} values for {} dates.'.format(len(row), len(day_list)))
+            row_list.append({day: NAN if var is None else float(var) for day, var in zip(day_list, row)})
+        return res, row_list
+
+    @staticmethod
+    def __align__(codes: list, fields: list, columns: list):
+        """ 各序列日期相同时直接使用，否则按日期并集对齐，缺失处为 nan """
+        days = columns[0][0] if len(columns) > 0 else array('q')
+        if all(var[0] == days for var in columns):
+            return WSDData(0, codes, fields, days_to_dates(days), [var[1].tolist() for var in columns])
+        days = sorted(set(x for var in columns for x in var[0]))
+        data = list()
+        for column_days, column_values in columns:
+            value_dict = dict(zip(column_days, column_values))
+            data.append([value_dict.get(var, NAN) for var in days])
+        return WSDData(0, codes, fields, days_to_dates(days), data)
+
+    def clear(self):
+        with self.__lock__:
+            for series in self.__series_dict__.values():
+                with series.lock:
+                    series.remove()
+            self.__series_dict__.clear()
+            self.__bytes__ = 0
+
+    def close(self):
+        """ 释放 slot 目录供其他进程使用 """
+        if self.__lock_file__ is not None:
+            self.__lock_file__.close()
+            self.__lock_file__ = None
+
+    def stats(self):
+        with self.__lock__:
+            return {
+                'root_dir': self.__root_dir__,
+                'series': len(self.__series_dict__),
+                'bytes': self.__bytes__,
+                'hits': self.__hits__,
+                'partial_hits': self.__partial_hits__,
+                'misses': self.__misses__,
+                'engine_calls': self.__engine_calls__,
+                'appends': self.__appends__,
+                'rewrites': self.__rewrites__,
+                'evictions': self.__evictions__,
+            }
@@ -0,0 +1,183 @@
+# -*- encoding: UTF-8 -*-
+import time
+
+from threading import Condition, Event, Thread
+
+from Socketer.Metrics import MetricsRegistry
+from Socketer.utils import get_logger
+
+
+class EngineUnavailable(RuntimeError):
+    pass
+
+
+def wind_engine():
+    """ 默认引擎工厂：WindPy 的全局会话 """
+    from WindPy import w
+    return w
+
+
+class EngineManager(object):
+    """
+    Owns the one engine session of a server.
+
+    factory() returns an engine with start / stop / isconnected, WindPy.w by default or e.g. a
+    StubWindEngine for tests. start() connects it in a background thread, runs warmup(engine) and
+    marks it ready; with lazy=True this happens on the first get() instead. The health thread
+    calls engine.isconnected() every health_interval seconds and reconnects a lost session,
+    retrying with a backoff from restart_delay up to max_restart_delay seconds. on_ready(engine)
+    is called after every successful connection, e.g. to restore subscriptions.
+
+    get(timeout) returns the ready engine or raises EngineUnavailable after timeout seconds, so
+    requests wait for the session but never set it up themselves.
+    """
+
+    def __init__(self, factory=None, lazy: bool = False, health_interval: float = 30.0,
+                 restart_delay: float = 1.0, max_restart_delay: float = 60.0, warmup=None, on_ready=None,
+                 metrics: MetricsRegistry = None, log=None):
+        self.log = log if log is not None else get_logger(self.__class__.__name__)
+        self.__factory__ = factory if factory is not None else wind_engine
+        self.__lazy__ = lazy
+        self.__health_interval__ = health_interval
+        self.__restart_delay__ = restart_delay
+        self.__max_restart_delay__ = max_restart_delay
+        self.__warmup__ = warmup
+        self.__on_ready__ = on_ready
+
+        self.engine = None
+        self.__ready__ = False
+        self.__condition__ = Condition()
+        self.__stop_event__ = Event()
+        self.__started__ = False
+        self.__thread__ = None
+        self.__ready_time__ = None
+        self.__last_error__ = None
+
+        metrics = metrics if metrics is not None else MetricsRegistry(enabled=False)
+        self.__connects__ = metrics.counter('wind_engine_connects_total', 'Successful engine connections')
+        self.__restarts__ = metrics.counter('wind_engine_restarts_total', 'Engine sessions found lost and restarted')
+        self.__failures__ = metrics.counter('wind_engine_failures_total', 'Failed engine connection attempts')
+        metrics.gauge('wind_engine_ready', 'Whether the engine session is ready', func=lambda: int(self.__ready__))
+
+    def __connect__(self):
+        """ 创建并启动引擎，isconnected() 为真后预热 """
+        engine = self.__factory__()
+        res = engine.start()
+        if getattr(res, 'ErrorCode', 0) != 0:
+            raise EngineUnavailable('engine start failed with ErrorCode {}.'.format(res.ErrorCode))
+        if not engine.isconnected():
+            raise EngineUnavailable('engine not connected after start.')
+        if self.__warmup__ is not None:
+            start = time.perf_counter()
+            try:
+                self.__warmup__(engine)
+            except Exception as e:
+                # 预热失败不影响使用，只是首个请求较慢
+                self.log.warning('engine warmup failed: {}'.format(e))
+            self.log.debug('engine warmup took %.3f seconds.', time.perf_counter() - start)
+        return engine
+
+    def __disconnect__(self):
+        with self.__condition__:
+            engine, self.engine, self.__ready__ = self.engine, None, False
+        if engine is None:
+            return
+        try:
+            engine.stop()
+        except Exception as e:
+            self.log.warning('engine stop failed: {}'.format(e))
+
+    def __healthy__(self):
+        try:
+            return bool(self.engine.isconnected())
+        except Exception as e:
+            self.__last_error__ = repr(e)
+            return False
+
+    def __supervise__(self):
+        delay = self.__restart_delay__
+        while not self.__stop_event__.is_set():
+            if self.__ready__ is False:
+                try:
+                    engine = self.__connect__()
+                except Exception as e:
+                    self.__failures__.inc()
+                    self.__last_error__ = repr(e)
+                    self.log.warning('engine connection failed, retry in {} seconds: {}'.format(delay, e))
+                    if self.__stop_event__.wait(delay):
+                        break
+                    delay = min(delay * 2, self.__max_restart_delay__)
+                    continue
+                delay = self.__restart_delay__
+                with self.__condition__:
+                    self.engine, self.__ready__, self.__ready_time__ = engine, True, time.time()
+                    self.__condition__.notify_all()
+                self.__connects__.inc()
+                self.log.info('engine {} ready.'.format(engine.__class__.__name__))
+                if self.__on_ready__ is not None:
+                    try:
+                        self.__on_ready__(engine)
+                    except Exception as e:
+                        self.log.error('engine on_ready callback failed: {}'.format(e))
+
+            if self.__stop_event__.wait(self.__health_interval__):
+                break
+            if not self.__healthy__():
+                self.__restarts__.inc()
+                self.log.warning('engine session lost, restarting.')
+                self.__disconnect__()
+
+    def __run__(self):
+        """ 启动监控线程，调用前需持有 __condition__ """
+        if self.__thread__ is not None or self.__stop_event__.is_set():
+            return
+        self.__thread__ = Thread(target=self.__supervise__, name='engine supervisor')
+        self.__thread__.daemon = True
+        self.__thread__.start()
+
+    def start(self):
+        with self.__condition__:
+            self.__stop_event__.clear()
+            self.__started__ = True
+            if self.__lazy__ is False:
+                self.__run__()
+
+    def is_ready(self):
+        return self.__ready__
+
+    def get(self, timeout: float = None):
+        """ 返回已就绪的引擎，timeout 秒内未就绪时抛出 EngineUnavailable """
+        with self.__condition__:
+            if self.__ready__ is True:
+                return self.engine
+            if self.__started__ is False:
+                raise EngineUnavailable('engine manager not started.')
+            self.__run__()
+            if not self.__condition__.wait_for(lambda: self.__ready__ or self.__stop_event__.is_set(), timeout):
+                raise EngineUnavailable('engine not ready in {} seconds: {}'.format(timeout, self.__last_error__))
+            if self.__ready__ is False:
+                raise EngineUnavailable('engine manager stopped.')
+            return self.engine
+
+    def stop(self):
+        with self.__condition__:
+            if self.__started__ is False:
+                return
+            self.__started__ = False
+            self.__stop_event__.set()
+            self.__condition__.notify_all()
+            thread, self.__thread__ = self.__thread__, None
+        if thread is not None:
+            thread.join()
+        self.__disconnect__()
+
+    def stats(self):
+        return {
+            'engine': self.engine.__class__.__name__ if self.engine is not None else None,
+            'ready': self.__ready__,
+            'uptime': time.time() - self.__ready_time__ if self.__ready__ is True else 0.0,
+            'connects': self.__connects__.value,
+            'restarts': self.__restarts__.value,
+            'failures': self.__failures__.value,
+            'last_error': self.__last_error__,
+        }
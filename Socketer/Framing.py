@@ -0,0 +1,111 @@
+# -*- encoding: UTF-8 -*-
+import socket
+import struct
+
+
+class FrameError(Exception):
+    pass
+
+
+class FrameConstants:
+    # frame header: 1 byte flags + 4 bytes payload length, network byte order
+    FRAME_HEADER = struct.Struct('!BI')
+    FRAME_HEADER_SIZE = FRAME_HEADER.size
+
+    FLAG_TEXT = 0x00
+    # payload is raw bytes and delivered without decoding
+    FLAG_BINARY = 0x01
+    # payload is compressed with the codec negotiated for the connection
+    FLAG_COMPRESSED = 0x02
+    # connection handshake, handled by Socketer itself and never delivered as a message
+    FLAG_CONTROL = 0x04
+    # payload is the (position, length) of the real payload in the shared-memory ring of the connection
+    FLAG_SHM = 0x08
+
+    DEFAULT_MAX_FRAME_SIZE = 256 * 1024 * 1024
+    # payloads above this size are sent with a separate sendall instead of being copied behind the header
+    COPY_THRESHOLD = 64 * 1024
+
+
+def pack_frame(payload: bytes, flags: int = FrameConstants.FLAG_TEXT):
+    """ 将单条消息封装为 header + payload """
+    return FrameConstants.FRAME_HEADER.pack(flags, len(payload)) + payload
+
+
+def send_frame(sock: socket.socket, payload: bytes, flags: int = FrameConstants.FLAG_TEXT):
+    """ 发送单条消息，大消息避免拼接复制 """
+    if len(payload) > FrameConstants.COPY_THRESHOLD:
+        sock.sendall(FrameConstants.FRAME_HEADER.pack(flags, len(payload)))
+        sock.sendall(payload)
+    else:
+        sock.sendall(pack_frame(payload, flags))
+
+
+class FrameReader(FrameConstants):
+    """
+    Reassembly buffer of one connection.
+
+    Data is read with recv_into into a preallocated bytearray which grows at most once per
+    oversized frame, so a multi-MB payload is assembled without intermediate byte copies.
+    """
+
+    def __init__(self, sock: socket.socket, bufsize: int = 64 * 1024, max_frame_size: int = None):
+        self.sock = sock
+        self.max_frame_size = max_frame_size if max_frame_size is not None else self.DEFAULT_MAX_FRAME_SIZE
+
+        self.__buffer__ = bytearray(max(bufsize, self.FRAME_HEADER_SIZE))
+        self.__view__ = memoryview(self.__buffer__)
+        self.__start__ = 0
+        self.__end__ = 0
+
+    def __reserve__(self, size: int):
+        """ 保证缓冲区从 __start__ 起至少有 size 字节可用 """
+        if self.__start__ + size <= len(self.__buffer__):
+            return
+        pending = self.__end__ - self.__start__
+        if size > len(self.__buffer__):
+            new_buffer = bytearray(size)
+            new_buffer[:pending] = self.__view__[self.__start__:self.__end__]
+            self.__view__.release()
+            self.__buffer__ = new_buffer
+            self.__view__ = memoryview(self.__buffer__)
+        else:
+            self.__view__[:pending] = self.__view__[self.__start__:self.__end__]
+        self.__start__, self.__end__ = 0, pending
+
+    def __next_frame__(self):
+        pending = self.__end__ - self.__start__
+        if pending < self.FRAME_HEADER_SIZE:
+            self.__reserve__(self.FRAME_HEADER_SIZE)
+            return None
+        flags, length = self.FRAME_HEADER.unpack_from(self.__buffer__, self.__start__)
+        if length > self.max_frame_size:
+            raise FrameError('frame of {} bytes exceeds max frame size {}'.format(length, self.max_frame_size))
+        total = self.FRAME_HEADER_SIZE + length
+        if pending < total:
+            self.__reserve__(total)
+            return None
+        payload_start = self.__start__ + self.FRAME_HEADER_SIZE
+        payload = bytes(self.__view__[payload_start:payload_start + length])
+        self.__start__ += total
+        if self.__start__ == self.__end__:
+            self.__start__, self.__end__ = 0, 0
+        return flags, payload
+
+    def feed(self):
+        """
+        Read once from the socket and return complete frames as a list of (flags, payload).
+
+        Returns None when the peer closed the connection.
+        """
+        received = self.sock.recv_into(self.__view__[self.__end__:])
+        if received == 0:
+            return None
+        self.__end__ += received
+
+        frames = list()
+        frame = self.__next_frame__()
+        while frame is not None:
+            frames.append(frame)
+            frame = self.__next_frame__()
+        return frames
@@ -0,0 +1,168 @@
+# -*- encoding: UTF-8 -*-
+import bisect
+
+from threading import Lock
+
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def __format_labels__(labels: tuple):
+    if len(labels) == 0:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(k, str(v).replace('"', '\\"')) for k, v in labels) + '}'
+
+
+class NullMetric(object):
+    """ 关闭统计时使用，所有操作为空 """
+    value = 0
+
+    def inc(self, value: float = 1):
+        pass
+
+    def set(self, value: float):
+        pass
+
+    def observe(self, value: float):
+        pass
+
+
+NULL_METRIC = NullMetric()
+
+
+class Counter(object):
+    def __init__(self):
+        self.value = 0
+        self.__lock__ = Lock()
+
+    def inc(self, value: float = 1):
+        with self.__lock__:
+            self.value += value
+
+    def samples(self, name: str, labels: tuple):
+        return [(name, labels, self.value)]
+
+
+class Gauge(object):
+    """ 可直接 set，或由 func 在读取时计算（如队列长度） """
+
+    def __init__(self, func=None):
+        self.value = 0
+        self.__func__ = func
+
+    def set(self, value: float):
+        self.value = value
+
+    def inc(self, value: float = 1):
+        self.value += value
+
+    def samples(self, name: str, labels: tuple):
+        return [(name, labels, self.__func__() if self.__func__ is not None else self.value)]
+
+
+class Histogram(object):
+    def __init__(self, buckets: tuple = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.__lock__ = Lock()
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.__lock__:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def quantile(self, q: float):
+        """ 以桶上界估计分位数 """
+        with self.__lock__:
+            counts, count = list(self.counts), self.count
+        if count == 0:
+            return float('nan')
+        rank, cumulative = q * count, 0
+        for i, var in enumerate(counts):
+            cumulative += var
+            if cumulative >= rank:
+                return self.buckets[i] if i < len(self.buckets) else float('inf')
+        return float('inf')
+
+    def samples(self, name: str, labels: tuple):
+        with self.__lock__:
+            counts, total, count = list(self.counts), self.sum, self.count
+        result, cumulative = list(), 0
+        for bound, var in zip(self.buckets + (float('inf'), ), counts):
+            cumulative += var
+            result.append((name + '_bucket', labels + (('le', '+Inf' if bound == float('inf') else repr(bound)), ),
+                           cumulative))
+        result.append((name + '_sum', labels, total))
+        result.append((name + '_count', labels, count))
+        return result
+
+
+class MetricsRegistry(object):
+    """
+    Counters, gauges and histograms of one server, optionally with labels.
+
+        metrics = MetricsRegistry()
+        metrics.counter('socketer_bytes_in_total', 'Bytes received').inc(n)
+        metrics.histogram('wind_request_seconds', 'Request latency', func='wsd').observe(t)
+
+    When disabled every metric is NULL_METRIC, so instrumented code only pays for one no-op call.
+    """
+    METRIC_TYPES = {Counter: 'counter', Gauge: 'gauge', Histogram: 'histogram'}
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self.__metric_dict__ = dict()
+        self.__help_dict__ = dict()
+        self.__lock__ = Lock()
+
+    def __get__(self, metric_class, name: str, help_text: str, labels: dict, **kwargs):
+        if self.enabled is False:
+            return NULL_METRIC
+        key = (name, tuple(sorted(labels.items())))
+        metric = self.__metric_dict__.get(key, None)
+        if metric is None:
+            with self.__lock__:
+                metric = self.__metric_dict__.get(key, None)
+                if metric is None:
+                    metric = metric_class(**kwargs)
+                    self.__metric_dict__[key] = metric
+                    self.__help_dict__.setdefault(name, (help_text, self.METRIC_TYPES[metric_class]))
+        return metric
+
+    def counter(self, name: str, help_text: str = '', **labels):
+        return self.__get__(Counter, name, help_text, labels)
+
+    def gauge(self, name: str, help_text: str = '', func=None, **labels):
+        return self.__get__(Gauge, name, help_text, labels, func=func)
+
+    def histogram(self, name: str, help_text: str = '', buckets: tuple = DEFAULT_BUCKETS, **labels):
+        return self.__get__(Histogram, name, help_text, labels, buckets=buckets)
+
+    def __samples__(self):
+        with self.__lock__:
+            items = sorted(self.__metric_dict__.items(), key=lambda var: var[0])
+        return [(key[0], metric.samples(key[0], key[1])) for key, metric in items]
+
+    def snapshot(self):
+        """ {name{labels}: value} 形式的当前值 """
+        return {
+            sample_name + __format_labels__(labels): value
+            for name, samples in self.__samples__() for sample_name, labels, value in samples
+        }
+
+    def dump_prometheus(self):
+        """ Prometheus 文本格式 """
+        lines, described = list(), set()
+        for name, samples in self.__samples__():
+            if name not in described:
+                help_text, metric_type = self.__help_dict__[name]
+                lines.append('# HELP {} {}'.format(name, help_text))
+                lines.append('# TYPE {} {}'.format(name, metric_type))
+                described.add(name)
+            for sample_name, labels, value in samples:
+                lines.append('{}{} {}'.format(sample_name, __format_labels__(labels), value))
+        return '\n'.join(lines) + '\n'
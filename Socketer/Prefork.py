@@ -0,0 +1,232 @@
+# -*- encoding: UTF-8 -*-
+import multiprocessing
+import signal
+import socket
+
+from multiprocessing.connection import wait
+from threading import Event, Lock, Thread
+
+from Socketer.utils import DEFAULT_LOG_LEVEL, get_logger
+
+
+# 合并各进程状态时取平均而非求和的项
+AVERAGE_KEYS = ('utilization', 'ratio')
+
+
+def __worker_main__(server_class, server_kwargs: dict, pipe):
+    """ 工作进程：启动服务器后应答主进程的 stats / stop 命令，主进程退出时随之退出 """
+    # Ctrl-C 由主进程处理并通知各工作进程
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    try:
+        server = server_class(reuse_port=True, **server_kwargs)
+        server.start()
+    except Exception as e:
+        pipe.send(('error', repr(e)))
+        return
+    pipe.send(('ready', None))
+    try:
+        while True:
+            try:
+                command = pipe.recv()
+            except (EOFError, OSError):
+                break
+            if command == 'stats':
+                pipe.send(('stats', server.stats()))
+            elif command == 'stop':
+                break
+    finally:
+        server.stop()
+
+
+def merge_stats(stats_list: list):
+    """ 数值求和（AVERAGE_KEYS 取平均），字典逐项合并，其他值取第一个进程的值 """
+    stats_list = [var for var in stats_list if var is not None]
+    if len(stats_list) == 0:
+        return None
+    first = stats_list[0]
+    if isinstance(first, dict):
+        return {key: merge_stats([var.get(key, None) for var in stats_list if isinstance(var, dict)]) for key in first}
+    if isinstance(first, (int, float)) and not isinstance(first, bool):
+        return sum(stats_list)
+    return first
+
+
+def __average__(stats, key: str, count: int):
+    """ 将合并结果中名为 key 的求和项改为平均值 """
+    if not isinstance(stats, dict) or count == 0:
+        return
+    for k, v in stats.items():
+        if k == key and isinstance(v, (int, float)):
+            stats[k] = v / count
+        else:
+            __average__(v, key, count)
+
+
+class PreforkServer(object):
+    """
+    Run a SocketServer subclass in several worker processes sharing one port via SO_REUSEPORT.
+
+        server = PreforkServer(WindServer, workers=4, port=33331)
+        server.start()
+
+    Every worker constructs its own server_class(**server_kwargs), so engine session, queues and
+    worker pool are per process and JSON work is spread over the cores. The kernel balances new
+    connections across the workers. A supervisor thread restarts workers that die, after
+    restart_delay seconds, and stats() merges the stats of all workers. Only the tcp transport
+    can be shared, SO_REUSEPORT does not apply to unix sockets.
+    """
+
+    def __init__(self, server_class, workers: int = 4, restart_delay: float = 1.0, start_timeout: float = 30.0,
+                 start_method: str = 'spawn', **server_kwargs):
+        if not hasattr(socket, 'SO_REUSEPORT'):
+            raise RuntimeError('SO_REUSEPORT is not supported on this platform.')
+        if workers < 1:
+            raise ValueError('param workers should be at least 1 but got {}.'.format(workers))
+        if server_kwargs.get('transport', 'tcp') != 'tcp':
+            # 各进程各自绑定同一 unix 路径时会删除彼此的 socket 文件
+            raise ValueError('param transport should be tcp for prefork workers but got {}.'.format(
+                server_kwargs['transport']))
+        self.log = get_logger(
+            self.__class__.__name__,
+            log_path=server_kwargs.get('log_path', None),
+            log_level=server_kwargs.get('log_level', DEFAULT_LOG_LEVEL),
+            log_async=server_kwargs.get('log_async', True),
+        )
+
+        self.__server_class__ = server_class
+        self.__server_kwargs__ = server_kwargs
+        self.__workers__ = workers
+        self.__restart_delay__ = restart_delay
+        self.__start_timeout__ = start_timeout
+        # 主进程有监控线程，默认以 spawn 启动工作进程以免 fork 继承其他线程持有的锁
+        self.__context__ = multiprocessing.get_context(start_method)
+
+        self.__process_list__ = [None] * workers
+        self.__pipe_list__ = [None] * workers
+        self.__pipe_lock_list__ = [Lock() for i in range(workers)]
+        self.__restarts__ = 0
+        self.__stop_event__ = Event()
+        self.__supervise_thread__ = None
+
+    def __spawn__(self, index: int):
+        """ 启动第 index 个工作进程并等待其开始监听 """
+        parent_pipe, child_pipe = self.__context__.Pipe()
+        process = self.__context__.Process(
+            target=__worker_main__, args=(self.__server_class__, self.__server_kwargs__, child_pipe),
+            name='{} worker {}'.format(self.__server_class__.__name__, index),
+        )
+        process.daemon = True
+        process.start()
+        child_pipe.close()
+
+        if not parent_pipe.poll(self.__start_timeout__):
+            process.terminate()
+            raise RuntimeError('worker {} not ready in {} seconds.'.format(index, self.__start_timeout__))
+        try:
+            status, detail = parent_pipe.recv()
+        except EOFError:
+            status, detail = 'error', 'exit code {}'.format(process.exitcode)
+        if status != 'ready':
+            process.join()
+            raise RuntimeError('worker {} failed to start: {}'.format(index, detail))
+
+        with self.__pipe_lock_list__[index]:
+            self.__process_list__[index] = process
+            self.__pipe_list__[index] = parent_pipe
+        self.log.debug('worker %s started with pid %s.', index, process.pid)
+
+    def __supervise__(self):
+        while not self.__stop_event__.is_set():
+            sentinel_dict = {var.sentinel: i for i, var in enumerate(self.__process_list__) if var is not None}
+            # 限时等待以便及时发现 stop，全部进程均未启动成功时直接进入重启
+            ready = wait(list(sentinel_dict.keys()), self.__restart_delay__) if len(sentinel_dict) > 0 else list()
+            if self.__stop_event__.is_set():
+                break
+            for sentinel in ready:
+                index = sentinel_dict[sentinel]
+                self.__process_list__[index].join()
+                self.log.warning('worker {} exited with code {}, restarting.'.format(
+                    index, self.__process_list__[index].exitcode))
+                with self.__pipe_lock_list__[index]:
+                    self.__pipe_list__[index].close()
+                    self.__process_list__[index] = None
+            if all(var is not None for var in self.__process_list__):
+                continue
+            # 避免启动即退出的工作进程反复重启
+            if self.__stop_event__.wait(self.__restart_delay__):
+                break
+            for index, process in enumerate(self.__process_list__):
+                if process is None:
+                    try:
+                        self.__spawn__(index)
+                        self.__restarts__ += 1
+                    except RuntimeError as e:
+                        self.log.error('restart worker {} failed: {}'.format(index, e))
+
+    def start(self):
+        self.__stop_event__.clear()
+        for index in range(self.__workers__):
+            self.__spawn__(index)
+        self.__supervise_thread__ = Thread(target=self.__supervise__, name='prefork server supervisor')
+        self.__supervise_thread__.daemon = True
+        self.__supervise_thread__.start()
+        self.log.info('{} started with {} {} workers.'.format(
+            self.__class__.__name__, self.__workers__, self.__server_class__.__name__))
+
+    def stats(self, timeout: float = 5.0):
+        """ 各工作进程的状态及合并后的状态，超时未应答的进程记为 None """
+        worker_stats = list()
+        for index in range(self.__workers__):
+            with self.__pipe_lock_list__[index]:
+                pipe = self.__pipe_list__[index]
+                result = None
+                try:
+                    if pipe is not None and self.__process_list__[index] is not None:
+                        # 丢弃此前超时未取的回复
+                        while pipe.poll():
+                            pipe.recv()
+                        pipe.send('stats')
+                        if pipe.poll(timeout):
+                            status, result = pipe.recv()
+                except (EOFError, OSError):
+                    result = None
+            worker_stats.append(result)
+
+        merged = merge_stats(worker_stats)
+        alive = [var for var in worker_stats if var is not None]
+        for key in AVERAGE_KEYS:
+            __average__(merged, key, len(alive))
+        return {
+            'workers': self.__workers__,
+            'alive': len(alive),
+            'restarts': self.__restarts__,
+            'total': merged,
+            'per_worker': worker_stats,
+        }
+
+    def is_alive(self):
+        return self.__supervise_thread__ is not None and self.__supervise_thread__.is_alive()
+
+    def stop(self, timeout: float = 10.0):
+        if self.__supervise_thread__ is None or self.__stop_event__.is_set():
+            return
+        self.__stop_event__.set()
+        for index in range(self.__workers__):
+            with self.__pipe_lock_list__[index]:
+                try:
+                    if self.__pipe_list__[index] is not None:
+                        self.__pipe_list__[index].send('stop')
+                except OSError:
+                    pass
+        for index, process in enumerate(self.__process_list__):
+            if process is None:
+                continue
+            process.join(timeout)
+            if process.is_alive():
+                self.log.warning('worker {} not stopped, terminating.'.format(index))
+                process.terminate()
+                process.join()
+            self.__pipe_list__[index].close()
+        self.__supervise_thread__.join()
+        self.log.info('{} stopped.'.format(self.__class__.__name__))
+
@@ -0,0 +1,370 @@
+# -*- encoding: UTF-8 -*-
+import selectors
+import socket
+import time
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from queue import Empty
+from threading import Thread
+
+from Socketer.Framing import FrameConstants, FrameError, FrameReader, pack_frame
+from Socketer.Server import SocketServer, SocketMessage
+
+
+class ReactorConnection(object):
+    __slots__ = ('sock', 'addr', 'reader', 'out', 'out_bytes', 'events', 'closing', 'compression')
+
+    def __init__(self, sock: socket.socket, addr, reader: FrameReader):
+        self.sock = sock
+        self.addr = addr
+        self.reader = reader
+        self.out = deque()
+        self.out_bytes = 0
+        self.events = 0
+        self.closing = False
+        self.compression = None
+
+
+class ReactorSocketServer(SocketServer):
+    """
+    SocketServer whose accept, receiving and sending of all connections run on one selector thread.
+
+    Sockets are non-blocking and the thread sleeps in select() until a socket is ready or it is
+    woken through a socketpair, so an idle connection costs one file descriptor and a small
+    buffer instead of two threads. process_msg / msg_in / msg_out / on_new_client / on_client_exit
+    keep the contract of SocketServer; the hooks run in a helper thread to keep the loop responsive.
+
+    Replies taken from msg_out together are coalesced per connection. Once out_buffer_size bytes
+    wait for a connection, slow_client_policy 'drop' drops its replies and 'disconnect' closes it,
+    while 'block' keeps buffering.
+    """
+
+    def __init__(self, port: int = 33331, out_buffer_size: int = 16 * 1024 * 1024, **kwargs):
+        SocketServer.__init__(self, port=port, **kwargs)
+        self.__out_buffer_size__ = out_buffer_size
+        self.__selector__ = None
+        self.__wake_r__, self.__wake_w__ = None, None
+        self.__calls__ = deque()
+        self.__conn_dict__ = dict()
+        self.__hook_executor__ = None
+        self.__stopping__ = False
+        self.metrics.gauge('socketer_out_buffer_bytes', 'Bytes waiting to be sent', func=self.__out_buffer_bytes__)
+
+    def __active_connections__(self):
+        return len(self.__conn_dict__)
+
+    def __out_buffer_bytes__(self):
+        return sum(var.out_bytes for var in list(self.__conn_dict__.values()))
+
+    def out_backlog(self, sock_addr):
+        conn = self.__conn_dict__.get(sock_addr, None)
+        return conn.out_bytes if conn is not None else 0
+
+    def __call_soon__(self, func, *args):
+        """ 线程安全：在 reactor 线程中执行 func(*args) """
+        self.__calls__.append((func, args))
+        try:
+            self.__wake_w__.send(b'\0')
+        except (BlockingIOError, InterruptedError):
+            # 唤醒字节未被读取，reactor 线程必然会再次醒来
+            pass
+
+    def __set_events__(self, conn: ReactorConnection):
+        events = (0 if conn.closing else selectors.EVENT_READ) | (selectors.EVENT_WRITE if conn.out else 0)
+        if events == conn.events:
+            return
+        if conn.events == 0:
+            self.__selector__.register(conn.sock, events, conn)
+        elif events == 0:
+            self.__selector__.unregister(conn.sock)
+        else:
+            self.__selector__.modify(conn.sock, events, conn)
+        conn.events = events
+
+    def __accept__(self):
+        while True:
+            try:
+                client_sock, client_addr = self.socket.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                if self.__server_tag__ is True:
+                    self.log.exception('accept failed.')
+                return
+            client_sock.setblocking(False)
+            client_addr = self.__peer_addr__(client_addr)
+            self.__connections__.inc()
+            self.log.debug('new connection from %s.', client_addr)
+            conn = ReactorConnection(client_sock, client_addr, FrameReader(
+                client_sock, bufsize=self.__bufsize__, max_frame_size=self.__max_frame_size__))
+            self.__hook_executor__.submit(self.__new_client__, conn)
+
+    def __new_client__(self, conn: ReactorConnection):
+        """ 在辅助线程中执行 on_new_client，完成后交由 reactor 线程开始读取 """
+        try:
+            self.on_new_client(conn.addr)
+        except Exception:
+            self.log.exception('on_new_client of {} failed.'.format(conn.addr))
+        self.__call_soon__(self.__register__, conn)
+
+    def __register__(self, conn: ReactorConnection):
+        if self.__stopping__ is True:
+            conn.sock.close()
+            return
+        self.__conn_dict__[conn.addr] = conn
+        self.__set_events__(conn)
+
+    def __close_conn__(self, conn: ReactorConnection):
+        if self.__conn_dict__.pop(conn.addr, None) is None:
+            return
+        if conn.events != 0:
+            self.__selector__.unregister(conn.sock)
+            conn.events = 0
+        conn.sock.close()
+        conn.out.clear()
+        conn.out_bytes = 0
+        self.__release_connection__(conn.addr)
+        self.__hook_executor__.submit(self.on_client_exit, conn.addr)
+        self.log.debug('connection %s closed.', conn.addr)
+
+    def __read__(self, conn: ReactorConnection):
+        try:
+            frames = conn.reader.feed()
+        except (BlockingIOError, InterruptedError):
+            return
+        except FrameError as e:
+            self.log.error('invalid frame from {}: {}'.format(conn.addr, e))
+            frames = None
+        except OSError as e:
+            self.log.warning('connection {} lost: {}'.format(conn.addr, e))
+            frames = None
+        if frames is None:
+            self.__close_conn__(conn)
+            return
+
+        for flags, payload in frames:
+            self.__bytes_in__.inc(len(payload) + FrameConstants.FRAME_HEADER_SIZE)
+            if flags & FrameConstants.FLAG_CONTROL:
+                compression, reply = self.__handshake__(conn.addr, payload)
+                self.__queue_payload__(conn, reply, FrameConstants.FLAG_CONTROL)
+                conn.compression = compression
+                self.__flush__(conn)
+                continue
+            if conn.compression is not None:
+                try:
+                    payload, flags = conn.compression.decode(payload, flags)
+                except Exception as e:
+                    self.log.error('invalid compressed frame from {}: {}'.format(conn.addr, e))
+                    self.__close_conn__(conn)
+                    return
+            self.__msgs_in__.inc()
+            self.__msg_size_in__.observe(len(payload))
+            if flags & FrameConstants.FLAG_BINARY:
+                msg = payload
+            else:
+                msg = payload.decode(self.__msg_encoding__)
+            self.msg_log.debug('message from %s with %s', conn.addr, msg)
+            if msg == self.CLIENT_EXIT_MSG:
+                # 退出消息回送后关闭连接，此后不再读取
+                self.__queue_frame__(conn, msg)
+                conn.closing = True
+                self.__flush__(conn)
+                return
+            self.msg_in.put(SocketMessage(conn.addr, msg))
+
+    def __queue_frame__(self, conn: ReactorConnection, msg):
+        if isinstance(msg, bytes):
+            payload, flags = msg, FrameConstants.FLAG_BINARY
+        else:
+            payload, flags = msg.encode(self.__msg_encoding__), FrameConstants.FLAG_TEXT
+        if conn.compression is not None:
+            payload, flags = conn.compression.encode(payload, flags)
+        self.__queue_payload__(conn, payload, flags)
+
+    def __queue_payload__(self, conn: ReactorConnection, payload: bytes, flags: int):
+        """ 小帧并入队尾的缓冲区以合并写出，大帧头部与数据分别排队以免复制 """
+        if len(payload) > FrameConstants.COPY_THRESHOLD:
+            conn.out.append(FrameConstants.FRAME_HEADER.pack(flags, len(payload)))
+            conn.out.append(payload)
+        elif len(conn.out) > 0 and isinstance(conn.out[-1], bytearray) and len(conn.out[-1]) < self.__coalesce_bytes__:
+            conn.out[-1] += pack_frame(payload, flags)
+        else:
+            conn.out.append(bytearray(pack_frame(payload, flags)))
+        conn.out_bytes += len(payload) + FrameConstants.FRAME_HEADER_SIZE
+        self.__bytes_out__.inc(len(payload) + FrameConstants.FRAME_HEADER_SIZE)
+        self.__msgs_out__.inc()
+
+    def __flush__(self, conn: ReactorConnection):
+        """ 非阻塞地写出待发送数据，写不完的部分等待 socket 可写 """
+        while len(conn.out) > 0:
+            head = conn.out[0]
+            try:
+                sent = conn.sock.send(head)
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError as e:
+                self.log.warning('message to {} failed: {}'.format(conn.addr, e))
+                self.__close_conn__(conn)
+                return
+            self.__writes__.inc()
+            conn.out_bytes -= sent
+            if sent < len(head):
+                conn.out[0] = memoryview(head)[sent:]
+                break
+            conn.out.popleft()
+        if len(conn.out) == 0 and conn.closing is True:
+            self.__close_conn__(conn)
+        elif conn.addr in self.__conn_dict__:
+            self.__set_events__(conn)
+
+    def __write_msgs__(self, msg_list: list):
+        touched = dict()
+        for msg_obj in msg_list:
+            conn = self.__conn_dict__.get(msg_obj.addr, None)
+            if conn is None or conn.closing is True:
+                self.log.warning('message to closed connection {} dropped.'.format(msg_obj.addr))
+                continue
+            if conn.out_bytes >= self.__out_buffer_size__:
+                if self.__slow_client_policy__ == 'drop':
+                    self.__dropped__.inc()
+                    self.log.debug('outbound buffer of %s full, message dropped.', msg_obj.addr)
+                    continue
+                elif self.__slow_client_policy__ == 'disconnect':
+                    self.__slow_disconnects__.inc()
+                    self.log.warning('outbound buffer of {} full, connection closed.'.format(msg_obj.addr))
+                    touched.pop(msg_obj.addr, None)
+                    self.__close_conn__(conn)
+                    continue
+            self.__queue_frame__(conn, msg_obj.msg)
+            touched[msg_obj.addr] = conn
+            self.msg_log.debug('message to %s: %s', msg_obj.addr, msg_obj.msg)
+        for conn in touched.values():
+            self.__flush__(conn)
+
+    def __send_msg__(self):
+        """ 将 msg_out 中已有的消息一并转交给 reactor 线程发送 """
+        while True:
+            try:
+                msg_obj = self.msg_out.get()
+            except KeyboardInterrupt:
+                break
+            if msg_obj is None:
+                break
+
+            msg_list, stopped = [msg_obj], False
+            while True:
+                try:
+                    msg_obj = self.msg_out.get_nowait()
+                except Empty:
+                    break
+                if msg_obj is None:
+                    stopped = True
+                    break
+                msg_list.append(msg_obj)
+            if any(not isinstance(var, SocketMessage) for var in msg_list):
+                raise NotImplementedError
+            self.__call_soon__(self.__write_msgs__, msg_list)
+            if stopped is True:
+                break
+
+    def __run_calls__(self):
+        try:
+            while self.__wake_r__.recv(4096):
+                pass
+        except (BlockingIOError, InterruptedError):
+            pass
+        while len(self.__calls__) > 0:
+            func, args = self.__calls__.popleft()
+            func(*args)
+
+    def __shutdown__(self):
+        """ 停止接收连接和消息，已排队的回复写完（或超时）后退出循环 """
+        self.__stopping__ = True
+        self.__selector__.unregister(self.socket)
+        for conn in list(self.__conn_dict__.values()):
+            conn.closing = True
+            self.__flush__(conn)
+
+    def __server_process__(self):
+        deadline = None
+        while True:
+            if self.__stopping__ is True:
+                deadline = deadline if deadline is not None else time.monotonic() + self.__time_out__
+                timeout = deadline - time.monotonic()
+                if len(self.__conn_dict__) == 0 or timeout <= 0:
+                    break
+            else:
+                timeout = None
+            for key, events in self.__selector__.select(timeout):
+                if key.data is None:
+                    self.__accept__()
+                elif key.data == 'wake':
+                    self.__run_calls__()
+                else:
+                    conn = key.data
+                    if events & selectors.EVENT_WRITE:
+                        self.__flush__(conn)
+                    if events & selectors.EVENT_READ and conn.addr in self.__conn_dict__ and not conn.closing:
+                        self.__read__(conn)
+
+        for conn in list(self.__conn_dict__.values()):
+            self.__close_conn__(conn)
+
+    def start(self):
+        self.__stop_event__.clear()
+        self.__stopping__ = False
+        self.__selector__ = selectors.DefaultSelector()
+        self.__wake_r__, self.__wake_w__ = socket.socketpair()
+        self.__wake_r__.setblocking(False)
+        self.__wake_w__.setblocking(False)
+        self.__selector__.register(self.__wake_r__, selectors.EVENT_READ, 'wake')
+        self.__hook_executor__ = ThreadPoolExecutor(max_workers=1, thread_name_prefix='socket reactor hook')
+
+        self.__send_tag__ = True
+        self.__send_thread__ = Thread(target=self.__send_msg__, name='socket message sending service')
+        self.__send_thread__.start()
+        self.log.debug('message sending started.')
+
+        self.__process_tag__ = True
+        self.__process_thread__ = Thread(target=self.process_msg, name='socket message process')
+        self.__process_thread__.start()
+        self.log.debug('message processing started.')
+
+        self.socket.listen(1024)
+        self.socket.setblocking(False)
+        self.__selector__.register(self.socket, selectors.EVENT_READ, None)
+        self.__receive_tag__ = True
+        self.__server_tag__ = True
+        self.__server_thread__ = Thread(target=self.__server_process__, name='socket server reactor')
+        self.__server_thread__.start()
+
+        self.log.info('{} started.'.format(self.__class__.__name__))
+
+    def stop(self):
+        if self.__server_thread__ is None or self.__stop_event__.is_set():
+            return
+        self.__receive_tag__ = False
+        self.__server_tag__ = False
+
+        self.__process_tag__ = False
+        self.__stop_event__.set()
+        self.msg_in.put(None)
+        self.__join__(self.__process_thread__, 'message processing')
+
+        self.__send_tag__ = False
+        self.msg_out.put(None)
+        self.__join__(self.__send_thread__, 'message sending')
+
+        # 发送线程已将回复交给 reactor 线程，关闭前写出的数据仍会被发送
+        self.__call_soon__(self.__shutdown__)
+        self.__join__(self.__server_thread__, 'server reactor')
+
+        self.__hook_executor__.shutdown(wait=True)
+        self.__selector__.close()
+        self.__wake_r__.close()
+        self.__wake_w__.close()
+        self.__close_listener__()
+        self.__release_all__()
+
+        self.log.info('{} stopped.'.format(self.__class__.__name__))
@@ -0,0 +1,139 @@
+# -*- encoding: UTF-8 -*-
+import time
+
+from collections import OrderedDict, deque
+from threading import Lock
+
+from Socketer.WorkerPool import WorkerPool
+
+
+PRIORITIES = ('high', 'normal', 'low')
+
+
+class TokenBucket(object):
+    """ rate tokens per second up to burst tokens """
+    __slots__ = ('rate', 'burst', 'tokens', 'time')
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.time = time.perf_counter()
+
+    def take(self, cost: float = 1.0):
+        now = time.perf_counter()
+        self.tokens = min(self.burst, self.tokens + (now - self.time) * self.rate)
+        self.time = now
+        if self.tokens < cost:
+            return False
+        self.tokens -= cost
+        return True
+
+
+class RateLimiter(object):
+    """ One TokenBucket per client key, rate=0 disables limiting """
+
+    def __init__(self, rate: float = 0.0, burst: float = 50.0):
+        if rate > 0 and burst < 1:
+            raise ValueError('param burst should be at least 1 but got {}.'.format(burst))
+        self.rate = rate
+        self.burst = burst
+        self.__bucket_dict__ = dict()
+        self.__lock__ = Lock()
+        self.__limited__ = 0
+
+    def allow(self, client_key, cost: float = 1.0):
+        """ 令牌足够时扣除并返回 True，否则返回 False（超过 burst 的请求永远被拒绝） """
+        if self.rate <= 0:
+            return True
+        with self.__lock__:
+            bucket = self.__bucket_dict__.get(client_key, None)
+            if bucket is None:
+                bucket = self.__bucket_dict__[client_key] = TokenBucket(self.rate, self.burst)
+            if bucket.take(cost):
+                return True
+            self.__limited__ += 1
+            return False
+
+    def forget(self, client_key):
+        with self.__lock__:
+            self.__bucket_dict__.pop(client_key, None)
+
+    def stats(self):
+        with self.__lock__:
+            return {'rate': self.rate, 'burst': self.burst, 'clients': len(self.__bucket_dict__),
+                    'limited': self.__limited__}
+
+
+class Scheduler(WorkerPool):
+    """
+    WorkerPool with one lane per priority in PRIORITIES. Workers always take the next task of the
+    highest non-empty lane, so interactive queries overtake queued backfills; within a lane
+    clients are served round-robin as in WorkerPool. Every lane holds at most max_queue_size
+    tasks and submit() rejects at once when it is full.
+
+    A task submitted with a deadline (a time.perf_counter() value) that is still queued when the
+    deadline has passed is not run; on_expired() is called instead, e.g. to tell the caller.
+    """
+
+    def __init__(self, workers: int = 4, max_queue_size: int = 1000, name: str = 'worker'):
+        super(Scheduler, self).__init__(workers=workers, max_queue_size=max_queue_size, name=name)
+        self.__lane_list__ = [OrderedDict() for var in PRIORITIES]
+        self.__lane_size__ = [0] * len(PRIORITIES)
+        self.__expired__ = 0
+
+    @staticmethod
+    def check_priority(priority: str):
+        if priority not in PRIORITIES:
+            raise ValueError('param priority should be in {} but got {}.'.format(PRIORITIES, priority))
+        return PRIORITIES.index(priority)
+
+    def submit(self, client_key, func, *args, priority: str = 'normal', deadline: float = None, on_expired=None):
+        """ 提交任务，所在优先级的队列已满时返回 False """
+        lane = self.check_priority(priority)
+        if deadline is not None:
+            func, args = self.__run_before__, (deadline, on_expired, func, args)
+        with self.__condition__:
+            if self.__lane_size__[lane] >= self.__max_queue_size__:
+                self.__rejected__ += 1
+                return False
+            client_queue = self.__lane_list__[lane]
+            if client_key not in client_queue:
+                client_queue[client_key] = deque()
+            client_queue[client_key].append((func, args))
+            self.__lane_size__[lane] += 1
+            self.__queue_size__ += 1
+            self.__condition__.notify()
+        return True
+
+    def __next_task__(self):
+        """ 取优先级最高的非空队列，调用前需持有 __condition__ """
+        for lane, client_queue in enumerate(self.__lane_list__):
+            if self.__lane_size__[lane] == 0:
+                continue
+            client_key, task_queue = client_queue.popitem(last=False)
+            task = task_queue.popleft()
+            if len(task_queue) > 0:
+                client_queue[client_key] = task_queue
+            self.__lane_size__[lane] -= 1
+            self.__queue_size__ -= 1
+            return task
+        raise RuntimeError('no task queued.')
+
+    def __run_before__(self, deadline: float, on_expired, func, args):
+        if time.perf_counter() <= deadline:
+            return func(*args)
+        with self.__condition__:
+            self.__expired__ += 1
+        if on_expired is not None:
+            on_expired()
+
+    def stats(self):
+        result = super(Scheduler, self).stats()
+        with self.__condition__:
+            result.update({
+                'clients_waiting': sum(len(var) for var in self.__lane_list__),
+                'lanes': dict(zip(PRIORITIES, self.__lane_size__)),
+                'expired': self.__expired__,
+            })
+        return result
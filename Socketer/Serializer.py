@@ -0,0 +1,161 @@
+# -*- encoding: UTF-8 -*-
+"""
+Message serializers of WindClient and WindServer.
+
+The client offers its serializers in the 'hello' request:
+
+    {"id": 1, "func": "hello", "args": {"encodings": [...], "serializers": ["msgpack", "orjson", "json"]}}
+
+and the server answers with the first offered one it also has, 'json' if none:
+
+    {"id": 1, "status": 0, "encoding": "binary", "serializer": "orjson"}
+
+Afterwards both sides write messages with it. 'json' and 'orjson' write the same JSON text in
+text frames, so text is always parsed with the fastest JSON library installed (orjson writes NaN
+as null). 'msgpack' messages go in binary frames; on such connections binary wsd results are
+wrapped as {"wire": <WireFormat bytes>}, so every binary frame is a msgpack message.
+
+Dates are written as 'YYYYMMDD' by every serializer. format_dates / parse_dates convert whole
+Times columns through a cache instead of calling strftime / strptime for every element.
+"""
+import datetime
+import json
+
+from Socketer.WireFormat import numpy
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+# 日期缓存的最大项数，超过后清空重建
+DATE_CACHE_SIZE = 100000
+__date_text__ = dict()
+__text_date__ = dict()
+
+
+def format_date(value):
+    """ date / datetime -> 'YYYYMMDD'，字符串原样返回 """
+    text = __date_text__.get(value, None)
+    if text is not None:
+        return text
+    if isinstance(value, str):
+        return value
+    if len(__date_text__) >= DATE_CACHE_SIZE:
+        __date_text__.clear()
+    text = __date_text__[value] = str(value.year * 10000 + value.month * 100 + value.day)
+    return text
+
+
+def format_dates(values: list):
+    return [format_date(var) for var in values]
+
+
+def parse_date(text: str):
+    """ 'YYYYMMDD' -> date """
+    value = __text_date__.get(text, None)
+    if value is not None:
+        return value
+    if len(__text_date__) >= DATE_CACHE_SIZE:
+        __text_date__.clear()
+    value = __text_date__[text] = datetime.date(int(text[:4]), int(text[4:6]), int(text[6:8]))
+    return value
+
+
+def parse_dates(texts: list):
+    return [parse_date(var) for var in texts]
+
+
+def parse_days(texts: list):
+    """ 'YYYYMMDD' 列表 -> datetime64[D] 数组，按年、月、日整体计算 """
+    if numpy is None:
+        raise ImportError('numpy is required for parse_days.')
+    values = numpy.array(texts, dtype='U8').astype('i8')
+    months = (values // 10000 - 1970).astype('datetime64[Y]').astype('datetime64[M]') + (values // 100 % 100 - 1)
+    return months.astype('datetime64[D]') + (values % 100 - 1)
+
+
+def __default__(obj):
+    if isinstance(obj, datetime.date):
+        return format_date(obj)
+    raise TypeError('Object of type {} is not serializable.'.format(type(obj).__name__))
+
+
+class JsonSerializer(object):
+    name = 'json'
+    binary = False
+
+    def dumps(self, obj):
+        return json.dumps(obj, default=__default__)
+
+    def loads(self, msg):
+        return json.loads(msg)
+
+
+class OrjsonSerializer(object):
+    name = 'orjson'
+    binary = False
+    # 日期交由 __default__ 写为 'YYYYMMDD'，而非 orjson 默认的 ISO 格式
+    OPTIONS = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS if orjson is not None else 0
+
+    def dumps(self, obj):
+        return orjson.dumps(obj, default=__default__, option=self.OPTIONS).decode('utf-8')
+
+    def loads(self, msg):
+        return orjson.loads(msg)
+
+
+class MsgpackSerializer(object):
+    name = 'msgpack'
+    binary = True
+
+    def dumps(self, obj):
+        return msgpack.packb(obj, default=__default__, use_bin_type=True)
+
+    def loads(self, msg):
+        return msgpack.unpackb(msg, raw=False)
+
+
+# 按优先顺序排列，仅包含已安装的实现
+SERIALIZERS = dict(
+    ([('msgpack', MsgpackSerializer())] if msgpack is not None else [])
+    + ([('orjson', OrjsonSerializer())] if orjson is not None else [])
+    + [('json', JsonSerializer())]
+)
+# 文本帧均为 JSON，以已安装的最快实现读写
+TEXT = SERIALIZERS['orjson'] if 'orjson' in SERIALIZERS else SERIALIZERS['json']
+
+
+def register(serializer, first: bool = False):
+    """ 注册自定义实现，需有 name / binary / dumps / loads；first 为 True 时优先协商 """
+    items = [(name, var) for name, var in SERIALIZERS.items() if name != serializer.name]
+    items = [(serializer.name, serializer)] + items if first is True else items + [(serializer.name, serializer)]
+    SERIALIZERS.clear()
+    SERIALIZERS.update(items)
+
+
+def offer(serializers):
+    """ serializers: True 表示全部可用实现，或名称列表 """
+    if serializers is True:
+        return list(SERIALIZERS.keys())
+    return [var for var in serializers if var in SERIALIZERS]
+
+
+def negotiate(offered: list):
+    for var in offered:
+        if var in SERIALIZERS:
+            return var
+    return 'json'
+
+
+def loads(msg, serializer=TEXT):
+    """ 文本帧均为 JSON，以最快的实现读取；二进制帧由本连接协商的 serializer 读取 """
+    if isinstance(msg, str):
+        return TEXT.loads(msg)
+    return serializer.loads(msg)
@@ -1,42 +1,111 @@
 # -*- encoding: UTF-8 -*-
+import itertools
+import os
 import socket
 import time
 
 from queue import Queue, Empty
-from threading import Thread
+from threading import Event, Lock, Thread
 
-from Socketer.utils import get_logger, SocketConstants
+from Socketer.Compression import DEFAULT_THRESHOLD, FrameCompression, compression_stats, negotiate, offer, \
+    pack_hello, unpack_hello
+from Socketer.Framing import FrameConstants, FrameReader, FrameError
+from Socketer.Metrics import MetricsRegistry
+from Socketer.Transport import ShmEncoder, ShmRing, bind_socket, check_transport, default_unix_path, shared_memory, \
+    unpack_shm
+from Socketer.utils import DEFAULT_LOG_LEVEL, MessageLog, get_logger, log_stats, SocketConstants
+from Socketer.Writer import ClientWriter
 
 
 class SocketMessage(object):
-    def __init__(self, addr: str, msg: str):
+    """ msg: str 以 msg_encoding 编码发送，bytes 作为二进制帧原样发送；time 为创建时刻，用于统计请求耗时 """
+    __slots__ = ('addr', 'msg', 'time')
+
+    def __init__(self, addr: str, msg):
         self.addr = addr
         self.msg = msg
+        self.time = time.perf_counter()
 
 
 class SocketServer(SocketConstants):
-
-    def __init__(self, port: int = 33331, bufsize: int = 1024,
-                 time_out: float = 1.0, msg_encoding: str = 'utf-8', **kwargs):
+    """
+    Threaded socket server: one accept thread, one receiving and one writer thread per connection,
+    one sending thread and one process_msg thread. All threads block on their socket or queue and
+    are woken by closing the socket or by a None sentinel in the queue, so stop() returns within
+    milliseconds.
+
+    The sending thread only routes msg_out to the outbound queue of each connection, whose writer
+    coalesces small replies into one write; routing never waits for a connection. A slow reader
+    fills only its own queue and once out_queue_size frames wait, slow_client_policy keeps queueing
+    but closes it if still full after slow_client_timeout seconds ('block'), drops its replies
+    ('drop') or closes it ('disconnect').
+
+    Clients may offer compression in a handshake frame; compression (True, False or codec names)
+    limits what is accepted and frames of at least compress_threshold bytes are compressed.
+
+    reuse_port=True sets SO_REUSEPORT so that several processes can serve the same port, see
+    PreforkServer.
+
+    transport 'tcp' binds host:port (host defaults to socket.gethostname()); 'unix' binds the
+    AF_UNIX socket unix_path for clients on the same machine, which may also ask for a per
+    connection shared-memory ring of shm_size bytes carrying replies of at least shm_threshold
+    bytes (shm_size=0 refuses), see Socketer.Transport.
+
+    Traffic, connections and queue depths are counted in self.metrics unless metrics=False is
+    passed; stats() and metrics_text() expose them.
+
+    Logging defaults to log_level='info' through the shared log thread (log_async=False writes
+    synchronously). At 'debug' every message is logged with its payload cut to log_payload_limit
+    characters, or only one in log_sample messages.
+    """
+
+    def __init__(self, port: int = 33331, bufsize: int = 64 * 1024,
+                 time_out: float = 1.0, msg_encoding: str = 'utf-8', max_frame_size: int = None,
+                 out_queue_size: int = 1000, slow_client_policy: str = 'block', slow_client_timeout: float = 5.0,
+                 coalesce_bytes: int = 256 * 1024, compression=True, compress_threshold: int = DEFAULT_THRESHOLD,
+                 reuse_port: bool = False, host: str = None, transport: str = 'tcp', unix_path: str = None,
+                 shm_size: int = 64 * 1024 * 1024, shm_threshold: int = 256 * 1024, **kwargs):
+        if slow_client_policy not in ClientWriter.POLICIES:
+            raise ValueError('param slow_client_policy should be in {} but got {}.'.format(
+                ClientWriter.POLICIES, slow_client_policy))
+        check_transport(transport)
         self.log = get_logger(
             self.__class__.__name__,
             log_path=kwargs.get('log_path', None),
-            log_level=kwargs.get('log_level', 'debug'),
+            log_level=kwargs.get('log_level', DEFAULT_LOG_LEVEL),
+            log_async=kwargs.get('log_async', True),
         )
+        # 逐条消息的 debug 日志只记录每 log_sample 条中的一条，内容截断至 log_payload_limit 个字符
+        self.msg_log = MessageLog(
+            self.log, sample=kwargs.get('log_sample', 1), limit=kwargs.get('log_payload_limit', 256))
 
-        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self.socket.bind((socket.gethostname(), port))
-        self.socket.settimeout(time_out)
+        self.__transport__ = transport
+        self.__unix_path__ = unix_path or default_unix_path(port)
+        self.socket = bind_socket(
+            transport, host or socket.gethostname(), port, unix_path=self.__unix_path__, reuse_port=reuse_port)
 
         self.msg_in = Queue()
         self.msg_out = Queue()
-        self.server_task = Queue()
 
         self.__bufsize__ = bufsize
+        self.__time_out__ = time_out
+        self.__max_frame_size__ = max_frame_size
         self.__msg_encoding__ = msg_encoding
+        self.__out_queue_size__ = out_queue_size
+        self.__slow_client_policy__ = slow_client_policy
+        self.__slow_client_timeout__ = slow_client_timeout
+        self.__coalesce_bytes__ = coalesce_bytes
+        self.__compression__ = offer(compression)
+        self.__compress_threshold__ = compress_threshold
+        self.__shm_size__ = shm_size if transport == 'unix' and shared_memory is not None else 0
+        self.__shm_threshold__ = shm_threshold
+        self.__shm_dict__ = dict()
+        self.__connection_id__ = itertools.count(1)
         self.__client_dict__ = dict()
         self.__thread_dict__ = dict()
+        self.__out_dict__ = dict()
+        self.__client_lock__ = Lock()
+        self.__stop_event__ = Event()
 
         self.__receive_tag__ = False
 
@@ -49,44 +118,217 @@ class SocketServer(SocketConstants):
         self.__process_tag__ = False
         self.__process_thread__ = None
 
+        self.metrics = MetricsRegistry(enabled=kwargs.get('metrics', True))
+        self.__init_metrics__()
+
+    def __init_metrics__(self):
+        metrics = self.metrics
+        self.__bytes_in__ = metrics.counter('socketer_bytes_in_total', 'Bytes received including frame headers')
+        self.__bytes_out__ = metrics.counter('socketer_bytes_out_total', 'Bytes sent including frame headers')
+        self.__msgs_in__ = metrics.counter('socketer_messages_in_total', 'Messages received')
+        self.__msgs_out__ = metrics.counter('socketer_messages_out_total', 'Messages sent')
+        self.__msg_size_in__ = metrics.histogram(
+            'socketer_message_in_bytes', 'Size of received messages',
+            buckets=(64, 256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216),
+        )
+        self.__connections__ = metrics.counter('socketer_connections_total', 'Accepted connections')
+        self.__writes__ = metrics.counter('socketer_writes_total', 'Socket writes, less than messages when coalesced')
+        self.__dropped__ = metrics.counter('socketer_dropped_total', 'Replies dropped for slow clients')
+        self.__slow_disconnects__ = metrics.counter(
+            'socketer_slow_disconnects_total', 'Slow clients disconnected with a full outbound queue')
+        metrics.gauge('socketer_queue_depth', 'Messages waiting in queue', func=self.__out_queue_depth__,
+                      queue='client_out')
+        metrics.gauge('socketer_active_connections', 'Open connections', func=self.__active_connections__)
+        metrics.gauge('socketer_queue_depth', 'Messages waiting in queue', func=self.msg_in.qsize, queue='msg_in')
+        metrics.gauge('socketer_queue_depth', 'Messages waiting in queue', func=self.msg_out.qsize, queue='msg_out')
+
+    def __active_connections__(self):
+        return len(self.__client_dict__)
+
+    def __out_queue_depth__(self):
+        return sum(var.qsize() for var in list(self.__out_dict__.values()))
+
+    def out_backlog(self, sock_addr):
+        """ 已放入连接的发送队列而尚未写出的字节数，连接不存在时为 0 """
+        writer = self.__out_dict__.get(sock_addr, None)
+        return writer.queued_bytes if writer is not None else 0
+
+    def stats(self):
+        """ 连接数、队列深度及全部统计项的当前值 """
+        return {
+            'connections': self.__active_connections__(),
+            'msg_in': self.msg_in.qsize(),
+            'msg_out': self.msg_out.qsize(),
+            'compression': compression_stats(self.metrics),
+            'log': log_stats(),
+            'metrics': self.metrics.snapshot(),
+        }
+
+    def metrics_text(self):
+        """ Prometheus 文本格式的统计项 """
+        return self.metrics.dump_prometheus()
+
+    def __peer_addr__(self, client_addr):
+        """ AF_UNIX 客户端的地址为空，以连接序号区分 """
+        if self.__transport__ == 'unix':
+            return 'unix:{}'.format(next(self.__connection_id__))
+        return client_addr
+
+    def __handshake__(self, sock_addr, payload: bytes):
+        """ 处理客户端的握手帧，返回本连接的帧编码（压缩及共享内存，均不使用时为 None）及回复的握手帧 """
+        try:
+            offered, shm = unpack_hello(payload) or list(), unpack_shm(payload)
+        except ValueError:
+            offered, shm = list(), None
+        codec = negotiate(offered, self.__compression__)
+        self.log.debug('connection %s negotiated compression %s.', sock_addr, codec)
+        compression = FrameCompression(codec, self.__compress_threshold__, self.metrics, self.__max_frame_size__) \
+            if codec is not None else None
+        if shm is not True or self.__shm_size__ <= 0:
+            return compression, pack_hello(codec)
+        try:
+            ring = ShmRing(self.__shm_size__)
+        except OSError as e:
+            self.log.warning('shared memory for {} refused: {}'.format(sock_addr, e))
+            return compression, pack_hello(codec, shm=None)
+        self.__shm_dict__[sock_addr] = ring
+        self.log.debug('connection %s uses shared memory %s.', sock_addr, ring.name)
+        return ShmEncoder(ring, self.__shm_threshold__, compression), pack_hello(
+            codec, shm={'name': ring.name, 'size': ring.size})
+
+    def __release_connection__(self, sock_addr):
+        """ 连接关闭后释放其共享内存 """
+        ring = self.__shm_dict__.pop(sock_addr, None)
+        if ring is not None:
+            ring.close()
+
+    def __release_all__(self):
+        """ stop() 最后释放仍未释放的共享内存，如自行关闭中的连接 """
+        for sock_addr in list(self.__shm_dict__.keys()):
+            self.__release_connection__(sock_addr)
+
+    def __close_listener__(self):
+        """ 关闭监听 socket 并删除 unix socket 文件 """
+        self.socket.close()
+        if self.__transport__ == 'unix':
+            try:
+                os.remove(self.__unix_path__)
+            except OSError:
+                pass
+
     def on_new_client(self, sock_addr: str):
         pass
 
+    def on_client_exit(self, sock_addr: str):
+        pass
+
+    def __close_client__(self, sock_addr):
+        """ 关闭并移除客户端连接，可由任意线程调用 """
+        with self.__client_lock__:
+            sock_client = self.__client_dict__.pop(sock_addr, None)
+            self.__thread_dict__.pop(sock_addr, None)
+            writer = self.__out_dict__.pop(sock_addr, None)
+        if sock_client is None:
+            return
+        assert isinstance(sock_client, socket.socket)
+        try:
+            sock_client.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        if writer is not None:
+            writer.close(flush=False, timeout=self.__time_out__)
+        sock_client.close()
+        self.__release_connection__(sock_addr)
+        self.on_client_exit(sock_addr)
+        self.log.debug('connection %s closed.', sock_addr)
+
     def __receiving_msg__(self, sock_client: socket.socket, sock_addr):
+        reader = FrameReader(sock_client, bufsize=self.__bufsize__, max_frame_size=self.__max_frame_size__)
+        compression = None
         while self.__receive_tag__ is True:
             try:
-                msg = sock_client.recv(self.__bufsize__).decode(self.__msg_encoding__)
-            except socket.timeout:
-                continue
+                frames = reader.feed()
+            except FrameError as e:
+                self.log.error('invalid frame from {}: {}'.format(sock_addr, e))
+                frames = None
+            except OSError as e:
+                if self.__receive_tag__ is True:
+                    self.log.warning('connection {} lost: {}'.format(sock_addr, e))
+                frames = None
             except KeyboardInterrupt:
                 break
 
-            if len(msg) == 0:
-                continue
-
-            self.log.debug('message from {} with {}'.format(sock_addr, msg))
-            if msg == self.CLIENT_EXIT_MSG:
-                self.msg_out.put(SocketMessage(sock_addr, self.CLIENT_EXIT_MSG))
-                self.server_task.put(SocketMessage(sock_addr, self.CLIENT_EXIT_MSG))
-                sock_client.shutdown(socket.SHUT_RD)
+            if frames is None:
+                self.__close_client__(sock_addr)
                 break
-            else:
-                self.msg_in.put(SocketMessage(sock_addr, msg))
+
+            for flags, payload in frames:
+                self.__bytes_in__.inc(len(payload) + FrameConstants.FRAME_HEADER_SIZE)
+                if flags & FrameConstants.FLAG_CONTROL:
+                    compression, reply = self.__handshake__(sock_addr, payload)
+                    writer = self.__out_dict__.get(sock_addr, None)
+                    if writer is not None:
+                        writer.put(reply, FrameConstants.FLAG_CONTROL)
+                        writer.compression = compression
+                    continue
+                if compression is not None:
+                    try:
+                        payload, flags = compression.decode(payload, flags)
+                    except Exception as e:
+                        self.log.error('invalid compressed frame from {}: {}'.format(sock_addr, e))
+                        self.__close_client__(sock_addr)
+                        return
+                self.__msgs_in__.inc()
+                self.__msg_size_in__.observe(len(payload))
+                if flags & FrameConstants.FLAG_BINARY:
+                    msg = payload
+                else:
+                    msg = payload.decode(self.__msg_encoding__)
+                self.msg_log.debug('message from %s with %s', sock_addr, msg)
+                if msg == self.CLIENT_EXIT_MSG:
+                    # 连接在退出消息回送后由发送线程关闭
+                    self.msg_out.put(SocketMessage(sock_addr, self.CLIENT_EXIT_MSG))
+                    return
+                else:
+                    self.msg_in.put(SocketMessage(sock_addr, msg))
+
+    def __on_sent__(self, frames: int, sent: int, writes: int):
+        """ 由各连接的写线程在写出一批帧后调用 """
+        self.__bytes_out__.inc(sent)
+        self.__msgs_out__.inc(frames)
+        self.__writes__.inc(writes)
 
     def __send_msg__(self):
-        while self.__send_tag__ is True:
+        """ 将 msg_out 中的消息分发至各连接的发送队列 """
+        while True:
             try:
-                msg_obj = self.msg_out.get(timeout=1)
-            except Empty:
-                continue
+                msg_obj = self.msg_out.get()
             except KeyboardInterrupt:
                 break
+            if msg_obj is None:
+                break
 
             if isinstance(msg_obj, SocketMessage):
-                msg_client = self.__client_dict__[msg_obj.addr]
-                assert isinstance(msg_client, socket.socket)
-                msg_client.sendall(msg_obj.msg.encode(self.__msg_encoding__))
-                self.log.debug('message to {}: {}'.format(msg_obj.addr, msg_obj.msg))
+                writer = self.__out_dict__.get(msg_obj.addr, None)
+                if writer is None:
+                    self.log.warning('message to closed connection {} dropped.'.format(msg_obj.addr))
+                    continue
+                assert isinstance(writer, ClientWriter)
+                if isinstance(msg_obj.msg, bytes):
+                    accepted = writer.put(msg_obj.msg, FrameConstants.FLAG_BINARY)
+                else:
+                    accepted = writer.put(msg_obj.msg.encode(self.__msg_encoding__),
+                                          close_after=msg_obj.msg == self.CLIENT_EXIT_MSG)
+                if accepted is True:
+                    self.msg_log.debug('message to %s: %s', msg_obj.addr, msg_obj.msg)
+                elif self.__slow_client_policy__ != 'drop' and writer.is_closed() and \
+                        msg_obj.addr in self.__client_dict__:
+                    self.__slow_disconnects__.inc()
+                    self.log.warning('outbound queue of {} full, connection closed.'.format(msg_obj.addr))
+                    self.__close_client__(msg_obj.addr)
+                elif self.__slow_client_policy__ == 'drop' and not writer.is_closed():
+                    self.__dropped__.inc()
+                    self.log.debug('outbound queue of %s full, message dropped.', msg_obj.addr)
             else:
                 raise NotImplementedError
 
@@ -94,42 +336,46 @@ class SocketServer(SocketConstants):
         while self.__server_tag__ is True:
             try:
                 client_sock, client_addr = self.socket.accept()
-                self.log.debug('new connection from {}.'.format(client_addr))
-                self.on_new_client(client_addr)
-                self.__client_dict__[client_addr] = client_sock
-                new_thread = Thread(target=self.__receiving_msg__, args=(client_sock, client_addr))
-                new_thread.start()
-                self.__thread_dict__[client_addr] = new_thread
-            except socket.timeout:
-                if not self.server_task.empty():
-                    obj = self.server_task.get(timeout=1)
-                    assert isinstance(obj, SocketMessage)
-                    if obj.msg == self.CLIENT_EXIT_MSG:
-                        sock_client = self.__client_dict__.pop(obj.addr)
-                        assert isinstance(sock_client, socket.socket)
-                        sock_client.shutdown(socket.SHUT_WR)
-                        sock_client.close()
-                        if obj.addr in self.__thread_dict__:
-                            self.__thread_dict__.pop(obj.addr)
-                    else:
-                        raise NotImplementedError('Unknown SocketServer task {} from {}'.format(obj.msg, obj.addr))
-                else:
-                    continue
+            except OSError:
+                # stop() 关闭监听 socket 以唤醒 accept
+                if self.__server_tag__ is True:
+                    self.log.exception('accept failed.')
+                break
             except KeyboardInterrupt:
                 break
 
+            client_sock.settimeout(None)
+            client_addr = self.__peer_addr__(client_addr)
+            self.__connections__.inc()
+            self.log.debug('new connection from %s.', client_addr)
+            self.on_new_client(client_addr)
+            new_thread = Thread(target=self.__receiving_msg__, args=(client_sock, client_addr))
+            writer = ClientWriter(
+                client_sock, client_addr, self.__close_client__, max_queue_size=self.__out_queue_size__,
+                policy=self.__slow_client_policy__, coalesce_bytes=self.__coalesce_bytes__,
+                block_timeout=self.__slow_client_timeout__, on_sent=self.__on_sent__,
+            )
+            with self.__client_lock__:
+                self.__client_dict__[client_addr] = client_sock
+                self.__thread_dict__[client_addr] = new_thread
+                self.__out_dict__[client_addr] = writer
+            writer.start()
+            new_thread.start()
+
     def process_msg(self):
-        while self.__process_tag__ is True:
-            time.sleep(1)
+        """ 子类实现：从 msg_in 取消息直到取到 None，结果放入 msg_out """
+        self.__stop_event__.wait()
 
     def start(self):
+        self.__stop_event__.clear()
+
         self.__send_tag__ = True
         self.__send_thread__ = Thread(target=self.__send_msg__, name='socket message sending service')
         self.__send_thread__.start()
         self.log.debug('message sending started.')
 
         self.log.debug('start waiting for socket connection.')
-        self.socket.listen(10)
+        self.socket.listen(128)
 
         self.__process_tag__ = True
         self.__process_thread__ = Thread(target=self.process_msg, name='socket message process')
@@ -143,50 +389,49 @@ class SocketServer(SocketConstants):
 
         self.log.info('{} started.'.format(self.__class__.__name__))
 
-    def stop(self):
-        self.__receive_tag__ = False
-        for t_key, t_value in self.__thread_dict__.items():
-            t_value.join()
-
-        time.sleep(1)
-        for t_key, t_value in self.__thread_dict__.items():
-            assert isinstance(t_value, Thread)
-            if t_value.is_alive():
-                self.log.warning('thread {} not stopped.'.format(t_key))
-            else:
-                self.log.debug('thread {} stopped.'.format(t_key))
-
-        # while self.msg_in.empty() is False:
-        #     time.sleep(0.1)
-        # self.log.debug('all message received processed.')
-        # TODO: 暂存未处理消息
-
-        self.__server_tag__ = False
-        self.__server_thread__.join(3)
-        if self.__server_thread__.is_alive():
-            self.log.warning('server thread not stopped.')
+    def __join__(self, thread: Thread, name: str):
+        thread.join(self.__time_out__)
+        if thread.is_alive():
+            self.log.warning('{} thread not stopped.'.format(name))
         else:
-            self.log.debug('server thread stopped.')
+            self.log.debug('%s thread stopped.', name)
 
-        while self.msg_out.empty() is False:
-            time.sleep(0.1)
-        self.log.debug('all task processed send.')
+    def stop(self):
+        if self.__server_thread__ is None or self.__stop_event__.is_set():
+            return
 
+        # 1. 停止接收新连接
+        self.__server_tag__ = False
+        self.__receive_tag__ = False
+        try:
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.__close_listener__()
+        self.__join__(self.__server_thread__, 'server')
+
+        # 2. 处理完已收到的消息
+        # TODO: 暂存未处理消息
         self.__process_tag__ = False
-        self.__process_thread__.join(2)
-        if self.__process_thread__.is_alive():
-            self.log.warning('message processing thread not stopped.')
-        else:
-            self.log.debug('message processing thread stopped.')
+        self.__stop_event__.set()
+        self.msg_in.put(None)
+        self.__join__(self.__process_thread__, 'message processing')
 
+        # 3. 发送完已产生的回复
         self.__send_tag__ = False
-        self.__send_thread__.join(2)
-        if self.__send_thread__.is_alive():
-            self.log.warning('message sending thread not stopped.')
-        else:
-            self.log.debug('message sending thread stopped.')
-
-        self.socket.close()
+        self.msg_out.put(None)
+        self.__join__(self.__send_thread__, 'message sending')
+
+        # 4. 写出各连接已排队的回复后关闭所有连接
+        with self.__client_lock__:
+            client_list = list(self.__thread_dict__.items())
+            writer_list = list(self.__out_dict__.values())
+        for writer in writer_list:
+            writer.close(flush=True, timeout=self.__time_out__)
+        for sock_addr, receive_thread in client_list:
+            self.__close_client__(sock_addr)
+            self.__join__(receive_thread, 'receiving {}'.format(sock_addr))
+        self.__release_all__()
 
         self.log.info('{} stopped.'.format(self.__class__.__name__))
 
@@ -0,0 +1,110 @@
+# -*- encoding: UTF-8 -*-
+import datetime
+import itertools
+import time
+import zlib
+
+from threading import Event, Lock, Thread
+
+from Socketer.Cache import WSDData, to_date
+
+
+class StubWindEngine(object):
+    """
+    Offline stand-in for WindPy.w with the same wsd call and result attributes.
+
+    Weekdays are trading days and values are deterministic for (code, field, date), so results of
+    overlapping queries agree. latency seconds (plus per_value_latency for every value) are slept
+    in every wsd call to mimic the vendor. wsq subscriptions are called back every tick_interval
+    seconds with new values from one ticker thread.
+    """
+
+    def __init__(self, latency: float = 0.0, per_value_latency: float = 0.0, seed: int = 0,
+                 tick_interval: float = 0.5):
+        self.latency = latency
+        self.per_value_latency = per_value_latency
+        self.tick_interval = tick_interval
+        self.calls = 0
+        self.__seed__ = seed
+        self.__connected__ = False
+
+        self.__request_id__ = itertools.count(1)
+        self.__subscription_dict__ = dict()
+        self.__subscription_lock__ = Lock()
+        self.__tick__ = 0
+        self.__ticker_stop__ = Event()
+        self.__ticker__ = None
+
+    def start(self, *args, **kwargs):
+        self.__connected__ = True
+
+    def stop(self):
+        self.__connected__ = False
+        self.__ticker_stop__.set()
+        if self.__ticker__ is not None:
+            self.__ticker__.join()
+            self.__ticker__ = None
+        with self.__subscription_lock__:
+            self.__subscription_dict__.clear()
+
+    def isconnected(self):
+        return self.__connected__
+
+    def __value__(self, code: str, field: str, day: datetime.date):
+        key = '{}|{}|{}|{}'.format(self.__seed__, code, field, day.toordinal()).encode('utf-8')
+        return 1 + zlib.crc32(key) % 9900 / 100.0
+
+    def wsd(self, codes: str, fields: str, start_date, end_date, options: str = ''):
+        self.calls += 1
+        start, end = to_date(start_date), to_date(end_date)
+        code_list = [var.strip().upper() for var in str(codes).split(',')]
+        field_list = [var.strip().upper() for var in str(fields).split(',')]
+        if start is None or end is None or (len(code_list) > 1 and len(field_list) > 1):
+            return WSDData(-40522005, code_list, field_list, [], [])
+
+        times = [start + datetime.timedelta(days=i) for i in range((end - start).days + 1)]
+        times = [datetime.datetime.combine(var, datetime.time()) for var in times if var.weekday() < 5]
+        if len(code_list) > 1:
+            rows = [(var, field_list[0]) for var in code_list]
+        else:
+            rows = [(code_list[0], var) for var in field_list]
+        data = [[self.__value__(code, field, t.date()) for t in times] for code, field in rows]
+
+        time.sleep(self.latency + self.per_value_latency * len(rows) * len(times))
+        return WSDData(0, code_list, field_list, times, data)
+
+    def __quote__(self, code_list: list, field_list: list):
+        """ wsq 返回值：Data 按字段、代码排列 """
+        now = datetime.datetime.now()
+        data = [[self.__value__(code, '{}#{}'.format(field, self.__tick__), now.date()) for code in code_list]
+                for field in field_list]
+        return WSDData(0, code_list, field_list, [now], data)
+
+    def __tick_loop__(self):
+        while not self.__ticker_stop__.wait(self.tick_interval):
+            self.__tick__ += 1
+            with self.__subscription_lock__:
+                subscriptions = list(self.__subscription_dict__.values())
+            for code_list, field_list, func in subscriptions:
+                func(self.__quote__(code_list, field_list))
+
+    def wsq(self, codes: str, fields: str, func=None, options: str = ''):
+        """ func 为 None 时返回当前快照，否则订阅并返回带 RequestID 的结果 """
+        code_list = [var.strip().upper() for var in str(codes).split(',')]
+        field_list = [var.strip().upper() for var in str(fields).split(',')]
+        res = self.__quote__(code_list, field_list)
+        if func is None:
+            return res
+        res.RequestID = next(self.__request_id__)
+        with self.__subscription_lock__:
+            self.__subscription_dict__[res.RequestID] = (code_list, field_list, func)
+            if self.__ticker__ is None:
+                self.__ticker_stop__.clear()
+                self.__ticker__ = Thread(target=self.__tick_loop__, name='stub wind ticker')
+                self.__ticker__.daemon = True
+                self.__ticker__.start()
+        return res
+
+    def cancelRequest(self, request_id: int):
+        with self.__subscription_lock__:
+            self.__subscription_dict__.pop(request_id, None)
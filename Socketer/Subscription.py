@@ -0,0 +1,225 @@
+# -*- encoding: UTF-8 -*-
+import time
+
+from threading import Condition, Lock, Thread
+
+from Socketer.Metrics import MetricsRegistry
+from Socketer.Serializer import TEXT
+from Socketer.utils import get_logger
+
+
+def make_keys(codes: str, fields: str):
+    """ 'A,B' x 'close,open' -> [(code, field)]，代码与字段均为大写 """
+    code_list = [var.strip().upper() for var in str(codes).split(',') if var.strip() != '']
+    field_list = [var.strip().upper() for var in str(fields).split(',') if var.strip() != '']
+    return [(code, field) for code in code_list for field in field_list]
+
+
+def pack_push(values: dict, push_time: float):
+    """ {(code, field): value} -> {"push": "wsq", "Time": ..., "Data": {code: {field: value}} """
+    data = dict()
+    for (code, field), value in values.items():
+        data.setdefault(code, dict())[field] = value
+    return TEXT.dumps({'push': 'wsq', 'Time': push_time, 'Data': data})
+
+
+class SubscriptionHub(object):
+    """
+    Fan-out of real-time (code, field) values to subscribed connections.
+
+    The first subscriber of a key starts an engine subscription with engine_subscribe(code, field),
+    which returns a handle, and the last one leaving cancels it with engine_cancel(handle). The
+    engine calls publish() with new values; the publisher thread then sends every subscriber one
+    message with the latest values of its changed keys through send(addr, msg). Subscribers with
+    the same changed keys share one serialized message.
+
+    A subscriber whose outbound backlog(addr) is over max_backlog bytes is skipped and its changed
+    keys accumulate, so once it catches up it only receives the latest value of every key.
+    """
+
+    def __init__(self, send, engine_subscribe, engine_cancel, backlog=None, max_backlog: int = 64 * 1024,
+                 retry_interval: float = 0.05, metrics: MetricsRegistry = None, log=None):
+        self.log = log if log is not None else get_logger(self.__class__.__name__)
+        self.__send__ = send
+        self.__engine_subscribe__ = engine_subscribe
+        self.__engine_cancel__ = engine_cancel
+        self.__backlog__ = backlog
+        self.__max_backlog__ = max_backlog
+        self.__retry_interval__ = retry_interval
+
+        # 订阅关系仅在 __engine_lock__ 下修改，推送状态由 __condition__ 保护
+        self.__engine_lock__ = Lock()
+        self.__condition__ = Condition()
+        self.__key_dict__ = dict()
+        self.__addr_dict__ = dict()
+        self.__handle_dict__ = dict()
+        self.__latest__ = dict()
+        self.__dirty__ = dict()
+        self.__stopped__ = True
+        self.__thread__ = None
+
+        metrics = metrics if metrics is not None else MetricsRegistry(enabled=False)
+        self.__pushes__ = metrics.counter('wind_push_messages_total', 'Pushed messages')
+        self.__serializations__ = metrics.counter('wind_push_serializations_total', 'Serialized push messages')
+        self.__conflated__ = metrics.counter('wind_push_conflated_total', 'Pushes held back for slow subscribers')
+        metrics.gauge('wind_subscribed_keys', 'Subscribed (code, field) keys', func=lambda: len(self.__key_dict__))
+
+    def subscribe(self, addr, codes: str, fields: str):
+        """ 返回 addr 订阅的 key 数，启动引擎订阅失败时抛出异常 """
+        keys = make_keys(codes, fields)
+        with self.__engine_lock__:
+            started = list()
+            try:
+                for key in keys:
+                    if key not in self.__handle_dict__:
+                        self.__handle_dict__[key] = self.__engine_subscribe__(*key)
+                        started.append(key)
+            except Exception:
+                for key in started:
+                    self.__cancel__(key)
+                raise
+            with self.__condition__:
+                addr_keys = self.__addr_dict__.setdefault(addr, set())
+                for key in keys:
+                    addr_keys.add(key)
+                    self.__key_dict__.setdefault(key, set()).add(addr)
+                # 已有最新值的 key 立即推送一次
+                known = [var for var in keys if var in self.__latest__]
+                if len(known) > 0:
+                    self.__dirty__.setdefault(addr, set()).update(known)
+                    self.__condition__.notify_all()
+                return len(addr_keys)
+
+    def unsubscribe(self, addr, codes: str = None, fields: str = None):
+        """ codes / fields 为 None 时取消 addr 的全部订阅，返回剩余的 key 数 """
+        with self.__engine_lock__:
+            with self.__condition__:
+                addr_keys = self.__addr_dict__.get(addr, set())
+                keys = set(addr_keys) if codes is None or fields is None else addr_keys & set(make_keys(codes, fields))
+                idle = list()
+                for key in keys:
+                    addr_keys.discard(key)
+                    subscribers = self.__key_dict__.get(key, set())
+                    subscribers.discard(addr)
+                    if len(subscribers) == 0:
+                        self.__key_dict__.pop(key, None)
+                        self.__latest__.pop(key, None)
+                        idle.append(key)
+                if len(addr_keys) == 0:
+                    self.__addr_dict__.pop(addr, None)
+                    self.__dirty__.pop(addr, None)
+                elif addr in self.__dirty__:
+                    self.__dirty__[addr] &= addr_keys
+            for key in idle:
+                self.__cancel__(key)
+            return len(addr_keys)
+
+    def __cancel__(self, key):
+        """ 调用前需持有 __engine_lock__ """
+        handle = self.__handle_dict__.pop(key, None)
+        if handle is None:
+            return
+        try:
+            self.__engine_cancel__(handle)
+        except Exception as e:
+            # 引擎已断开时取消失败不影响其他订阅
+            self.log.warning('cancel subscription {} failed: {}'.format(key, e))
+
+    def restore(self):
+        """ 引擎重新连接后重新启动全部引擎订阅，旧的订阅已随会话失效 """
+        with self.__engine_lock__:
+            for key in list(self.__handle_dict__.keys()):
+                try:
+                    self.__handle_dict__[key] = self.__engine_subscribe__(*key)
+                except Exception as e:
+                    self.log.warning('restore subscription {} failed: {}'.format(key, e))
+
+    def publish(self, values: dict):
+        """ 引擎回调：values 为 {(code, field): value}，未被订阅的 key 被忽略 """
+        with self.__condition__:
+            for key, value in values.items():
+                subscribers = self.__key_dict__.get(key, None)
+                if subscribers is None:
+                    continue
+                self.__latest__[key] = value
+                for addr in subscribers:
+                    self.__dirty__.setdefault(addr, set()).add(key)
+            if len(self.__dirty__) > 0:
+                self.__condition__.notify_all()
+
+    def __take__(self, retry: bool):
+        """ 取出待推送的 {addr: {key: value}}，有被搁置的订阅者时最多等待 retry_interval 秒 """
+        with self.__condition__:
+            if retry is True:
+                self.__condition__.wait(self.__retry_interval__)
+            while len(self.__dirty__) == 0 and self.__stopped__ is False:
+                self.__condition__.wait()
+            if self.__stopped__ is True:
+                return None
+            dirty, self.__dirty__ = self.__dirty__, dict()
+            return {addr: {key: self.__latest__[key] for key in keys if key in self.__latest__}
+                    for addr, keys in dirty.items()}
+
+    def __publish__(self):
+        retry = False
+        while True:
+            pending = self.__take__(retry)
+            if pending is None:
+                break
+            push_time, packed, held = time.time(), dict(), dict()
+            for addr, values in pending.items():
+                if len(values) == 0:
+                    continue
+                if self.__backlog__ is not None and self.__backlog__(addr) > self.__max_backlog__:
+                    held[addr] = set(values.keys())
+                    self.__conflated__.inc()
+                    continue
+                keys = frozenset(values.keys())
+                msg = packed.get(keys, None)
+                if msg is None:
+                    msg = packed[keys] = pack_push(values, push_time)
+                    self.__serializations__.inc()
+                self.__send__(addr, msg)
+                self.__pushes__.inc()
+
+            retry = len(held) > 0
+            if retry is True:
+                with self.__condition__:
+                    for addr, keys in held.items():
+                        if addr in self.__addr_dict__:
+                            self.__dirty__.setdefault(addr, set()).update(keys & self.__addr_dict__[addr])
+
+    def start(self):
+        with self.__condition__:
+            self.__stopped__ = False
+        self.__thread__ = Thread(target=self.__publish__, name='subscription publisher')
+        self.__thread__.daemon = True
+        self.__thread__.start()
+
+    def stop(self):
+        if self.__thread__ is None:
+            return
+        with self.__condition__:
+            self.__stopped__ = True
+            self.__condition__.notify_all()
+        self.__thread__.join()
+        self.__thread__ = None
+        with self.__engine_lock__:
+            for key in list(self.__handle_dict__.keys()):
+                self.__cancel__(key)
+            with self.__condition__:
+                self.__key_dict__.clear()
+                self.__addr_dict__.clear()
+                self.__latest__.clear()
+                self.__dirty__.clear()
+
+    def stats(self):
+        with self.__condition__:
+            return {
+                'subscribers': len(self.__addr_dict__),
+                'keys': len(self.__key_dict__),
+                'pending': len(self.__dirty__),
+                'pushes': self.__pushes__.value,
+                'serializations': self.__serializations__.value,
+                'conflated': self.__conflated__.value,
+            }
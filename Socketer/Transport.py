@@ -0,0 +1,191 @@
+# -*- encoding: UTF-8 -*-
+"""
+Transports between SocketClient and SocketServer.
+
+'tcp' binds / connects host:port. 'unix' uses the AF_UNIX socket unix_path (by default
+<tempdir>/socketer-<port>.sock) and skips the network stack for clients on the same machine.
+
+On 'unix' connections the client may ask for a shared-memory ring in its handshake:
+
+    {"compression": ["zlib"], "shm": true}
+
+and the server creates a multiprocessing.shared_memory block for the connection:
+
+    {"compression": "zlib", "shm": {"name": "psm_...", "size": 67108864}}
+
+Afterwards the server copies payloads of at least shm_threshold bytes into the ring and only sends a
+16 byte FLAG_SHM frame (position, length) over the socket. The client copies the payload out and
+advances the read position kept in the first 8 bytes of the block, which frees the space again.
+Payloads that do not fit into the free space are sent over the socket as usual.
+"""
+import json
+import os
+import socket
+import struct
+import tempfile
+
+from Socketer.Framing import FrameConstants
+
+try:
+    from multiprocessing import resource_tracker, shared_memory
+except ImportError:
+    shared_memory = None
+
+
+TRANSPORTS = ('tcp', 'unix')
+# 读位置由客户端写入，8 字节对齐
+SHM_HEADER = struct.Struct('=Q')
+SHM_DESCRIPTOR = struct.Struct('!QQ')
+# 本进程创建的块，客户端与服务器在同一进程时不应取消其登记
+__created__ = set()
+
+
+def check_transport(transport: str):
+    if transport not in TRANSPORTS:
+        raise ValueError('param transport should be in {} but got {}.'.format(TRANSPORTS, transport))
+    if transport == 'unix' and not hasattr(socket, 'AF_UNIX'):
+        raise RuntimeError('AF_UNIX is not supported on this platform.')
+
+
+def default_unix_path(port: int):
+    return os.path.join(tempfile.gettempdir(), 'socketer-{}.sock'.format(port))
+
+
+def make_socket(transport: str):
+    return socket.socket(socket.AF_UNIX if transport == 'unix' else socket.AF_INET, socket.SOCK_STREAM)
+
+
+def address(transport: str, host: str, port: int, unix_path: str = None):
+    if transport == 'unix':
+        return unix_path or default_unix_path(port)
+    return host, port
+
+
+def bind_socket(transport: str, host: str, port: int, unix_path: str = None, reuse_port: bool = False):
+    """ 返回已绑定的监听 socket，unix 路径上遗留的 socket 文件在无人监听时被删除 """
+    sock = make_socket(transport)
+    if transport == 'unix':
+        path = address(transport, host, port, unix_path)
+        if os.path.exists(path):
+            probe = make_socket(transport)
+            try:
+                probe.connect(path)
+            except OSError:
+                os.remove(path)
+            else:
+                sock.close()
+                raise OSError('unix socket {} is in use.'.format(path))
+            finally:
+                probe.close()
+        sock.bind(path)
+        return sock
+
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port is True:
+        # 多个进程绑定同一端口，由内核分配连接
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    return sock
+
+
+def unpack_shm(payload: bytes):
+    """ 握手帧中的 shm 项：客户端为 True / False，服务器为 {"name", "size"} 或 None """
+    return json.loads(payload.decode('utf-8')).get('shm', None)
+
+
+class ShmRing(object):
+    """ Server side of the ring of one connection, written by one thread only """
+
+    def __init__(self, size: int):
+        self.size = size
+        self.shm = shared_memory.SharedMemory(create=True, size=SHM_HEADER.size + size)
+        SHM_HEADER.pack_into(self.shm.buf, 0, 0)
+        self.__write_pos__ = 0
+        __created__.add(self.shm.name)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def write(self, payload: bytes):
+        """ 写入成功时返回 FLAG_SHM 帧的内容，空间不足时返回 None """
+        length = len(payload)
+        read_pos = SHM_HEADER.unpack_from(self.shm.buf, 0)[0]
+        if not self.__write_pos__ - self.size <= read_pos <= self.__write_pos__:
+            return None
+        if length > self.size - (self.__write_pos__ - read_pos):
+            return None
+        start = self.__write_pos__ % self.size
+        first = min(length, self.size - start)
+        view, buf = memoryview(payload), self.shm.buf
+        buf[SHM_HEADER.size + start:SHM_HEADER.size + start + first] = view[:first]
+        if length > first:
+            buf[SHM_HEADER.size:SHM_HEADER.size + length - first] = view[first:]
+        descriptor = SHM_DESCRIPTOR.pack(self.__write_pos__, length)
+        self.__write_pos__ += length
+        return descriptor
+
+    def close(self):
+        __created__.discard(self.shm.name)
+        self.shm.close()
+        try:
+            self.shm.unlink()
+        except FileNotFoundError:
+            pass
+
+
+class ShmReader(object):
+    """ Client side of the ring, read by the receiving thread in frame order """
+
+    def __init__(self, name: str, size: int):
+        try:
+            self.shm = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            # Python 3.13 之前打开已有的块也会被登记，进程退出时会被删除
+            self.shm = shared_memory.SharedMemory(name=name)
+            if name not in __created__:
+                resource_tracker.unregister(self.shm._name, 'shared_memory')
+        # 块的实际大小可能按页取整，以服务器告知的大小为准
+        self.size = size
+
+    def read(self, descriptor: bytes):
+        position, length = SHM_DESCRIPTOR.unpack(descriptor)
+        start = position % self.size
+        first = min(length, self.size - start)
+        buf = self.shm.buf
+        if length == first:
+            payload = bytes(buf[SHM_HEADER.size + start:SHM_HEADER.size + start + length])
+        else:
+            payload = b''.join((buf[SHM_HEADER.size + start:SHM_HEADER.size + self.size],
+                                buf[SHM_HEADER.size:SHM_HEADER.size + length - first]))
+        SHM_HEADER.pack_into(buf, 0, position + length)
+        return payload
+
+    def close(self):
+        self.shm.close()
+
+
+class ShmEncoder(object):
+    """
+    Outbound frames of a connection with a ring: payloads of at least threshold bytes go through the
+    ring, the others through compression (a FrameCompression or None) as before.
+    """
+
+    def __init__(self, ring: ShmRing, threshold: int, compression=None):
+        self.ring = ring
+        self.threshold = threshold
+        self.compression = compression
+
+    def encode(self, payload: bytes, flags: int):
+        if len(payload) >= self.threshold:
+            descriptor = self.ring.write(payload)
+            if descriptor is not None:
+                return descriptor, flags | FrameConstants.FLAG_SHM
+        if self.compression is None:
+            return payload, flags
+        return self.compression.encode(payload, flags)
+
+    def decode(self, payload: bytes, flags: int):
+        if self.compression is None:
+            return payload, flags
+        return self.compression.decode(payload, flags)
@@ -0,0 +1,111 @@
+# -*- encoding: UTF-8 -*-
+"""
+Binary columnar encoding of wsd results.
+
+    | meta length: uint32 | meta: utf-8 json | padding to 8 bytes |
+    | times: int64 days since 1970-01-01 |
+    | data: float64 row-major, rows x times |
+
+All numbers are little-endian. Results whose Data is not numeric cannot be encoded and are
+sent as json instead.
+"""
+import datetime
+import json
+import struct
+import sys
+
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+META_LENGTH = struct.Struct('<I')
+EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+NAN = float('nan')
+
+
+def __padding__(size: int):
+    return (8 - size % 8) % 8
+
+
+def __to_array__(typecode: str, values):
+    buffer = array(typecode, values)
+    if sys.byteorder == 'big':
+        buffer.byteswap()
+    return buffer
+
+
+def __numeric_row__(row: list):
+    try:
+        return __to_array__('d', row)
+    except TypeError:
+        pass
+    values = list()
+    for var in row:
+        if var is None:
+            values.append(NAN)
+        elif isinstance(var, (int, float)) and not isinstance(var, bool):
+            values.append(var)
+        else:
+            return None
+    return __to_array__('d', values)
+
+
+def encode_wsd(meta: dict, times: list, data: list):
+    """ 编码 wsd 结果，Data 非数值时返回 None """
+    rows = list()
+    for row in data:
+        encoded_row = __numeric_row__(row)
+        if encoded_row is None or len(encoded_row) != len(times):
+            return None
+        rows.append(encoded_row)
+
+    day_list = __to_array__('q', (
+        (var.date() if isinstance(var, datetime.datetime) else var).toordinal() - EPOCH_ORDINAL for var in times
+    ))
+
+    meta = dict(meta)
+    meta.update({'rows': len(rows), 'times': len(times), 'dtype': '<f8'})
+    meta_bytes = json.dumps(meta).encode('utf-8')
+    head_size = META_LENGTH.size + len(meta_bytes)
+
+    parts = [META_LENGTH.pack(len(meta_bytes)), meta_bytes, b'\x00' * __padding__(head_size), day_list.tobytes()]
+    parts.extend(var.tobytes() for var in rows)
+    return b''.join(parts)
+
+
+def decode_wsd(payload: bytes):
+    """
+    Return (meta, times, data) without copying the buffers:
+        with numpy, times is a datetime64[D] array and data a (rows, times) float64 array;
+        without numpy, times is array('q') of days since 1970-01-01 and data a flat array('d') of rows x times.
+    """
+    view = memoryview(payload)
+    meta_size, = META_LENGTH.unpack_from(view, 0)
+    meta = json.loads(bytes(view[META_LENGTH.size:META_LENGTH.size + meta_size]).decode('utf-8'))
+    offset = META_LENGTH.size + meta_size
+    offset += __padding__(offset)
+
+    n_rows, n_times = meta['rows'], meta['times']
+    data_offset = offset + 8 * n_times
+
+    if numpy is not None:
+        times = numpy.frombuffer(payload, dtype='<i8', count=n_times, offset=offset).view('datetime64[D]')
+        data = numpy.frombuffer(payload, dtype=meta['dtype'], count=n_rows * n_times, offset=data_offset)
+        return meta, times, data.reshape(n_rows, n_times)
+
+    times, data = array('q'), array('d')
+    times.frombytes(view[offset:data_offset])
+    data.frombytes(view[data_offset:data_offset + 8 * n_rows * n_times])
+    if sys.byteorder == 'big':
+        times.byteswap()
+        data.byteswap()
+    return meta, times, data
+
+
+def days_to_dates(days):
+    return [datetime.date.fromordinal(EPOCH_ORDINAL + int(var)) for var in days]
+
@@ -0,0 +1,109 @@
+# -*- encoding: UTF-8 -*-
+import time
+
+from collections import OrderedDict, deque
+from threading import Condition, Thread
+
+from Socketer.utils import get_logger
+
+
+class WorkerPool(object):
+    """
+    Thread pool with one FIFO per client served round-robin, so one client's backfill cannot
+    starve the short queries of others. The total number of waiting tasks is bounded.
+    """
+
+    def __init__(self, workers: int = 4, max_queue_size: int = 1000, name: str = 'worker'):
+        if workers < 1:
+            raise ValueError('param workers should be positive but got {}.'.format(workers))
+        self.log = get_logger(self.__class__.__name__, log_level='info')
+
+        self.__workers__ = workers
+        self.__max_queue_size__ = max_queue_size
+        self.__pool_name__ = name
+
+        self.__client_queue__ = OrderedDict()
+        self.__queue_size__ = 0
+        self.__condition__ = Condition()
+        self.__thread_list__ = list()
+        self.__work_tag__ = False
+
+        self.__busy__ = 0
+        self.__busy_time__ = 0.0
+        self.__start_time__ = None
+        self.__completed__ = 0
+        self.__rejected__ = 0
+
+    def submit(self, client_key, func, *args):
+        """ 提交任务，队列已满时返回 False """
+        with self.__condition__:
+            if self.__queue_size__ >= self.__max_queue_size__:
+                self.__rejected__ += 1
+                return False
+            if client_key not in self.__client_queue__:
+                self.__client_queue__[client_key] = deque()
+            self.__client_queue__[client_key].append((func, args))
+            self.__queue_size__ += 1
+            self.__condition__.notify()
+        return True
+
+    def __next_task__(self):
+        """ 轮询各客户端队列，调用前需持有 __condition__ """
+        client_key, task_queue = self.__client_queue__.popitem(last=False)
+        task = task_queue.popleft()
+        if len(task_queue) > 0:
+            self.__client_queue__[client_key] = task_queue
+        self.__queue_size__ -= 1
+        return task
+
+    def __work__(self):
+        while True:
+            with self.__condition__:
+                while self.__work_tag__ is True and self.__queue_size__ == 0:
+                    self.__condition__.wait()
+                if self.__queue_size__ == 0:
+                    break
+                func, args = self.__next_task__()
+                self.__busy__ += 1
+
+            start = time.perf_counter()
+            try:
+                func(*args)
+            except Exception as e:
+                self.log.exception('task {} failed: {}'.format(func, e))
+            finally:
+                with self.__condition__:
+                    self.__busy__ -= 1
+                    self.__busy_time__ += time.perf_counter() - start
+                    self.__completed__ += 1
+
+    def start(self):
+        self.__work_tag__ = True
+        self.__start_time__ = time.perf_counter()
+        for i in range(self.__workers__):
+            new_thread = Thread(target=self.__work__, name='{} {}'.format(self.__pool_name__, i))
+            new_thread.start()
+            self.__thread_list__.append(new_thread)
+
+    def stop(self, timeout: float = None):
+        """ 停止接收新任务，等待已排队任务完成 """
+        with self.__condition__:
+            self.__work_tag__ = False
+            self.__condition__.notify_all()
+        for t in self.__thread_list__:
+            t.join(timeout)
+        self.__thread_list__.clear()
+
+    def stats(self):
+        with self.__condition__:
+            elapsed = time.perf_counter() - self.__start_time__ if self.__start_time__ is not None else 0.0
+            return {
+                'workers': self.__workers__,
+                'busy': self.__busy__,
+                'queue_depth': self.__queue_size__,
+                'max_queue_size': self.__max_queue_size__,
+                'clients_waiting': len(self.__client_queue__),
+                'completed': self.__completed__,
+                'rejected': self.__rejected__,
+                'utilization': self.__busy_time__ / (elapsed * self.__workers__) if elapsed > 0 else 0.0,
+            }
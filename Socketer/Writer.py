@@ -0,0 +1,150 @@
+# -*- encoding: UTF-8 -*-
+import socket
+import time
+
+from collections import deque
+from threading import Condition, Thread, current_thread
+
+from Socketer.Framing import FrameConstants, pack_frame
+
+
+class ClientWriter(object):
+    """
+    Outbound queue and writer thread of one connection, so a slow reader only stalls itself.
+
+    put() queues a frame and never waits, so one slow connection cannot hold up the thread routing
+    replies to all of them; the writer thread takes every queued frame (up to coalesce_bytes) and
+    writes small frames with one sendall. When max_queue_size frames are waiting, policy decides:
+    'block' keeps queueing, 'drop' discards the frame and 'disconnect' closes the connection. A
+    connection still full block_timeout seconds after it filled up under 'block' is closed as
+    with 'disconnect'.
+    on_close(addr) is called from the writer thread after a send failure or a close_after frame and
+    on_sent(frames, bytes, writes) after every batch. Frames other than FLAG_CONTROL are compressed
+    with compression (a FrameCompression) once it is set.
+    """
+    POLICIES = ('block', 'drop', 'disconnect')
+
+    def __init__(self, sock: socket.socket, addr, on_close, max_queue_size: int = 1000, policy: str = 'block',
+                 coalesce_bytes: int = 256 * 1024, block_timeout: float = 5.0, on_sent=None):
+        if policy not in self.POLICIES:
+            raise ValueError('param policy should be in {} but got {}.'.format(self.POLICIES, policy))
+        self.addr = addr
+        self.compression = None
+        self.dropped = 0
+        self.writes = 0
+        self.queued_bytes = 0
+
+        self.__socket__ = sock
+        self.__on_close__ = on_close
+        self.__on_sent__ = on_sent
+        self.__max_queue_size__ = max_queue_size
+        self.__policy__ = policy
+        self.__coalesce_bytes__ = coalesce_bytes
+        self.__block_timeout__ = block_timeout
+
+        self.__queue__ = deque()
+        self.__full_since__ = None
+        self.__condition__ = Condition()
+        self.__closed__ = False
+        self.__flush__ = True
+        self.__thread__ = Thread(target=self.__write__, name='socket writer {}'.format(addr))
+        self.__thread__.daemon = True
+
+    def start(self):
+        self.__thread__.start()
+
+    def qsize(self):
+        return len(self.__queue__)
+
+    def is_closed(self):
+        return self.__closed__
+
+    def put(self, payload: bytes, flags: int = FrameConstants.FLAG_TEXT, close_after: bool = False):
+        """ 返回 False 表示帧未进入队列：连接已关闭、被丢弃，或连接因队列已满需关闭 """
+        with self.__condition__:
+            if self.__closed__ is True:
+                return False
+            if len(self.__queue__) >= self.__max_queue_size__:
+                if self.__policy__ == 'drop':
+                    self.dropped += 1
+                    return False
+                if self.__full_since__ is None:
+                    self.__full_since__ = time.monotonic()
+                if self.__policy__ == 'disconnect' or time.monotonic() - self.__full_since__ > self.__block_timeout__:
+                    self.__closed__, self.__flush__ = True, False
+                    self.__condition__.notify_all()
+                    return False
+            self.__queue__.append((payload, flags, close_after))
+            self.queued_bytes += len(payload)
+            self.__condition__.notify_all()
+        return True
+
+    def __take__(self):
+        """ 取出待发送的帧，总长不超过 coalesce_bytes（至少一帧），队列为空且已关闭时返回 None """
+        with self.__condition__:
+            while len(self.__queue__) == 0 and self.__closed__ is False:
+                self.__condition__.wait()
+            if len(self.__queue__) == 0 or self.__flush__ is False:
+                return None
+            batch, size = list(), 0
+            while len(self.__queue__) > 0 and (len(batch) == 0 or size < self.__coalesce_bytes__):
+                item = self.__queue__.popleft()
+                batch.append(item)
+                size += len(item[0])
+            self.queued_bytes -= size
+            if len(self.__queue__) < self.__max_queue_size__:
+                self.__full_since__ = None
+        return batch
+
+    def __send__(self, batch: list):
+        """ 返回写出的字节数与写操作次数 """
+        small, sent, writes = list(), 0, 0
+        for payload, flags, close_after in batch:
+            if self.compression is not None and not flags & FrameConstants.FLAG_CONTROL:
+                payload, flags = self.compression.encode(payload, flags)
+            sent += len(payload) + FrameConstants.FRAME_HEADER_SIZE
+            if len(payload) > FrameConstants.COPY_THRESHOLD:
+                if len(small) > 0:
+                    self.__socket__.sendall(b''.join(small))
+                    small.clear()
+                    writes += 1
+                # 大帧不复制，头部与数据分别写出
+                self.__socket__.sendall(FrameConstants.FRAME_HEADER.pack(flags, len(payload)))
+                self.__socket__.sendall(payload)
+                writes += 1
+            else:
+                small.append(pack_frame(payload, flags))
+        if len(small) > 0:
+            self.__socket__.sendall(b''.join(small))
+            writes += 1
+        self.writes += writes
+        return sent, writes
+
+    def __write__(self):
+        while True:
+            batch = self.__take__()
+            if batch is None:
+                break
+            try:
+                sent, writes = self.__send__(batch)
+            except OSError:
+                self.close(flush=False)
+                self.__on_close__(self.addr)
+                break
+            if self.__on_sent__ is not None:
+                self.__on_sent__(len(batch), sent, writes)
+            if any(var[2] for var in batch):
+                self.close(flush=False)
+                self.__on_close__(self.addr)
+                break
+
+    def close(self, flush: bool = True, timeout: float = None):
+        """ flush 为 True 时发送完已排队的帧再退出；由其他线程调用时等待写线程结束 """
+        with self.__condition__:
+            if self.__closed__ is False:
+                self.__closed__, self.__flush__ = True, flush
+            elif flush is False:
+                self.__flush__ = False
+            self.__condition__.notify_all()
+        if self.__thread__.ident is not None and current_thread() is not self.__thread__:
+            self.__thread__.join(timeout)
@@ -8,6 +8,10 @@ __version__ = '0.0.1'
 from Socketer.cmd import cli, socketer
 
 from Socketer.Client import SocketClient
+from Socketer.ClientPool import SocketClientPool
 from Socketer.Server import SocketServer, SocketMessage
+from Socketer.AsyncServer import AsyncSocketServer
+from Socketer.Reactor import ReactorSocketServer
+from Socketer.Prefork import PreforkServer
 
-from Socketer.ApplyWind import WindClient, WindServer, WSDRes
+from Socketer.ApplyWind import WindClient, WindServer, AsyncWindServer, ReactorWindServer, WSDRes
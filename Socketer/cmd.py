@@ -4,7 +4,10 @@ Socketer:
     Proudly presented by JM.
 
 Usage:
-    sockter -w | --wind
+    sockter (-w | --wind) [--workers=<n>] [--cache-dir=<dir>] [--transport=<t>]
+    sockter bench [--server=<engine>] [--mode=<mode>] [--clients=<n>] [--requests=<n>] [--size=<bytes>]
+                  [--rate=<n>] [--port=<port>] [--codes=<n>] [--days=<n>] [--latency=<seconds>] [--compress]
+                  [--transport=<t>]
     sockter -h | --help
     sockter -v | --version
 
@@ -12,9 +15,25 @@ Tips:
     Please hit Ctrl-C to exit.
 
 Options:
-    -w --wind        Start Wind Server
-    -h --help        Show this help message and exit.
-    -v --version     Show version.
+    -w --wind            Start Wind Server
+    --workers=<n>        Wind Server worker processes sharing the tcp port, 0 for one process [default: 0]
+    --cache-dir=<dir>    Directory of the persistent wsd cache
+    --transport=<t>      tcp, or unix for clients on the same machine [default: tcp]
+    -h --help            Show this help message and exit.
+    -v --version         Show version.
+
+Benchmark options:
+    --server=<engine>    Server engine, threaded, async or reactor [default: threaded]
+    --mode=<mode>        echo: echo messages, wind: wsd calls against a stub Wind engine [default: echo]
+    --clients=<n>        Concurrent clients [default: 10]
+    --requests=<n>       Requests per client [default: 1000]
+    --size=<bytes>       Echo message size [default: 256]
+    --rate=<n>           Requests per second per client, 0 for unlimited [default: 0]
+    --port=<port>        Port of the local benchmark server [default: 14140]
+    --codes=<n>          Codes per wsd call in wind mode [default: 50]
+    --days=<n>           Calendar days per wsd call in wind mode [default: 250]
+    --latency=<seconds>  Stub engine latency per wsd call [default: 0]
+    --compress           Negotiate frame compression in wind mode
 """
 import time
 
@@ -28,9 +47,18 @@ class socketer():
 
     def get_command(self):
         """ 处理命令行参数 """
-        if '-w' in self.__args__ or '--wind' in self.__args__:
+        if self.__args__.get('--wind') is True:
             from Socketer.ApplyWind import WindServer
-            wind_server = WindServer()
+            workers = int(self.__args__.get('--workers') or 0)
+            cache_dir = self.__args__.get('--cache-dir')
+            transport = self.__args__.get('--transport') or 'tcp'
+            if workers > 0 and transport != 'tcp':
+                exit('--workers needs --transport=tcp, worker processes cannot share a unix socket.')
+            if workers > 0:
+                from Socketer.Prefork import PreforkServer
+                wind_server = PreforkServer(WindServer, workers=workers, cache_dir=cache_dir, transport=transport)
+            else:
+                wind_server = WindServer(cache_dir=cache_dir, transport=transport)
             try:
                 wind_server.start()
                 while wind_server.is_alive():
@@ -41,6 +69,17 @@ class socketer():
                 exit(0)
             else:
                 exit(0)
+        elif self.__args__.get('bench') is True:
+            from Socketer.Benchmark import run_load, format_report
+            args = self.__args__
+            result = run_load(
+                server=args['--server'], mode=args['--mode'],
+                n_clients=int(args['--clients']), n_requests=int(args['--requests']),
+                msg_size=int(args['--size']), rate=float(args['--rate']), port=int(args['--port']),
+                n_codes=int(args['--codes']), n_days=int(args['--days']), engine_latency=float(args['--latency']),
+                compression=args['--compress'] is True, transport=args['--transport'],
+            )
+            print(format_report('{} {}'.format(args['--server'], args['--mode']), result))
         else:
             pass
 
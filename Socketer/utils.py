@@ -1,6 +1,12 @@
 # -*- encoding: UTF-8 -*-
+import atexit
+import itertools
 import logging
 
+from logging.handlers import QueueHandler, QueueListener
+from queue import Full, Queue
+from threading import Lock
+
 
 class SocketConstants:
     CLIENT_EXIT_MSG = 'ClientSocketExit'
@@ -14,8 +20,85 @@ __log_leval_map__ = {
     'critical': logging.CRITICAL,
 }
 
+DEFAULT_LOG_LEVEL = 'info'
+# 异步日志队列的长度，队列满时丢弃 WARNING 以下的记录而不阻塞调用线程
+LOG_QUEUE_SIZE = 10000
+
+
+class __AsyncLog__(object):
+    """ 进程内全部异步 logger 共用一个队列及写出线程 """
+    queue = Queue(maxsize=LOG_QUEUE_SIZE)
+    listener = None
+    lock = Lock()
+    dropped = 0
+
+
+class AsyncHandler(QueueHandler):
+    """
+    Hands records to the shared log thread, which formats them and calls handlers. Records are
+    not formatted in the calling thread, so arguments are formatted as they are when written.
+    """
+
+    def __init__(self, handlers: list):
+        super(AsyncHandler, self).__init__(__AsyncLog__.queue)
+        self.handlers = handlers
+
+    def prepare(self, record):
+        record.socketer_handlers = self.handlers
+        return record
+
+    def enqueue(self, record):
+        if __AsyncLog__.listener is None:
+            # 写出线程已停止（如进程退出时）则同步写出
+            __Dispatcher__().handle(record)
+            return
+        if record.levelno >= logging.WARNING:
+            self.queue.put(record)
+            return
+        try:
+            self.queue.put_nowait(record)
+        except Full:
+            __AsyncLog__.dropped += 1
+
+
+class __Dispatcher__(logging.Handler):
+    """ 写出线程中将记录交给其 logger 的 handlers """
+
+    def handle(self, record):
+        for handler in record.socketer_handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+        return True
+
+
+def __start_log_thread__():
+    with __AsyncLog__.lock:
+        if __AsyncLog__.listener is not None:
+            return
+        __AsyncLog__.listener = QueueListener(__AsyncLog__.queue, __Dispatcher__())
+        __AsyncLog__.listener.start()
+
+
+def flush_logs():
+    """ 写出队列中的全部记录并停止写出线程，此后异步 logger 同步写出，直至再次调用 get_logger """
+    with __AsyncLog__.lock:
+        listener, __AsyncLog__.listener = __AsyncLog__.listener, None
+    if listener is not None:
+        listener.stop()
 
-def get_logger(module_name: str, log_path: str = None, log_level=logging.DEBUG):
+
+atexit.register(flush_logs)
+
+
+def log_stats():
+    return {
+        'queued': __AsyncLog__.queue.qsize(),
+        'dropped': __AsyncLog__.dropped,
+    }
+
+
+def get_logger(module_name: str, log_path: str = None, log_level=DEFAULT_LOG_LEVEL, log_async: bool = True):
+    """ log_async 为 True 时由共用的写出线程格式化并写出，调用线程不等待终端及磁盘 """
     if isinstance(log_level, int):
         log_level = log_level
     elif isinstance(log_level, str):
@@ -31,11 +114,12 @@ def get_logger(module_name: str, log_path: str = None, log_level=logging.DEBUG):
         ))
 
     logger = logging.Logger(module_name, log_level)
+    handlers = list()
 
     screen_handler = logging.StreamHandler()
     screen_handler.setFormatter(logging.Formatter('%(asctime)s %(module)s %(levelname)s: %(message)s'))
     screen_handler.setLevel(log_level)
-    logger.addHandler(screen_handler)
+    handlers.append(screen_handler)
 
     if log_path is not None:
         import os
@@ -51,6 +135,50 @@ def get_logger(module_name: str, log_path: str = None, log_level=logging.DEBUG):
             '%(asctime)s %(filename)s %(funcName)s %(lineno)d:  %(levelname)s, %(message)s'
         ))
         file_handler.setLevel(log_level)
-        logger.addHandler(file_handler)
+        handlers.append(file_handler)
+
+    if log_async is True:
+        __start_log_thread__()
+        logger.addHandler(AsyncHandler(handlers))
+    else:
+        for handler in handlers:
+            logger.addHandler(handler)
 
     return logger
+
+
+class Truncated(object):
+    """ 日志中的消息内容，只保留前 limit 个字符 / 字节，不持有完整消息 """
+    __slots__ = ('head', 'size')
+
+    def __init__(self, payload, limit: int = 256):
+        self.head = payload[:limit]
+        self.size = len(payload)
+
+    def __str__(self):
+        text = self.head if isinstance(self.head, str) else repr(bytes(self.head))
+        if self.size <= len(self.head):
+            return text
+        return '{}... ({} in total)'.format(text, self.size)
+
+
+class MessageLog(object):
+    """
+    Per-message debug log of a hot loop: only every sample-th message is logged, with its payload
+    cut to limit characters, and nothing is done unless DEBUG is enabled.
+    """
+
+    def __init__(self, log, sample: int = 1, limit: int = 256):
+        if sample < 1:
+            raise ValueError('param sample should be at least 1 but got {}.'.format(sample))
+        self.log = log
+        self.sample = sample
+        self.limit = limit
+        self.__counter__ = itertools.count()
+
+    def debug(self, msg: str, addr, payload):
+        if not self.log.isEnabledFor(logging.DEBUG):
+            return
+        if self.sample > 1 and next(self.__counter__) % self.sample != 0:
+            return
+        self.log.debug(msg, addr, Truncated(payload, self.limit))
@@ -0,0 +1,22 @@
+# -*- encoding: UTF-8 -*-
+import socket
+
+import pytest
+
+
+@pytest.fixture
+def free_port():
+    """ 系统分配的空闲端口 """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(('', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+@pytest.fixture
+def sock_pair():
+    left, right = socket.socketpair()
+    yield left, right
+    left.close()
+    right.close()
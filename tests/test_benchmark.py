@@ -0,0 +1,46 @@
+# -*- encoding: UTF-8 -*-
+import datetime
+import math
+
+import pytest
+
+from Socketer.Benchmark import compare_servers, percentile, run_load
+from Socketer.StubWind import StubWindEngine
+
+
+def test_stub_engine_deterministic_weekdays():
+    first = StubWindEngine().wsd('000001.SZ', 'close,open', '20200101', '20200112')
+    second = StubWindEngine().wsd('000001.SZ', 'close,open', datetime.date(2020, 1, 6), datetime.date(2020, 1, 8))
+    assert first.ErrorCode == 0
+    assert all(var.weekday() < 5 for var in first.Times)
+    assert len(first.Times) == 8
+    # 重叠区间的结果一致
+    assert second.Data == [row[3:6] for row in first.Data]
+
+
+def test_stub_engine_rejects_many_codes_and_fields():
+    assert StubWindEngine().wsd('000001.SZ,000002.SZ', 'close,open', '20200101', '20200112').ErrorCode != 0
+
+
+def test_percentile():
+    values = list(range(1, 101))
+    assert percentile(values, 50) in (50, 51)
+    assert percentile(values, 100) == 100
+    assert math.isnan(percentile([], 50))
+
+
+@pytest.mark.parametrize('server', ['threaded', 'async', 'reactor'])
+@pytest.mark.parametrize('mode', ['echo', 'wind'])
+def test_run_load_smoke(server, mode, free_port):
+    result = run_load(server, mode, n_clients=2, n_requests=5, port=free_port, n_codes=3, n_days=10)
+    assert result['msgs/s'] > 0
+    assert result['p50 ms'] <= result['p99 ms']
+
+
+def test_compare_servers_small_load():
+    report = compare_servers(port=0, n_connections=5, n_clients=2, n_requests=5, msg_size=16)
+    assert list(report) == ['EchoSocketServer', 'EchoAsyncSocketServer', 'EchoReactorSocketServer']
+    for result in report.values():
+        assert result['connections/s'] > 0
+        assert result['requests/s'] > 0
+        assert result['p50 ms'] <= result['p99 ms']
@@ -0,0 +1,133 @@
+# -*- encoding: UTF-8 -*-
+import datetime
+
+from Socketer.Cache import WSD_NO_DATA, WSDCache, WSDData, is_daily
+from Socketer.StubWind import StubWindEngine
+
+
+def day(d: int):
+    # 2020-01-06 为周一
+    return datetime.date(2020, 1, d)
+
+
+class Engine(StubWindEngine):
+    """ 记录每次调用的区间，没有交易日时如 Wind 返回 WSD_NO_DATA """
+
+    def __init__(self):
+        super(Engine, self).__init__()
+        self.segments = list()
+
+    def wsd(self, codes, fields, start_date, end_date, options=''):
+        self.segments.append((start_date, end_date))
+        res = super(Engine, self).wsd(codes, fields, start_date, end_date, options)
+        if res.ErrorCode == 0 and len(res.Times) == 0:
+            return WSDData(WSD_NO_DATA, res.Codes, res.Fields, [], [])
+        return res
+
+
+def dates(res):
+    return [var.date() if isinstance(var, datetime.datetime) else var for var in res.Times]
+
+
+def test_full_hit_after_miss():
+    cache, engine = WSDCache(), Engine()
+    first = cache.query(engine.wsd, '000001.SZ', 'close', day(6), day(10))
+    second = cache.query(engine.wsd, '000001.SZ', 'close', day(7), day(9))
+    assert engine.segments == [(day(6), day(10))]
+    assert dates(second) == [day(7), day(8), day(9)]
+    assert second.Data == [first.Data[0][1:4]]
+    assert cache.stats()['hits'] == 1
+
+
+def test_only_missing_segments_fetched():
+    cache, engine = WSDCache(), Engine()
+    cache.query(engine.wsd, '000001.SZ,000002.SZ', 'close', day(8), day(9))
+    cache.query(engine.wsd, '000001.SZ,000002.SZ', 'close', day(14), day(15))
+    res = cache.query(engine.wsd, '000001.SZ,000002.SZ', 'close', day(6), day(17))
+    assert engine.segments[2:] == [(day(6), day(7)), (day(10), day(13)), (day(16), day(17))]
+    direct = engine.wsd('000001.SZ,000002.SZ', 'close', day(6), day(17))
+    assert dates(res) == dates(direct)
+    assert res.Data == direct.Data
+    assert cache.stats()['misses'] == 1
+    assert cache.stats()['partial_hits'] == 2
+
+
+def test_merged_coverage_is_a_hit():
+    cache, engine = WSDCache(), Engine()
+    cache.query(engine.wsd, '000001.SZ', 'close', day(6), day(8))
+    cache.query(engine.wsd, '000001.SZ', 'close', day(9), day(10))
+    cache.query(engine.wsd, '000001.SZ', 'close', day(6), day(10))
+    assert len(engine.segments) == 2
+
+
+def test_no_data_segment_keeps_cached_part():
+    cache, engine = WSDCache(), Engine()
+    cached = cache.query(engine.wsd, '000001.SZ', 'close', day(6), day(10))
+    # 1 月 4、5 日为周末
+    res = cache.query(engine.wsd, '000001.SZ', 'close', day(4), day(10))
+    assert res.ErrorCode == 0
+    assert res.Data == cached.Data
+    assert cache.query(engine.wsd, '000001.SZ', 'close', day(4), day(10)).Data == cached.Data
+    assert len(engine.segments) == 2
+
+
+def test_no_data_without_cache_returns_engine_answer():
+    cache, engine = WSDCache(), Engine()
+    assert cache.query(engine.wsd, '000001.SZ', 'close', day(4), day(5)).ErrorCode == WSD_NO_DATA
+
+
+def test_error_segment_returned():
+    cache, engine = WSDCache(), Engine()
+    cache.query(engine.wsd, '000001.SZ,000002.SZ', 'close', day(6), day(8))
+    # 多代码多字段为引擎的参数错误
+    assert cache.query(engine.wsd, '000001.SZ,000002.SZ', 'close,open', day(6), day(8)).ErrorCode != 0
+
+
+def test_non_daily_options_bypass_cache():
+    cache, engine = WSDCache(), Engine()
+    for options in ('Period=W', 'Days=Alldays;Fill=Previous'):
+        cache.query(engine.wsd, '000001.SZ', 'close', day(6), day(10), options)
+        cache.query(engine.wsd, '000001.SZ', 'close', day(6), day(10), options)
+    assert len(engine.segments) == 4
+    assert cache.stats()['entries'] == 0
+
+
+def test_is_daily():
+    assert is_daily('') is True
+    assert is_daily(None) is True
+    assert is_daily('Period=D;PriceAdj=F') is True
+    assert is_daily('period=m') is False
+    assert is_daily('PriceAdj=F; Days=Weekdays') is False
+
+
+def test_eviction_and_ttl():
+    cache, engine = WSDCache(max_entries=1), Engine()
+    cache.query(engine.wsd, '000001.SZ', 'close', day(6), day(10))
+    cache.query(engine.wsd, '000002.SZ', 'close', day(6), day(10))
+    assert cache.stats()['entries'] == 1
+    assert cache.stats()['evictions'] == 1
+
+    cache, engine = WSDCache(ttl=0), Engine()
+    cache.query(engine.wsd, '000001.SZ', 'close', day(6), day(10))
+    cache.query(engine.wsd, '000001.SZ', 'close', day(6), day(10))
+    assert len(engine.segments) == 2
+
+
+def test_volatile_days_refetched():
+    today = datetime.date.today()
+    start = today - datetime.timedelta(days=10)
+    cache, engine = WSDCache(), Engine()
+    first = cache.query(engine.wsd, '000001.SZ', 'close', start, today)
+    second = cache.query(engine.wsd, '000001.SZ', 'close', start, today)
+    assert engine.segments == [(start, today), (today, today)]
+    assert second.Data == first.Data
+    assert dates(second) == dates(first)
+
+    # 历史区间仍然命中缓存
+    cache.query(engine.wsd, '000001.SZ', 'close', start, today - datetime.timedelta(days=1))
+    assert len(engine.segments) == 2
+
+    cache, engine = WSDCache(volatile_days=0), Engine()
+    cache.query(engine.wsd, '000001.SZ', 'close', start, today)
+    cache.query(engine.wsd, '000001.SZ', 'close', start, today)
+    assert len(engine.segments) == 1
@@ -0,0 +1,168 @@
+# -*- encoding: UTF-8 -*-
+import socket
+import time
+
+from queue import Queue
+
+import pytest
+
+from Socketer.AsyncServer import AsyncSocketServer
+from Socketer.Client import SocketClient
+from Socketer.Framing import FrameConstants, pack_frame
+from Socketer.Reactor import ReactorSocketServer
+from Socketer.Server import SocketServer, SocketMessage
+from Socketer.Transport import shared_memory
+
+
+STOP_LATENCY_BOUND = 0.5
+
+
+@pytest.fixture(params=[SocketServer, AsyncSocketServer, ReactorSocketServer])
+def server(request, free_port):
+    server = request.param(port=free_port, log_level='error')
+    server.start()
+    yield server
+    server.stop()
+
+
+def connect(server: SocketServer, **kwargs):
+    client = SocketClient(socket.gethostname(), port=server.socket.getsockname()[1], log_level='error', **kwargs)
+    client.start()
+    return client
+
+
+def echo(server: SocketServer, client: SocketClient, msg):
+    client.msg_out.put(msg)
+    received = server.msg_in.get(timeout=5)
+    server.msg_out.put(SocketMessage(received.addr, received.msg))
+    return client.msg_in.get(timeout=5)
+
+
+def test_text_and_binary_messages(server):
+    client = connect(server)
+    try:
+        assert echo(server, client, 'text message') == 'text message'
+        assert echo(server, client, b'\x00binary\xff') == b'\x00binary\xff'
+        assert echo(server, client, 'x' * (1024 * 1024)) == 'x' * (1024 * 1024)
+    finally:
+        client.stop()
+
+
+def test_stop_refuses_connections(server):
+    port = server.socket.getsockname()[1]
+    client = connect(server)
+    echo(server, client, 'before stop')
+    client.stop()
+    server.stop()
+    # 停止后不再监听
+    with pytest.raises(OSError):
+        socket.create_connection((socket.gethostname(), port), timeout=1).close()
+
+
+def test_stop_latency(server):
+    client = connect(server)
+    echo(server, client, 'before stop')
+    start = time.perf_counter()
+    client.stop()
+    server.stop()
+    assert time.perf_counter() - start < STOP_LATENCY_BOUND
+    assert client.is_alive() is False
+
+
+def test_stop_latency_idle(server):
+    # 没有收发过消息的连接同样立即停止
+    client = connect(server)
+    start = time.perf_counter()
+    client.stop()
+    server.stop()
+    assert time.perf_counter() - start < STOP_LATENCY_BOUND
+
+
+class SlowHookServer(AsyncSocketServer):
+    def __init__(self, **kwargs):
+        super(SlowHookServer, self).__init__(**kwargs)
+        self.exited = list()
+
+    def on_new_client(self, sock_addr: str):
+        time.sleep(0.2)
+
+    def on_client_exit(self, sock_addr: str):
+        self.exited.append(sock_addr)
+
+
+def test_async_stop_finishes_connection_handlers(free_port):
+    server = SlowHookServer(port=free_port, log_level='error')
+    server.start()
+    sock = socket.create_connection((socket.gethostname(), free_port))
+    try:
+        time.sleep(0.05)
+        # 停止时连接仍在 on_new_client 中，其 on_client_exit 仍会执行
+        server.stop()
+        assert len(server.exited) == 1
+    finally:
+        sock.close()
+
+
+class ExitRecorder(ReactorSocketServer):
+    def __init__(self, **kwargs):
+        super(ExitRecorder, self).__init__(**kwargs)
+        self.exited = Queue()
+
+    def on_client_exit(self, sock_addr: str):
+        self.exited.put(sock_addr)
+
+
+def test_reactor_closes_clients_in_loop(free_port):
+    # 连接由 reactor 线程直接关闭，不再经 server_task 队列
+    server = ExitRecorder(port=free_port, log_level='error')
+    server.start()
+    try:
+        assert hasattr(server, 'server_task') is False
+        client = connect(server)
+        echo(server, client, 'before exit')
+        client.stop()
+        server.exited.get(timeout=5)
+        # 未发送退出消息直接断开的连接同样关闭
+        sock = socket.create_connection((socket.gethostname(), free_port))
+        sock.close()
+        server.exited.get(timeout=5)
+        assert server.stats()['connections'] == 0
+    finally:
+        server.stop()
+
+
+def test_unexpected_shm_frame_closes_connection(free_port):
+    listener = socket.create_server(('', free_port))
+    client = SocketClient(socket.gethostname(), port=free_port, log_level='critical', compression=False, shm=False)
+    client.start()
+    conn, _ = listener.accept()
+    try:
+        conn.sendall(pack_frame(b'\x00' * 16, FrameConstants.FLAG_SHM))
+        conn.settimeout(5)
+        # 客户端关闭连接，不把描述符当作消息
+        assert conn.recv(1024) == b''
+        assert client.msg_in.empty()
+    finally:
+        client.stop()
+        conn.close()
+        listener.close()
+
+
+@pytest.mark.skipif(not hasattr(socket, 'AF_UNIX') or shared_memory is None, reason='AF_UNIX not supported')
+@pytest.mark.parametrize('server_class', [SocketServer, AsyncSocketServer, ReactorSocketServer])
+def test_unix_transport_with_shared_memory(server_class, free_port, tmp_path):
+    unix_path = str(tmp_path / 'socketer.sock')
+    server = server_class(port=free_port, transport='unix', unix_path=unix_path, shm_size=1024 * 1024,
+                          shm_threshold=1024, log_level='error')
+    server.start()
+    client = SocketClient(socket.gethostname(), port=free_port, transport='unix', unix_path=unix_path,
+                          log_level='error')
+    client.start()
+    try:
+        assert client.shm is not None
+        # 大于环形区空闲空间的回复经 socket 发送
+        for msg in ('small', b'\x01' * 4096, 'y' * (512 * 1024), b'\x02' * (4 * 1024 * 1024)):
+            assert echo(server, client, msg) == msg
+    finally:
+        client.stop()
+        server.stop()
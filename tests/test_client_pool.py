@@ -0,0 +1,72 @@
+# -*- encoding: UTF-8 -*-
+import pytest
+
+from Socketer.ClientPool import SocketClientPool
+
+
+class FakeClient(object):
+    def __init__(self, name: str = 'fake'):
+        self.name = name
+        self.alive = False
+
+    def start(self):
+        self.alive = True
+
+    def stop(self):
+        self.alive = False
+
+    def is_alive(self):
+        return self.alive
+
+
+@pytest.fixture
+def pool():
+    pool = SocketClientPool(FakeClient, min_size=1, max_size=2, check_interval=60)
+    pool.start()
+    yield pool
+    pool.close()
+
+
+def test_idle_client_reused(pool):
+    with pool.borrow() as first:
+        pass
+    with pool.borrow() as second:
+        assert second is first
+    assert pool.stats()['created'] == 1
+
+
+def test_max_size_bounds_clients(pool):
+    first, second = pool.acquire(), pool.acquire()
+    with pytest.raises(TimeoutError):
+        pool.acquire(timeout=0.05)
+    pool.release(first)
+    assert pool.acquire(timeout=0.05) is first
+    pool.release(first)
+    pool.release(second)
+    assert pool.stats() == dict(pool.stats(), size=2, idle=2, in_use=0)
+
+
+def test_broken_client_closed(pool):
+    with pytest.raises(ConnectionError):
+        with pool.borrow() as client:
+            raise ConnectionError('reset')
+    assert client.alive is False
+    assert pool.stats()['size'] == 0
+
+
+def test_unhealthy_client_replaced(pool):
+    with pool.borrow() as client:
+        pass
+    client.alive = False
+    with pool.borrow() as replacement:
+        assert replacement is not client and replacement.alive is True
+    assert pool.stats()['replaced'] == 1
+
+
+def test_close_stops_idle_clients(pool):
+    with pool.borrow() as client:
+        pass
+    pool.close()
+    assert client.alive is False
+    with pytest.raises(RuntimeError):
+        pool.acquire()
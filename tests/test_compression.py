@@ -0,0 +1,51 @@
+# -*- encoding: UTF-8 -*-
+import zlib
+
+import pytest
+
+from Socketer.Compression import CODECS, FrameCompression, negotiate, offer, pack_hello, unpack_hello
+from Socketer.Framing import FrameConstants, FrameError
+
+
+@pytest.fixture(params=list(CODECS.keys()))
+def codec(request):
+    return request.param
+
+
+def test_round_trip(codec):
+    sender, receiver = FrameCompression(codec, threshold=16), FrameCompression(codec, threshold=16)
+    for payload in (b'short', b'quote,' * 1000, bytes(range(256)) * 64, b'quote,' * 1000):
+        wire, flags = sender.encode(payload, FrameConstants.FLAG_BINARY)
+        if len(payload) < 16:
+            assert flags == FrameConstants.FLAG_BINARY
+        else:
+            assert flags & FrameConstants.FLAG_COMPRESSED
+        assert receiver.decode(wire, flags) == (payload, FrameConstants.FLAG_BINARY)
+
+
+def test_decompressed_size_limit(codec):
+    sender = FrameCompression(codec, threshold=0)
+    receiver = FrameCompression(codec, threshold=0, max_frame_size=1024)
+    wire, flags = sender.encode(b'\x00' * 1024, FrameConstants.FLAG_TEXT)
+    assert receiver.decode(wire, flags)[0] == b'\x00' * 1024
+
+    wire, flags = sender.encode(b'\x00' * (1024 * 1024), FrameConstants.FLAG_TEXT)
+    assert len(wire) < 16 * 1024
+    with pytest.raises(FrameError):
+        receiver.decode(wire, flags)
+
+
+def test_zlib_bomb_rejected():
+    receiver = FrameCompression('zlib', max_frame_size=64 * 1024)
+    compressor = zlib.compressobj()
+    bomb = compressor.compress(b'\x00' * (64 * 1024 * 1024)) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    with pytest.raises(FrameError):
+        receiver.decode(bomb, FrameConstants.FLAG_COMPRESSED)
+
+
+def test_negotiation():
+    assert offer(False) == list()
+    assert offer(['zlib', 'brotli']) == ['zlib']
+    assert negotiate(['lz4', 'zlib'], ['zlib']) == 'zlib'
+    assert negotiate(['brotli'], offer(True)) is None
+    assert unpack_hello(pack_hello(['zlib'])) == ['zlib']
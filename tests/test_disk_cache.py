@@ -0,0 +1,141 @@
+# -*- encoding: UTF-8 -*-
+import datetime
+import time
+
+from threading import Event, Thread
+
+import pytest
+
+from Socketer.Cache import WSD_NO_DATA, WSDData
+from Socketer.DiskCache import DiskSeries, WSDDiskCache
+from Socketer.StubWind import StubWindEngine
+
+
+def day(d: int):
+    # 2020-01-06 为周一
+    return datetime.date(2020, 1, d)
+
+
+def dates(res):
+    return [var.date() if isinstance(var, datetime.datetime) else var for var in res.Times]
+
+
+class Engine(StubWindEngine):
+    """ 记录每次调用的区间，没有交易日时如 Wind 返回 WSD_NO_DATA """
+
+    def __init__(self):
+        super(Engine, self).__init__()
+        self.segments = list()
+
+    def wsd(self, codes, fields, start_date, end_date, options=''):
+        self.segments.append((start_date, end_date))
+        res = super(Engine, self).wsd(codes, fields, start_date, end_date, options)
+        if res.ErrorCode == 0 and len(res.Times) == 0:
+            return WSDData(WSD_NO_DATA, res.Codes, res.Fields, [], [])
+        return res
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = WSDDiskCache(str(tmp_path))
+    yield cache
+    cache.close()
+
+
+def test_append_rewrite_and_hit(cache):
+    engine = Engine()
+    cache.query(engine.wsd, '000001.SZ', 'close', day(8), day(9))
+    cache.query(engine.wsd, '000001.SZ', 'close', day(13), day(14))
+    res = cache.query(engine.wsd, '000001.SZ', 'close', day(6), day(15))
+    direct = engine.wsd('000001.SZ', 'close', day(6), day(15))
+    assert dates(res) == dates(direct)
+    assert res.Data == direct.Data
+    assert engine.segments[2:5] == [(day(6), day(7)), (day(10), day(12)), (day(15), day(15))]
+
+    assert cache.query(engine.wsd, '000001.SZ', 'close', day(7), day(14)).Data == [direct.Data[0][1:7]]
+    stats = cache.stats()
+    assert stats['hits'] == 1
+    assert stats['appends'] == 3
+    assert stats['rewrites'] == 2
+
+
+def test_no_data_segment_keeps_cached_part(cache):
+    engine = Engine()
+    cached = cache.query(engine.wsd, '000001.SZ', 'close', day(6), day(10))
+    # 1 月 4、5 日为周末
+    res = cache.query(engine.wsd, '000001.SZ', 'close', day(4), day(10))
+    assert res.ErrorCode == 0
+    assert res.Data == cached.Data
+    assert cache.query(engine.wsd, '000001.SZ', 'close', day(4), day(10)).Data == cached.Data
+    assert len(engine.segments) == 2
+
+
+def test_no_data_without_cache_returns_engine_answer(cache):
+    assert cache.query(Engine().wsd, '000001.SZ', 'close', day(4), day(5)).ErrorCode == WSD_NO_DATA
+
+
+def test_non_daily_options_bypass_cache(cache):
+    engine = Engine()
+    for options in ('Period=W', 'Days=Alldays;Fill=Previous'):
+        cache.query(engine.wsd, '000001.SZ', 'close', day(6), day(10), options)
+        cache.query(engine.wsd, '000001.SZ', 'close', day(6), day(10), options)
+    assert len(engine.segments) == 4
+    assert cache.stats()['series'] == 0
+
+
+def test_survives_restart(tmp_path):
+    engine = Engine()
+    cache = WSDDiskCache(str(tmp_path))
+    first = cache.query(engine.wsd, '000001.SZ,000002.SZ', 'close', day(6), day(10))
+    cache.close()
+
+    cache = WSDDiskCache(str(tmp_path))
+    try:
+        assert cache.query(engine.wsd, '000001.SZ,000002.SZ', 'close', day(6), day(10)).Data == first.Data
+        assert len(engine.segments) == 1
+        assert cache.stats()['series'] == 2
+    finally:
+        cache.close()
+
+
+def test_eviction(tmp_path):
+    engine = Engine()
+    cache = WSDDiskCache(str(tmp_path), max_bytes=2 * DiskSeries.ITEM_SIZE * 5)
+    try:
+        cache.query(engine.wsd, '000001.SZ', 'close', day(6), day(10))
+        cache.query(engine.wsd, '000002.SZ', 'close', day(6), day(10))
+        stats = cache.stats()
+        assert stats['series'] == 1
+        assert stats['evictions'] == 1
+        assert stats['bytes'] == 2 * DiskSeries.ITEM_SIZE * 5
+        cache.query(engine.wsd, '000001.SZ', 'close', day(6), day(10))
+        assert len(engine.segments) == 3
+    finally:
+        cache.close()
+
+
+def test_write_of_one_series_does_not_block_others(cache, monkeypatch):
+    engine, writing, release = Engine(), Event(), Event()
+    write = DiskSeries.write
+
+    def slow_write(series, rows, start, end):
+        if '000001.SZ' in series.path:
+            writing.set()
+            release.wait(5)
+        return write(series, rows, start, end)
+
+    monkeypatch.setattr(DiskSeries, 'write', slow_write)
+    thread = Thread(target=cache.query, args=(engine.wsd, '000001.SZ', 'close', day(6), day(10)))
+    thread.start()
+    try:
+        assert writing.wait(5) is True
+        start = time.perf_counter()
+        res = cache.query(engine.wsd, '000002.SZ', 'close', day(6), day(10))
+        assert time.perf_counter() - start < 1.0
+        assert len(res.Times) == 5
+        assert cache.stats()['series'] == 2
+    finally:
+        release.set()
+        thread.join(5)
+    assert cache.query(engine.wsd, '000001.SZ', 'close', day(6), day(10)).ErrorCode == 0
+    assert cache.stats()['hits'] == 1
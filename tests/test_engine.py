@@ -0,0 +1,125 @@
+# -*- encoding: UTF-8 -*-
+import socket
+import time
+
+import pytest
+
+from Socketer.ApplyWind import WindClient, WindServer
+from Socketer.Engine import EngineManager, EngineUnavailable
+from Socketer.Metrics import MetricsRegistry
+from Socketer.StubWind import StubWindEngine
+from Socketer.utils import get_logger
+
+
+def wait_until(predicate, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while predicate() is False:
+        assert time.monotonic() < deadline
+        time.sleep(0.005)
+
+
+class Factory(object):
+    """ 记录创建的引擎，fail 为真时创建失败 """
+
+    def __init__(self, fail: bool = False):
+        self.fail = fail
+        self.engines = list()
+
+    def __call__(self):
+        if self.fail is True:
+            raise ConnectionError('terminal not logged in')
+        engine = StubWindEngine()
+        self.engines.append(engine)
+        return engine
+
+
+def make_manager(factory, **kwargs):
+    kwargs.setdefault('health_interval', 0.02)
+    kwargs.setdefault('restart_delay', 0.01)
+    log = get_logger('EngineManager', log_level='critical')
+    return EngineManager(factory=factory, metrics=MetricsRegistry(), log=log, **kwargs)
+
+
+def test_get_waits_for_session():
+    factory, ready = Factory(), list()
+    manager = make_manager(factory, warmup=lambda engine: engine.wsd('000001.SZ', 'close', '20200106', '20200110'),
+                           on_ready=ready.append)
+    with pytest.raises(EngineUnavailable, match='not started'):
+        manager.get(0)
+    manager.start()
+    try:
+        engine = manager.get(5)
+        assert engine is factory.engines[0]
+        assert engine.calls == 1
+        assert ready == [engine]
+        assert manager.stats()['connects'] == 1
+    finally:
+        manager.stop()
+    assert factory.engines[0].isconnected() is False
+    with pytest.raises(EngineUnavailable):
+        manager.get(0)
+
+
+def test_lost_session_restarted():
+    factory, ready = Factory(), list()
+    manager = make_manager(factory, on_ready=ready.append)
+    manager.start()
+    try:
+        manager.get(5).stop()
+        wait_until(lambda: len(ready) == 2)
+        assert manager.get(5) is factory.engines[1]
+        stats = manager.stats()
+        assert stats['restarts'] == 1
+        assert stats['connects'] == 2
+    finally:
+        manager.stop()
+
+
+def test_failed_connection_retried():
+    factory = Factory(fail=True)
+    manager = make_manager(factory)
+    manager.start()
+    try:
+        with pytest.raises(EngineUnavailable, match='terminal not logged in'):
+            manager.get(0.1)
+        assert manager.stats()['failures'] > 0
+        factory.fail = False
+        assert manager.get(5) is factory.engines[0]
+    finally:
+        manager.stop()
+
+
+def test_lazy_and_failed_warmup():
+    def warmup(engine):
+        raise RuntimeError('warmup failed')
+
+    factory = Factory()
+    manager = make_manager(factory, lazy=True, warmup=warmup)
+    manager.start()
+    try:
+        time.sleep(0.05)
+        assert factory.engines == list()
+        assert manager.is_ready() is False
+        # 预热失败不影响使用
+        assert manager.get(5) is factory.engines[0]
+    finally:
+        manager.stop()
+
+
+def test_server_answers_while_engine_unavailable(free_port):
+    factory = Factory(fail=True)
+    server = WindServer(port=free_port, engine_factory=factory, engine_timeout=0.2, engine_warmup=False, cache=False,
+                        log_level='critical')
+    server.start()
+    client = WindClient(socket.gethostname(), port=free_port, log_level='error')
+    client.start()
+    try:
+        assert client.server_ready(5) is False
+        with pytest.raises(RuntimeError, match='server engine error'):
+            client.wsd_async('000001.SZ', 'close', '20200106', '20200110').result(5)
+        factory.fail = False
+        wait_until(lambda: client.server_ready(5) is True)
+        assert client.wsd('000001.SZ', 'close', '20200106', '20200110').ErrorCode == 0
+    finally:
+        client.stop()
+        server.stop()
@@ -0,0 +1,77 @@
+# -*- encoding: UTF-8 -*-
+import pytest
+
+from threading import Thread
+
+from Socketer.Framing import FrameConstants, FrameError, FrameReader, pack_frame, send_frame
+
+
+def read_frames(reader: FrameReader, count: int):
+    frames = list()
+    while len(frames) < count:
+        received = reader.feed()
+        assert received is not None
+        frames.extend(received)
+    return frames
+
+
+def test_frames_in_one_read(sock_pair):
+    left, right = sock_pair
+    left.sendall(pack_frame(b'first') + pack_frame(b'\x00\x01', FrameConstants.FLAG_BINARY) + pack_frame(b''))
+    frames = read_frames(FrameReader(right), 3)
+    assert frames == [(FrameConstants.FLAG_TEXT, b'first'), (FrameConstants.FLAG_BINARY, b'\x00\x01'),
+                      (FrameConstants.FLAG_TEXT, b'')]
+
+
+def test_frame_split_across_reads(sock_pair):
+    left, right = sock_pair
+    reader = FrameReader(right)
+    data = pack_frame(b'split payload')
+    left.sendall(data[:3])
+    assert reader.feed() == []
+    left.sendall(data[3:8])
+    assert reader.feed() == []
+    left.sendall(data[8:])
+    assert reader.feed() == [(FrameConstants.FLAG_TEXT, b'split payload')]
+
+
+def test_frame_larger_than_buffer(sock_pair):
+    left, right = sock_pair
+    right.settimeout(5)
+    payload = bytes(range(256)) * 1024
+    reader = FrameReader(right, bufsize=1024)
+    left.setblocking(False)
+    data, frames = pack_frame(payload) + pack_frame(b'next'), list()
+    while len(data) > 0 or len(frames) < 2:
+        if len(data) > 0:
+            try:
+                data = data[left.send(data):]
+            except BlockingIOError:
+                pass
+        frames.extend(reader.feed())
+    assert frames == [(FrameConstants.FLAG_TEXT, payload), (FrameConstants.FLAG_TEXT, b'next')]
+
+
+def test_send_frame_above_copy_threshold(sock_pair):
+    left, right = sock_pair
+    payload = b'x' * (FrameConstants.COPY_THRESHOLD + 1)
+    left.settimeout(5)
+    right.settimeout(5)
+    sender = Thread(target=send_frame, args=(left, payload, FrameConstants.FLAG_BINARY))
+    sender.start()
+    frames = read_frames(FrameReader(right), 1)
+    sender.join()
+    assert frames == [(FrameConstants.FLAG_BINARY, payload)]
+
+
+def test_oversized_frame_rejected(sock_pair):
+    left, right = sock_pair
+    left.sendall(FrameConstants.FRAME_HEADER.pack(FrameConstants.FLAG_TEXT, 1024))
+    with pytest.raises(FrameError):
+        FrameReader(right, max_frame_size=512).feed()
+
+
+def test_peer_closed(sock_pair):
+    left, right = sock_pair
+    left.close()
+    assert FrameReader(right).feed() is None
@@ -0,0 +1,67 @@
+# -*- encoding: UTF-8 -*-
+import logging
+
+import pytest
+
+from Socketer.utils import MessageLog, Truncated, flush_logs, get_logger
+
+
+class Records(logging.Handler):
+    def __init__(self):
+        super(Records, self).__init__(logging.DEBUG)
+        self.records = list()
+
+    def emit(self, record):
+        self.records.append(record.getMessage())
+
+
+def make_log(level=logging.DEBUG):
+    log, records = logging.Logger('test', level), Records()
+    log.addHandler(records)
+    return log, records
+
+
+def test_truncated():
+    assert str(Truncated('short')) == 'short'
+    assert str(Truncated('x' * 300, limit=4)) == 'xxxx... (300 in total)'
+    assert str(Truncated(b'\x00\x01\x02', limit=2)) == "b'\\x00\\x01'... (3 in total)"
+
+
+def test_message_log_samples_and_truncates():
+    log, records = make_log()
+    msg_log = MessageLog(log, sample=3, limit=5)
+    for i in range(7):
+        msg_log.debug('message %s from %s', i, 'payload {}'.format(i))
+    assert records.records == ['message 0 from paylo... (9 in total)', 'message 3 from paylo... (9 in total)',
+                               'message 6 from paylo... (9 in total)']
+    with pytest.raises(ValueError):
+        MessageLog(log, sample=0)
+
+
+def test_message_log_skips_payload_without_debug():
+    class Payload(object):
+        def __getitem__(self, item):
+            raise AssertionError('payload touched')
+
+    log, records = make_log(logging.INFO)
+    MessageLog(log).debug('message from %s: %s', 'addr', Payload())
+    assert records.records == list()
+
+
+def test_async_logger_writes_file(tmp_path):
+    log_path = tmp_path / 'logs' / 'socketer.log'
+    log = get_logger('AsyncTest', log_path=str(log_path), log_level='debug')
+    for i in range(100):
+        log.debug('record %s', i)
+    log.warning('last record')
+    flush_logs()
+    lines = log_path.read_text().splitlines()
+    assert len(lines) == 101
+    assert lines[-1].endswith('WARNING, last record')
+
+
+def test_invalid_log_level():
+    with pytest.raises(ValueError):
+        get_logger('Invalid', log_level='verbose')
+    with pytest.raises(ValueError):
+        get_logger('Invalid', log_level=1.5)
@@ -0,0 +1,45 @@
+# -*- encoding: UTF-8 -*-
+from Socketer.Metrics import NULL_METRIC, MetricsRegistry
+
+
+def test_counter_gauge_labels():
+    metrics = MetricsRegistry()
+    metrics.counter('requests_total', 'Requests', func='wsd').inc()
+    metrics.counter('requests_total', 'Requests', func='wsd').inc(2)
+    metrics.counter('requests_total', 'Requests', func='ping').inc()
+    queue = [1, 2, 3]
+    metrics.gauge('queue_depth', 'Queued', func=lambda: len(queue))
+    queue.append(4)
+    snapshot = metrics.snapshot()
+    assert snapshot['requests_total{func="wsd"}'] == 3
+    assert snapshot['requests_total{func="ping"}'] == 1
+    assert snapshot['queue_depth'] == 4
+
+
+def test_histogram_buckets_and_quantile():
+    metrics = MetricsRegistry()
+    histogram = metrics.histogram('latency_seconds', 'Latency', buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.5, 5.0):
+        histogram.observe(value)
+    snapshot = metrics.snapshot()
+    assert snapshot['latency_seconds_bucket{le="0.1"}'] == 1
+    assert snapshot['latency_seconds_bucket{le="1.0"}'] == 3
+    assert snapshot['latency_seconds_bucket{le="+Inf"}'] == 4
+    assert snapshot['latency_seconds_count'] == 4
+    assert histogram.quantile(0.5) == 1.0
+    assert histogram.quantile(1.0) == float('inf')
+
+
+def test_prometheus_text():
+    metrics = MetricsRegistry()
+    metrics.counter('bytes_total', 'Bytes "sent"', peer='a"b').inc(10)
+    text = metrics.dump_prometheus()
+    assert '# HELP bytes_total Bytes "sent"\n# TYPE bytes_total counter\n' in text
+    assert 'bytes_total{peer="a\\"b"} 10\n' in text
+
+
+def test_disabled_registry_is_no_op():
+    metrics = MetricsRegistry(enabled=False)
+    assert metrics.counter('requests_total') is NULL_METRIC
+    metrics.histogram('latency_seconds').observe(1.0)
+    assert metrics.snapshot() == {}
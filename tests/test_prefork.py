@@ -0,0 +1,82 @@
+# -*- encoding: UTF-8 -*-
+import socket
+import time
+
+import pytest
+
+from Socketer.ApplyWind import WindClient, WindServer
+from Socketer.Prefork import AVERAGE_KEYS, PreforkServer, merge_stats
+from Socketer.StubWind import StubWindEngine
+from Socketer.cmd import socketer
+
+
+pytestmark = pytest.mark.skipif(not hasattr(socket, 'SO_REUSEPORT'), reason='SO_REUSEPORT not supported')
+
+
+def test_unix_transport_rejected():
+    with pytest.raises(ValueError, match='transport'):
+        PreforkServer(WindServer, workers=2, transport='unix')
+
+
+def test_cli_rejects_workers_with_unix_transport():
+    with pytest.raises(SystemExit, match='--transport=tcp'):
+        socketer(**{'--wind': True, '--workers': '2', '--transport': 'unix'}).get_command()
+
+
+def test_merge_stats():
+    assert 'utilization' in AVERAGE_KEYS
+    merged = merge_stats([{'requests': 2, 'pool': {'workers': 4}, 'engine': 'ready'},
+                          {'requests': 3, 'pool': {'workers': 4}, 'engine': 'ready'}, None])
+    assert merged == {'requests': 5, 'pool': {'workers': 8}, 'engine': 'ready'}
+
+
+def test_workers_serve_and_restart(free_port):
+    # spawn 启动的工作进程需要可序列化的参数，引擎工厂直接用 StubWindEngine 类
+    server = PreforkServer(WindServer, workers=2, restart_delay=0.1, port=free_port,
+                           engine_factory=StubWindEngine, engine_warmup=False, cache=False, log_level='critical')
+    server.start()
+    client = WindClient(socket.gethostname(), port=free_port, log_level='error')
+    client.start()
+    try:
+        assert client.wsd('000001.SZ', 'close', '20200106', '20200110', timeout=10).ErrorCode == 0
+        server.__process_list__[0].kill()
+        deadline = time.monotonic() + 30
+        while server.stats()['restarts'] == 0:
+            assert time.monotonic() < deadline
+            time.sleep(0.05)
+        stats = server.stats()
+        assert stats['alive'] == 2
+        assert stats['total']['pool']['workers'] == 8
+    finally:
+        client.stop()
+        started = time.monotonic()
+        server.stop()
+    assert time.monotonic() - started < 10
+    assert server.is_alive() is False
+
+
+def test_stop_while_restarts_fail(free_port):
+    server = PreforkServer(WindServer, workers=1, restart_delay=0.05, port=free_port,
+                           engine_factory=StubWindEngine, engine_warmup=False, cache=False, log_level='critical')
+    server.start()
+    failures, spawn = list(), server.__spawn__
+
+    def failing_spawn(index: int):
+        try:
+            spawn(index)
+        except RuntimeError as e:
+            failures.append(e)
+            raise
+
+    # 此后重启的工作进程均构造失败，监控线程不再有可等待的进程
+    server.__spawn__ = failing_spawn
+    server.__server_kwargs__['log_level'] = 'verbose'
+    server.__process_list__[0].kill()
+    deadline = time.monotonic() + 30
+    while len(failures) == 0:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    time.sleep(0.1)
+    server.stop()
+    assert server.is_alive() is False
+    assert server.stats()['restarts'] == 0
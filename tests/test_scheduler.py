@@ -0,0 +1,107 @@
+# -*- encoding: UTF-8 -*-
+import socket
+import time
+
+import pytest
+
+from Socketer.ApplyWind import WindClient, WindServer
+from Socketer.Scheduler import RateLimiter, Scheduler, TokenBucket
+from Socketer.StubWind import StubWindEngine
+
+
+def test_higher_lane_served_first():
+    pool, order = Scheduler(workers=1), list()
+    pool.submit('a', order.append, 'low', priority='low')
+    pool.submit('a', order.append, 'normal a')
+    pool.submit('b', order.append, 'normal b')
+    pool.submit('a', order.append, 'high', priority='high')
+    pool.start()
+    pool.stop()
+    assert order == ['high', 'normal a', 'normal b', 'low']
+    assert pool.stats()['lanes'] == {'high': 0, 'normal': 0, 'low': 0}
+
+
+def test_lanes_bounded_separately():
+    pool = Scheduler(workers=1, max_queue_size=1)
+    assert pool.submit('a', print, priority='low') is True
+    assert pool.submit('a', print, priority='low') is False
+    assert pool.submit('a', print, priority='high') is True
+    assert pool.stats()['rejected'] == 1
+    with pytest.raises(ValueError):
+        pool.submit('a', print, priority='urgent')
+
+
+def test_expired_task_not_run():
+    pool, done, expired = Scheduler(workers=1), list(), list()
+    pool.submit('a', done.append, 'late', deadline=time.perf_counter() - 1, on_expired=lambda: expired.append(1))
+    pool.submit('a', done.append, 'in time', deadline=time.perf_counter() + 60)
+    pool.start()
+    pool.stop()
+    assert done == ['in time']
+    assert expired == [1]
+    assert pool.stats()['expired'] == 1
+
+
+def test_token_bucket_refills():
+    bucket = TokenBucket(rate=100, burst=1)
+    assert bucket.take() is True
+    assert bucket.take() is False
+    time.sleep(0.02)
+    assert bucket.take() is True
+
+
+def test_rate_limiter_per_client():
+    assert all(RateLimiter().allow('a') for _ in range(1000))
+    with pytest.raises(ValueError):
+        RateLimiter(rate=1, burst=0.5)
+
+    limiter = RateLimiter(rate=0.001, burst=2)
+    assert limiter.allow('a') is True
+    assert limiter.allow('a') is True
+    assert limiter.allow('a') is False
+    assert limiter.allow('b', cost=2) is True
+    assert limiter.allow('c', cost=3) is False
+    limiter.forget('a')
+    assert limiter.allow('a') is True
+    assert limiter.stats()['limited'] == 2
+
+
+class SlowEngine(StubWindEngine):
+    def wsd(self, *args, **kwargs):
+        time.sleep(0.3)
+        return super(SlowEngine, self).wsd(*args, **kwargs)
+
+
+def run_server(port: int, **kwargs):
+    engine = SlowEngine()
+    server = WindServer(port=port, engine_factory=lambda: engine, engine_warmup=False, cache=False, coalesce=False,
+                        log_level='critical', **kwargs)
+    server.start()
+    client = WindClient(socket.gethostname(), port=port, log_level='error')
+    client.start()
+    return server, client
+
+
+def test_server_rate_limit(free_port):
+    server, client = run_server(free_port, rate_limit=0.001, rate_burst=1)
+    try:
+        assert client.wsd_async('000001.SZ', 'close', '20200106', '20200110').result(5).ErrorCode == 0
+        with pytest.raises(RuntimeError, match='rate limit'):
+            client.wsd_async('000001.SZ', 'close', '20200106', '20200110').result(5)
+    finally:
+        client.stop()
+        server.stop()
+
+
+def test_server_drops_expired_queries(free_port):
+    server, client = run_server(free_port, workers=1)
+    try:
+        running = client.wsd_async('000001.SZ', 'close', '20200106', '20200110')
+        queued = client.wsd_async('000002.SZ', 'close', '20200106', '20200110', timeout=0.1)
+        with pytest.raises(TimeoutError, match='expired'):
+            queued.result(5)
+        assert running.result(5).ErrorCode == 0
+        assert server.stats()['pool']['expired'] == 1
+    finally:
+        client.stop()
+        server.stop()
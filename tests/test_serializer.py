@@ -0,0 +1,89 @@
+# -*- encoding: UTF-8 -*-
+import datetime
+import socket
+
+import pytest
+
+from Socketer.ApplyWind import WindClient, WindServer
+from Socketer.Serializer import SERIALIZERS, TEXT, JsonSerializer, format_dates, loads, negotiate, offer, \
+    parse_dates, register
+from Socketer.StubWind import StubWindEngine
+
+
+START, END = datetime.date(2020, 1, 6), datetime.date(2020, 1, 17)
+
+
+def installed(name: str):
+    if name not in SERIALIZERS:
+        pytest.importorskip(name)
+    return SERIALIZERS[name]
+
+
+@pytest.mark.parametrize('name', ['json', 'orjson', 'msgpack'])
+def test_round_trip(name):
+    serializer = installed(name)
+    obj = {'id': 1, 'status': 0, 'Codes': ['000001.SZ'], 'Times': [START, datetime.datetime(2020, 1, 7, 15)],
+           'Data': [[1.5, None]], 'nested': {'wire': b'\x00\x01'} if serializer.binary else {}}
+    msg = serializer.dumps(obj)
+    assert isinstance(msg, bytes if serializer.binary else str)
+    res = loads(msg, serializer)
+    assert res['Times'] == ['20200106', '20200107']
+    assert res['Data'] == [[1.5, None]]
+    assert res['nested'] == obj['nested']
+    with pytest.raises(TypeError):
+        serializer.dumps({'value': object()})
+
+
+def test_text_frames_read_by_fastest_json():
+    assert loads(JsonSerializer().dumps({'a': [1, 2]})) == {'a': [1, 2]}
+    assert TEXT.name in ('orjson', 'json')
+
+
+def test_dates():
+    dates = [START, END, START]
+    assert parse_dates(format_dates(dates)) == dates
+    assert format_dates(['20200101']) == ['20200101']
+
+
+def test_offer_and_negotiate():
+    assert offer(True) == list(SERIALIZERS.keys())
+    assert offer(['cbor', 'json']) == ['json']
+    assert negotiate(['cbor']) == 'json'
+    assert negotiate(offer(True)) == list(SERIALIZERS.keys())[0]
+
+
+def test_register_first():
+    class Custom(JsonSerializer):
+        name = 'custom'
+
+    saved = list(SERIALIZERS.items())
+    try:
+        register(Custom(), first=True)
+        assert list(SERIALIZERS.keys())[0] == 'custom'
+        assert negotiate(['json', 'custom']) == 'json'
+    finally:
+        SERIALIZERS.clear()
+        SERIALIZERS.update(saved)
+
+
+@pytest.mark.parametrize('encoding', ['binary', 'json'])
+@pytest.mark.parametrize('name', ['json', 'orjson', 'msgpack'])
+def test_negotiated_serializer_end_to_end(name, encoding, free_port):
+    installed(name)
+    engine = StubWindEngine()
+    server = WindServer(port=free_port, engine_factory=lambda: engine, engine_warmup=False, cache=False,
+                        log_level='critical')
+    server.start()
+    client = WindClient(socket.gethostname(), port=free_port, encoding=encoding, serializer=[name], log_level='error')
+    client.start()
+    try:
+        res = client.wsd('000001.SZ,000002.SZ', 'close', START, END, timeout=5)
+        assert client.serializer.name == name
+        assert client.encoding == encoding
+        direct = StubWindEngine().wsd('000001.SZ,000002.SZ', 'close', START, END)
+        assert res.Codes == direct.Codes
+        assert res.Data == direct.Data
+        assert res.Times == [var.date() for var in direct.Times]
+    finally:
+        client.stop()
+        server.stop()
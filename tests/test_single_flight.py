@@ -0,0 +1,87 @@
+# -*- encoding: UTF-8 -*-
+import datetime
+import socket
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event
+
+import pytest
+
+from Socketer.ApplyWind import WindClient, WindServer
+from Socketer.Cache import SingleFlight
+from Socketer.Metrics import MetricsRegistry
+from Socketer.StubWind import StubWindEngine
+
+
+def run_concurrently(flight: SingleFlight, key, func, count: int = 5):
+    """ 首个调用进入 func 后再发起其余调用 """
+    started, release = Event(), Event()
+
+    def leader_func():
+        started.set()
+        release.wait(5)
+        return func()
+
+    with ThreadPoolExecutor(count) as pool:
+        futures = [pool.submit(flight.do, key, leader_func)]
+        assert started.wait(5) is True
+        futures.extend(pool.submit(flight.do, key, leader_func) for _ in range(count - 1))
+        while flight.stats()['saved'] < count - 1:
+            time.sleep(0.001)
+        release.set()
+        return futures
+
+
+def test_concurrent_calls_share_result():
+    counter = MetricsRegistry().counter('saved', 'Calls served by another')
+    flight, result = SingleFlight(saved_counter=counter), object()
+    futures = run_concurrently(flight, 'key', lambda: result)
+    assert all(var.result() is result for var in futures)
+    assert flight.stats() == {'in_flight': 0, 'calls': 1, 'saved': 4}
+    assert counter.value == 4
+
+
+def test_concurrent_calls_share_exception():
+    flight = SingleFlight()
+
+    def fail():
+        raise RuntimeError('engine down')
+
+    for future in run_concurrently(flight, 'key', fail):
+        with pytest.raises(RuntimeError, match='engine down'):
+            future.result()
+    # 失败的调用不留在 in flight 中，下一次调用重新执行
+    assert flight.do('key', lambda: 1) == 1
+    assert flight.stats()['calls'] == 2
+
+
+def test_sequential_and_distinct_calls_not_coalesced():
+    flight = SingleFlight()
+    assert [flight.do(var, lambda x: x * 2, var) for var in (1, 1, 2)] == [2, 2, 4]
+    assert flight.stats() == {'in_flight': 0, 'calls': 3, 'saved': 0}
+
+
+class SlowEngine(StubWindEngine):
+    def wsd(self, *args, **kwargs):
+        time.sleep(0.3)
+        return super(SlowEngine, self).wsd(*args, **kwargs)
+
+
+def test_identical_wsd_queries_call_engine_once(free_port):
+    engine = SlowEngine()
+    server = WindServer(port=free_port, engine_factory=lambda: engine, engine_warmup=False, cache=False,
+                        log_level='critical')
+    server.start()
+    client = WindClient(socket.gethostname(), port=free_port, log_level='error')
+    client.start()
+    try:
+        start, end = datetime.date(2020, 1, 1), datetime.date(2020, 1, 31)
+        futures = [client.wsd_async('000001.SZ', 'close', start, end) for _ in range(4)]
+        results = [var.result(5) for var in futures]
+        assert engine.calls == 1
+        assert all(var.Data == results[0].Data for var in results)
+        assert server.stats()['coalesce']['saved'] == 3
+    finally:
+        client.stop()
+        server.stop()
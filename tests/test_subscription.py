@@ -0,0 +1,132 @@
+# -*- encoding: UTF-8 -*-
+import json
+import socket
+import time
+
+import pytest
+
+from Socketer.ApplyWind import WindClient, WindServer
+from Socketer.Metrics import MetricsRegistry
+from Socketer.StubWind import StubWindEngine
+from Socketer.Subscription import SubscriptionHub, make_keys
+
+
+class Recorder(object):
+    """ 记录发给各订阅者的推送，backlog 由测试设置 """
+
+    def __init__(self):
+        self.sent = dict()
+        self.backlog = dict()
+        self.started = list()
+        self.cancelled = list()
+
+    def send(self, addr, msg):
+        self.sent.setdefault(addr, list()).append(json.loads(msg))
+
+    def engine_subscribe(self, code, field):
+        if code == 'BAD.SZ':
+            raise ValueError('unknown code')
+        self.started.append((code, field))
+        return code, field
+
+    def data(self, addr):
+        return [var['Data'] for var in self.sent.get(addr, ())]
+
+
+def wait_until(predicate, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while predicate() is False:
+        assert time.monotonic() < deadline
+        time.sleep(0.005)
+
+
+@pytest.fixture
+def hub():
+    recorder = Recorder()
+    hub = SubscriptionHub(recorder.send, recorder.engine_subscribe, recorder.cancelled.append,
+                          backlog=lambda addr: recorder.backlog.get(addr, 0), max_backlog=100, retry_interval=0.01,
+                          metrics=MetricsRegistry())
+    hub.recorder = recorder
+    hub.start()
+    yield hub
+    hub.stop()
+
+
+def test_make_keys():
+    assert make_keys('a.sz, b.sz', 'close,') == [('A.SZ', 'CLOSE'), ('B.SZ', 'CLOSE')]
+
+
+def test_engine_subscription_shared_by_subscribers(hub):
+    assert hub.subscribe('fast', 'A.SZ', 'close') == 1
+    assert hub.subscribe('slow', 'A.SZ,B.SZ', 'close') == 2
+    assert hub.recorder.started == [('A.SZ', 'CLOSE'), ('B.SZ', 'CLOSE')]
+    assert hub.unsubscribe('slow', 'A.SZ', 'close') == 1
+    assert hub.recorder.cancelled == list()
+    hub.unsubscribe('fast')
+    assert hub.recorder.cancelled == [('A.SZ', 'CLOSE')]
+    assert hub.stats()['keys'] == 1
+
+
+def test_failed_subscribe_rolls_back(hub):
+    with pytest.raises(ValueError):
+        hub.subscribe('fast', 'A.SZ,BAD.SZ', 'close')
+    assert hub.recorder.cancelled == [('A.SZ', 'CLOSE')]
+    assert hub.stats()['keys'] == 0
+
+
+def test_subscribers_share_serialized_message(hub):
+    hub.subscribe('first', 'A.SZ', 'close')
+    hub.subscribe('second', 'A.SZ', 'close')
+    hub.publish({('A.SZ', 'CLOSE'): 1.0, ('C.SZ', 'CLOSE'): 2.0})
+    wait_until(lambda: hub.stats()['pushes'] == 2)
+    assert hub.recorder.data('first') == hub.recorder.data('second') == [{'A.SZ': {'CLOSE': 1.0}}]
+    assert hub.stats()['serializations'] == 1
+
+
+def test_slow_subscriber_gets_latest_values_once(hub):
+    hub.subscribe('fast', 'A.SZ,B.SZ', 'close')
+    hub.subscribe('slow', 'A.SZ,B.SZ', 'close')
+    hub.recorder.backlog['slow'] = 1000
+    for i in range(10):
+        hub.publish({('A.SZ', 'CLOSE'): float(i)})
+        wait_until(lambda: hub.recorder.data('fast')[-1:] == [{'A.SZ': {'CLOSE': float(i)}}])
+    hub.publish({('B.SZ', 'CLOSE'): 20.0})
+    wait_until(lambda: hub.stats()['conflated'] > 0)
+    assert hub.recorder.data('slow') == list()
+
+    hub.recorder.backlog['slow'] = 0
+    wait_until(lambda: len(hub.recorder.data('slow')) > 0)
+    time.sleep(0.05)
+    assert hub.recorder.data('slow') == [{'A.SZ': {'CLOSE': 9.0}, 'B.SZ': {'CLOSE': 20.0}}]
+
+
+def test_new_subscriber_gets_known_values(hub):
+    hub.subscribe('first', 'A.SZ', 'close')
+    hub.publish({('A.SZ', 'CLOSE'): 1.0})
+    wait_until(lambda: len(hub.recorder.data('first')) == 1)
+    hub.subscribe('second', 'A.SZ', 'close')
+    wait_until(lambda: hub.recorder.data('second') == [{'A.SZ': {'CLOSE': 1.0}}])
+
+
+class FailingQuoteEngine(StubWindEngine):
+    def wsq(self, *args, **kwargs):
+        raise RuntimeError('quote service down')
+
+
+def test_engine_error_on_subscribe_answered(free_port):
+    server = WindServer(port=free_port, engine_factory=FailingQuoteEngine, engine_warmup=False, cache=False,
+                        log_level='critical')
+    server.start()
+    client = WindClient(socket.gethostname(), port=free_port, log_level='error')
+    client.start()
+    try:
+        with pytest.raises(RuntimeError, match='quote service down'):
+            client.subscribe('000001.SZ', 'rt_last', lambda data: None, timeout=5)
+        # 服务器继续处理其他请求
+        assert client.wsd('000001.SZ', 'close', '20200106', '20200110', timeout=5).ErrorCode == 0
+        assert client.unsubscribe(timeout=5) == 0
+        assert client.server_stats(timeout=5)['subscriptions']['keys'] == 0
+        assert 'wind_subscribed_keys' in client.server_metrics(timeout=5)
+    finally:
+        client.stop()
+        server.stop()
@@ -0,0 +1,85 @@
+# -*- encoding: UTF-8 -*-
+import json
+import socket
+
+import pytest
+
+from threading import Thread
+
+from Socketer.ApplyWind import WindClient
+from Socketer.Server import SocketServer, SocketMessage
+
+
+class ScriptedServer(object):
+    """ 回复 hello，其余请求收齐 count 个后倒序回复 {'ready': id} """
+
+    def __init__(self, port: int, count: int):
+        self.server = SocketServer(port=port, log_level='error')
+        self.count = count
+        self.thread = Thread(target=self.__run__)
+
+    def __run__(self):
+        held = list()
+        while True:
+            msg_obj = self.server.msg_in.get()
+            if msg_obj is None:
+                break
+            msg = json.loads(msg_obj.msg)
+            if msg['func'] == 'hello':
+                reply = {'id': msg['id'], 'status': 0, 'encoding': 'json', 'serializer': 'json'}
+                self.server.msg_out.put(SocketMessage(msg_obj.addr, json.dumps(reply)))
+                continue
+            held.append((msg_obj.addr, msg['id']))
+            if len(held) == self.count:
+                for addr, request_id in reversed(held):
+                    reply = {'id': request_id, 'status': 0, 'ready': request_id}
+                    self.server.msg_out.put(SocketMessage(addr, json.dumps(reply)))
+                held.clear()
+
+    def __enter__(self):
+        self.server.start()
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.stop()
+        self.server.msg_in.put(None)
+        self.thread.join()
+
+
+def test_responses_matched_by_id(free_port):
+    with ScriptedServer(free_port, count=5):
+        client = WindClient(socket.gethostname(), port=free_port, log_level='error')
+        client.start()
+        try:
+            futures = [client.__request__('ready', (), parser=lambda res: res['ready']) for i in range(5)]
+            request_ids = [var.result(5) for var in futures]
+        finally:
+            client.stop()
+    # hello 占用第一个 id，乱序返回的结果仍交给各自的 Future
+    assert request_ids == [2, 3, 4, 5, 6]
+
+
+def test_stop_fails_pending_requests(free_port):
+    with ScriptedServer(free_port, count=2):
+        client = WindClient(socket.gethostname(), port=free_port, log_level='error')
+        client.start()
+        future = client.__request__('ready', (), parser=lambda res: res['ready'])
+        client.stop()
+        with pytest.raises(ConnectionError):
+            future.result(5)
+
+
+def test_timed_out_request_forgotten(free_port):
+    with ScriptedServer(free_port, count=2):
+        client = WindClient(socket.gethostname(), port=free_port, log_level='critical')
+        client.start()
+        try:
+            with pytest.raises(TimeoutError):
+                client.wsd('000001.SZ', 'close', '20200106', '20200110', timeout=0.1)
+            assert len(client.__pending__) == 0
+            # 第二个请求触发两个回复，迟到的回复被丢弃而不是交给它
+            assert client.server_ready(5) == 3
+            assert len(client.__pending__) == 0
+        finally:
+            client.stop()
@@ -0,0 +1,93 @@
+# -*- encoding: UTF-8 -*-
+import datetime
+import socket
+
+import pytest
+
+from Socketer.ApplyWind import WindClient, WindServer
+from Socketer.StubWind import StubWindEngine
+
+
+START, END = datetime.date(2020, 1, 1), datetime.date(2020, 1, 31)
+
+
+@pytest.fixture
+def stub_engine():
+    return StubWindEngine()
+
+
+@pytest.fixture
+def stub_client(free_port, stub_engine):
+    """ 不缓存、不合并相同查询的服务器，引擎调用次数即请求所需的查询次数 """
+    server = WindServer(port=free_port, engine_factory=lambda: stub_engine, engine_warmup=False, cache=False,
+                        coalesce=False, log_level='critical')
+    server.start()
+    client = WindClient(socket.gethostname(), port=free_port, log_level='error')
+    client.start()
+    yield client
+    client.stop()
+    server.stop()
+
+
+class FailingEngine(StubWindEngine):
+    def wsd(self, *args, **kwargs):
+        raise RuntimeError('terminal disconnected')
+
+
+@pytest.fixture
+def failing_client(free_port):
+    server = WindServer(port=free_port, engine_factory=FailingEngine, engine_warmup=False, cache=False,
+                        log_level='critical')
+    server.start()
+    client = WindClient(socket.gethostname(), port=free_port, log_level='error')
+    client.start()
+    yield client
+    client.stop()
+    server.stop()
+
+
+def test_engine_exception_answered(failing_client):
+    future = failing_client.wsd_async('000001.SZ', 'close', START, END)
+    with pytest.raises(RuntimeError, match='terminal disconnected'):
+        future.result(5)
+
+
+def test_engine_exception_answered_in_batch(failing_client):
+    results = failing_client.wsd_batch([('000001.SZ', 'close', START, END), ('000002.SZ', 'close', START, END)],
+                                       timeout=5)
+    with pytest.raises(RuntimeError, match='terminal disconnected'):
+        next(results)
+
+
+def test_batch_merges_single_field_queries(stub_client, stub_engine):
+    codes = ['000001.SZ', '000002.SZ,000003.SZ', '000004.SZ']
+    queries = [(var, 'close', START, END) for var in codes] + [('000001.SZ', 'open', START, END)]
+    results = dict(stub_client.wsd_batch(queries))
+    # close 的三个请求合并为一次查询，open 单独查询
+    assert stub_engine.calls == 2
+    for i, (query_codes, fields, start, end) in enumerate(queries):
+        direct = StubWindEngine().wsd(query_codes, fields, start, end)
+        assert results[i].Codes == direct.Codes
+        assert results[i].Data == direct.Data
+        assert results[i].Times == [var.date() for var in direct.Times]
+
+
+def test_batch_invalid_query_answered(stub_client):
+    results = stub_client.wsd_batch([('000001.SZ', 'close')], timeout=5)
+    with pytest.raises(ValueError):
+        next(results)
+
+
+@pytest.mark.parametrize('by, size', [('code', 2), ('date', 7), ('code', 100)])
+def test_wsd_iter_blocks_join_to_full_result(stub_client, by, size):
+    codes = '000001.SZ,000002.SZ,000003.SZ,000004.SZ,000005.SZ'
+    full = stub_client.wsd(codes, 'close', START, END)
+    blocks = list(stub_client.wsd_iter(codes, 'close', START, END, by=by, size=size))
+    if by == 'code':
+        assert [len(var.Codes) for var in blocks] == [min(size, 5 - i) for i in range(0, 5, size)]
+        assert [x for var in blocks for x in var.Codes] == full.Codes
+        assert [x for var in blocks for x in var.Data] == full.Data
+    else:
+        assert all(len(var.Times) <= size for var in blocks)
+        assert [x for var in blocks for x in var.Times] == full.Times
+        assert [[x for var in blocks for x in var.Data[i]] for i in range(5)] == full.Data
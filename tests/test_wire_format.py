@@ -0,0 +1,62 @@
+# -*- encoding: UTF-8 -*-
+import datetime
+import math
+
+import pytest
+
+from Socketer import WireFormat
+from Socketer.WireFormat import decode_wsd, days_to_dates, encode_wsd
+
+
+TIMES = [datetime.date(2020, 1, 6), datetime.datetime(2020, 1, 7), datetime.date(2020, 1, 8)]
+DATES = [datetime.date(2020, 1, 6), datetime.date(2020, 1, 7), datetime.date(2020, 1, 8)]
+META = {'id': 3, 'status': 0, 'ErrorCode': 0, 'Codes': ['000001.SZ', '000002.SZ'], 'Fields': ['CLOSE']}
+
+
+def as_lists(times, data, n_times: int):
+    """ numpy / array 两种解码结果转为 (日期列表, 行列表) """
+    if WireFormat.numpy is not None:
+        return [var.item() for var in times], data.tolist()
+    values = data.tolist()
+    return days_to_dates(times), [values[i:i + n_times] for i in range(0, len(values), n_times)]
+
+
+@pytest.fixture(params=['numpy', 'array'])
+def backend(request, monkeypatch):
+    if request.param == 'numpy' and WireFormat.numpy is None:
+        pytest.skip('numpy is not installed')
+    if request.param == 'array':
+        monkeypatch.setattr(WireFormat, 'numpy', None)
+    return request.param
+
+
+def test_round_trip(backend):
+    data = [[1.5, 2.0, 3], [-1.0, 0.0, 1e300]]
+    meta, times, decoded = decode_wsd(encode_wsd(META, TIMES, data))
+    assert {k: meta[k] for k in META} == META
+    assert (meta['rows'], meta['times']) == (2, 3)
+    assert as_lists(times, decoded, 3) == (DATES, [[1.5, 2.0, 3.0], [-1.0, 0.0, 1e300]])
+
+
+def test_none_becomes_nan(backend):
+    meta, times, decoded = decode_wsd(encode_wsd(META, TIMES, [[1.0, None, 3.0]]))
+    values = as_lists(times, decoded, 3)[1][0]
+    assert values[0] == 1.0 and math.isnan(values[1]) and values[2] == 3.0
+
+
+def test_empty_result(backend):
+    meta, times, decoded = decode_wsd(encode_wsd(META, [], []))
+    assert (meta['rows'], meta['times']) == (0, 0)
+    assert len(times) == 0
+
+
+@pytest.mark.parametrize('data', [[['a', 'b', 'c']], [[1.0, 'n/a', 2.0]], [[1.0, 2.0]]])
+def test_not_encodable(data):
+    # 非数值及长度与日期不一致的结果以 json 发送
+    assert encode_wsd(META, TIMES, data) is None
+
+
+def test_meta_padded_to_eight_bytes():
+    for name in ('', 'a', 'ab', 'abc'):
+        payload = encode_wsd(dict(META, name=name), TIMES, [[1.0, 2.0, 3.0]])
+        assert (len(payload) - 8 * 3 - 8 * 3) % 8 == 0
@@ -0,0 +1,31 @@
+# -*- encoding: UTF-8 -*-
+from Socketer.WorkerPool import WorkerPool
+
+
+def test_clients_served_round_robin():
+    pool, order = WorkerPool(workers=1), list()
+    for i in range(3):
+        pool.submit('a', order.append, 'a{}'.format(i))
+    for i in range(2):
+        pool.submit('b', order.append, 'b{}'.format(i))
+    pool.start()
+    pool.stop()
+    assert order == ['a0', 'b0', 'a1', 'b1', 'a2']
+
+
+def test_full_queue_rejects():
+    pool = WorkerPool(workers=1, max_queue_size=2)
+    assert pool.submit('a', print) is True
+    assert pool.submit('b', print) is True
+    assert pool.submit('c', print) is False
+    assert pool.stats()['rejected'] == 1
+
+
+def test_failed_task_does_not_stop_worker():
+    pool, done = WorkerPool(workers=1), list()
+    pool.submit('a', lambda: 1 / 0)
+    pool.submit('a', done.append, 1)
+    pool.start()
+    pool.stop()
+    assert done == [1]
+    assert pool.stats()['completed'] == 2
@@ -0,0 +1,112 @@
+# -*- encoding: UTF-8 -*-
+import socket
+import time
+
+import pytest
+
+from Socketer.Client import SocketClient
+from Socketer.Framing import FrameConstants, FrameReader, pack_frame
+from Socketer.Server import SocketServer, SocketMessage
+from Socketer.Writer import ClientWriter
+
+
+def make_writer(sock, closed: list, **kwargs):
+    return ClientWriter(sock, 'peer', closed.append, **kwargs)
+
+
+def read_payloads(sock, count: int):
+    sock.settimeout(5)
+    reader, frames = FrameReader(sock), list()
+    while len(frames) < count:
+        frames.extend(reader.feed())
+    return [payload for _, payload in frames]
+
+
+def test_invalid_policy(sock_pair):
+    with pytest.raises(ValueError):
+        make_writer(sock_pair[0], list(), policy='wait')
+
+
+def test_coalesce_small_frames(sock_pair):
+    left, right = sock_pair
+    writer = make_writer(left, list())
+    for i in range(10):
+        assert writer.put('msg {}'.format(i).encode()) is True
+    writer.start()
+    writer.close()
+    assert writer.writes == 1
+    assert read_payloads(right, 10) == ['msg {}'.format(i).encode() for i in range(10)]
+
+
+def test_drop_policy(sock_pair):
+    writer = make_writer(sock_pair[0], list(), max_queue_size=2, policy='drop')
+    assert writer.put(b'a') is True
+    assert writer.put(b'b') is True
+    assert writer.put(b'c') is False
+    assert writer.dropped == 1
+    assert writer.is_closed() is False
+    assert writer.qsize() == 2
+
+
+def test_disconnect_policy(sock_pair):
+    writer = make_writer(sock_pair[0], list(), max_queue_size=2, policy='disconnect')
+    writer.put(b'a')
+    writer.put(b'b')
+    assert writer.put(b'c') is False
+    assert writer.is_closed() is True
+    assert writer.put(b'd') is False
+
+
+def test_block_policy_never_waits(sock_pair):
+    writer = make_writer(sock_pair[0], list(), max_queue_size=2, policy='block', block_timeout=0.3)
+    start = time.perf_counter()
+    for _ in range(5):
+        assert writer.put(b'x') is True
+    assert time.perf_counter() - start < 0.1
+    assert writer.qsize() == 5
+
+    # 队列满后超过 block_timeout 仍未排空则关闭连接
+    time.sleep(0.4)
+    start = time.perf_counter()
+    assert writer.put(b'x') is False
+    assert time.perf_counter() - start < 0.1
+    assert writer.is_closed() is True
+
+
+def test_block_policy_resets_after_drain(sock_pair):
+    left, right = sock_pair
+    writer = make_writer(left, list(), max_queue_size=2, policy='block', block_timeout=0.3)
+    for _ in range(3):
+        writer.put(b'x')
+    writer.start()
+    assert read_payloads(right, 3) == [b'x'] * 3
+    time.sleep(0.4)
+    assert writer.put(b'x') is True
+    assert writer.is_closed() is False
+    writer.close()
+
+
+def test_slow_client_does_not_delay_others(free_port):
+    server = SocketServer(port=free_port, log_level='error', out_queue_size=4,
+                          slow_client_policy='block', slow_client_timeout=5.0)
+    server.start()
+    slow = socket.create_connection((socket.gethostname(), free_port))
+    fast = SocketClient(socket.gethostname(), port=free_port, log_level='error')
+    fast.start()
+    try:
+        slow.sendall(pack_frame(b'slow', FrameConstants.FLAG_TEXT))
+        slow_addr = server.msg_in.get(timeout=5).addr
+        # 慢连接不读取，其发送缓冲区与队列都被填满
+        for _ in range(64):
+            server.msg_out.put(SocketMessage(slow_addr, b'\x00' * (1024 * 1024)))
+
+        fast.msg_out.put('fast')
+        received = server.msg_in.get(timeout=5)
+        start = time.perf_counter()
+        server.msg_out.put(SocketMessage(received.addr, received.msg))
+        assert fast.msg_in.get(timeout=5) == 'fast'
+        assert time.perf_counter() - start < 1.0
+    finally:
+        fast.stop()
+        slow.close()
+        server.stop()
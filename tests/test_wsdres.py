@@ -0,0 +1,60 @@
+# -*- encoding: UTF-8 -*-
+import datetime
+import json
+import math
+
+import pytest
+
+from Socketer import WireFormat
+from Socketer.ApplyWind import WSDRes
+from Socketer.WireFormat import decode_wsd, encode_wsd
+
+
+RESPONSE = {
+    'ErrorCode': 0, 'Codes': ['000001.SZ', '000002.SZ'], 'Fields': ['CLOSE'],
+    'Times': ['20200106', '20200107', '20200108'], 'Data': [[1.0, 2.0, 3.0], [4.0, 5.5, 6.0]],
+}
+DATES = [datetime.date(2020, 1, 6), datetime.date(2020, 1, 7), datetime.date(2020, 1, 8)]
+
+
+def from_binary():
+    meta, times, data = decode_wsd(encode_wsd(
+        {k: RESPONSE[k] for k in ('ErrorCode', 'Codes', 'Fields')}, DATES, RESPONSE['Data']))
+    return WSDRes.from_binary(meta, times, data)
+
+
+@pytest.fixture(params=['json', 'binary', 'binary without numpy'])
+def res(request, monkeypatch):
+    if request.param == 'json':
+        return WSDRes(json.loads(json.dumps(RESPONSE)))
+    if request.param == 'binary without numpy':
+        monkeypatch.setattr(WireFormat, 'numpy', None)
+        monkeypatch.setattr('Socketer.ApplyWind.numpy', None)
+    return from_binary()
+
+
+def test_data_and_times_are_lists(res):
+    assert res.Data == RESPONSE['Data']
+    assert all(type(var) is list for var in res.Data)
+    assert res.Times == DATES
+    assert json.loads(json.dumps(res.Data)) == RESPONSE['Data']
+
+
+def test_null_values_become_nan():
+    res = WSDRes(dict(RESPONSE, Data=[[1.0, None, 3.0]], Codes=['000001.SZ']))
+    assert res.Data[0][0] == 1.0 and math.isnan(res.Data[0][1])
+
+
+def test_text_values_kept():
+    res = WSDRes(dict(RESPONSE, Data=[['a', 'b', None]], Codes=['000001.SZ']))
+    assert res.Data == [['a', 'b', None]]
+
+
+def test_to_numpy_shares_buffer():
+    numpy = pytest.importorskip('numpy')
+    res = WSDRes(RESPONSE)
+    array = res.to_numpy()
+    assert array.shape == (2, 3)
+    assert numpy.shares_memory(array, res.data_array)
+    assert res.times_array.tolist() == DATES
+    assert from_binary().to_numpy().tolist() == RESPONSE['Data']